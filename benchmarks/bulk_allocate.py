@@ -0,0 +1,56 @@
+"""
+Per-line cost of POST /allocate versus POST /allocate/bulk, in-process through the ASGI app.
+
+    python -m benchmarks.bulk_allocate --lines 1000 --skus 10 --db-uri sqlite:////tmp/bench.db
+"""
+
+import argparse
+import time
+
+from fastapi.testclient import TestClient
+
+from allocation.entrypoints import main as api
+from allocation.service_layer.unit_of_work import SqlAlchemyUnitOfWork
+from benchmarks.utils import make_session_factory, print_table
+
+
+def seed(client: TestClient, prefix: str, skus: int, lines: int):
+    for i in range(skus):
+        client.post("/batches/", json={"reference": f"{prefix}-batch-{i}", "sku": f"{prefix}-{i}", "qty": lines * 10, "eta": None})
+    return [{"orderid": f"{prefix}-order-{n}", "sku": f"{prefix}-{n % skus}", "qty": 1} for n in range(lines)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-uri", default="", help="defaults to allocation.config.get_db_uri()")
+    parser.add_argument("--lines", type=int, default=500)
+    parser.add_argument("--skus", type=int, default=10)
+    args = parser.parse_args()
+
+    api.uow = SqlAlchemyUnitOfWork(session_factory=make_session_factory(args.db_uri))
+    client = TestClient(api.app)
+
+    lines = seed(client, "single", args.skus, args.lines)
+    started = time.perf_counter()
+    for line in lines:
+        assert client.post("/allocate", json=line).status_code == 201
+    single = time.perf_counter() - started
+
+    lines = seed(client, "bulk", args.skus, args.lines)
+    started = time.perf_counter()
+    response = client.post("/allocate/bulk", json=lines)
+    bulk = time.perf_counter() - started
+    assert response.status_code == 200
+    assert all(result["error"] is None for result in response.json()["results"])
+
+    print_table(
+        [
+            {"path": "/allocate", "lines": args.lines, "total_s": single, "per_line_ms": single / args.lines * 1000},
+            {"path": "/allocate/bulk", "lines": args.lines, "total_s": bulk, "per_line_ms": bulk / args.lines * 1000},
+        ]
+    )
+    print(f"speedup: {single / bulk:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Optimistic-concurrency contention benchmark.
+
+N threads allocate order lines on a single SKU through handlers.allocate, so every
+commit races on products.version_number. Reports retry rate and latency percentiles.
+
+    python -m benchmarks.contention --concurrency 1 4 16 --allocations 50
+"""
+
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from allocation.domain import events, exceptions
+from allocation.service_layer import handlers, retry
+from allocation.service_layer.unit_of_work import SqlAlchemyUnitOfWork
+from benchmarks.utils import make_session_factory, print_table, summarize
+
+SKU = "CONTENDED-SKU"
+
+
+def run(session_factory, concurrency: int, allocations: int) -> Dict:
+    uow_seed = SqlAlchemyUnitOfWork(session_factory=session_factory)
+    handlers.add_batch(events.BatchCreated(ref=f"batch-{concurrency}", sku=f"{SKU}-{concurrency}", qty=10**9, eta=None), uow=uow_seed)
+    retry.stats.reset()
+    barrier = threading.Barrier(concurrency)
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def worker(worker_id: int):
+        nonlocal errors
+        uow = SqlAlchemyUnitOfWork(session_factory=session_factory)
+        barrier.wait()
+        for i in range(allocations):
+            event = events.AllocationRequired(orderId=f"order-{worker_id}-{i}", sku=f"{SKU}-{concurrency}", qty=1)
+            started = time.perf_counter()
+            try:
+                handlers.allocate(event=event, uow=uow)
+            except exceptions.ConcurrencyError:
+                with lock:
+                    errors += 1
+                continue
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    wall = time.perf_counter() - started
+
+    total = concurrency * allocations
+    summary = summarize(latencies)
+    return {
+        "allocators": concurrency,
+        "requests": total,
+        "throughput_rps": total / wall,
+        "retries_per_request": retry.stats.retries / total,
+        "exhausted": errors,
+        "p50_ms": summary.get("p50_ms", 0.0),
+        "p99_ms": summary.get("p99_ms", 0.0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-uri", default="", help="defaults to allocation.config.get_db_uri()")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--allocations", type=int, default=50, help="allocations per allocator")
+    parser.add_argument("--attempts", type=int, default=None, help="override RETRY_ATTEMPTS")
+    args = parser.parse_args()
+
+    if args.attempts is not None:
+        policy = retry.RetryPolicy.from_config()
+        retry.set_policy(retry.RetryPolicy(attempts=args.attempts, base_delay=policy.base_delay, max_delay=policy.max_delay))
+    session_factory = make_session_factory(args.db_uri)
+    print_table([run(session_factory, concurrency, args.allocations) for concurrency in args.concurrency])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Micro-benchmarks for the domain model hot paths, without a database.
+
+Every case builds a Product with B batches and L allocated order lines (spread round-robin over
+the batches) and times Product.allocate, deallocate, change_batch_quantity, get_batch and
+Batch.available_quantity one call at a time. Order lines live in sets, so scan positions depend on
+string hashing: fix PYTHONHASHSEED when comparing runs.
+
+    PYTHONHASHSEED=0 python -m benchmarks.domain --batches 1 100 10000 --lines 0 1000 1000000 --json domain.json
+    PYTHONHASHSEED=0 python -m benchmarks.domain --compare domain.json --tolerance 0.25
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import sys
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+from allocation.domain.model import Batch, OrderLine, Product
+from benchmarks.utils import print_table, summarize
+
+SKU = "BENCH-SKU"
+OPERATIONS = ("allocate", "deallocate", "change_batch_quantity", "get_batch", "available_quantity")
+
+
+def build_product(batches: int, lines: int) -> Product:
+    first_eta = datetime.date(2026, 1, 1)
+    product = Product(
+        sku=SKU,
+        batches=[
+            Batch(ref=f"batch-{i}", sku=SKU, qty=lines + 10**9, eta=None if i == 0 else first_eta + datetime.timedelta(days=i % 365))
+            for i in range(batches)
+        ],
+    )
+    for n in range(lines):
+        product.batches[n % batches]._allocations.add(OrderLine(orderId=f"order-{n}", sku=SKU, qty=1))
+    return product
+
+
+def _steps(product: Product, operation: str) -> Iterator[Callable[[], object]]:
+    """Endless zero-argument calls of `operation`, each leaving the product as it found it."""
+    last = product.batches[-1]
+    if operation == "allocate":
+        n = 0
+        while True:
+            line = OrderLine(orderId=f"bench-{n}", sku=SKU, qty=1)
+            yield lambda: product.allocate(line)
+            product.batches[0]._allocations.discard(line)
+            n += 1
+    elif operation == "deallocate":
+        line = OrderLine(orderId="bench-deallocate", sku=SKU, qty=1)
+        while True:
+            # The line lives in the last batch, the worst case for the batch scan.
+            last._allocations.add(line)
+            yield lambda: product.deallocate(line)
+    elif operation == "change_batch_quantity":
+        quantity = last._purchase_quantity
+        while True:
+            yield lambda: product.change_batch_quantity(reference=last.reference, qty=quantity + 1)
+            yield lambda: product.change_batch_quantity(reference=last.reference, qty=quantity)
+    elif operation == "get_batch":
+        while True:
+            yield lambda: product.get_batch(reference=last.reference)
+    elif operation == "available_quantity":
+        busiest = product.batches[0]
+        while True:
+            yield lambda: busiest.available_quantity
+    else:
+        raise ValueError(f"Unknown operation {operation!r}")
+
+
+def measure(product: Product, operation: str, max_samples: int, max_seconds: float) -> List[float]:
+    samples: List[float] = []
+    deadline = time.perf_counter() + max_seconds
+    for step in _steps(product, operation):
+        started = time.perf_counter()
+        step()
+        samples.append(time.perf_counter() - started)
+        product.events.clear()
+        if len(samples) >= max_samples or (len(samples) >= 3 and time.perf_counter() > deadline):
+            break
+    return samples
+
+
+def run(batch_counts: List[int], line_counts: List[int], operations: List[str], max_samples: int, max_seconds: float) -> List[Dict]:
+    rows = []
+    for batches in batch_counts:
+        for lines in line_counts:
+            product = build_product(batches=batches, lines=lines)
+            for operation in operations:
+                summary = summarize(measure(product, operation, max_samples=max_samples, max_seconds=max_seconds))
+                rows.append({"operation": operation, "batches": batches, "lines": lines, **summary})
+    return rows
+
+
+def _key(row: Dict) -> tuple:
+    return row["operation"], row["batches"], row["lines"]
+
+
+def regressions(rows: List[Dict], baseline: List[Dict], tolerance: float) -> List[Dict]:
+    """Cases whose median got slower than the baseline's by more than `tolerance` (0.25 = 25%)."""
+    previous = {_key(row): row for row in baseline}
+    slower = []
+    for row in rows:
+        before = previous.get(_key(row))
+        if before and before["p50_ms"] > 0 and row["p50_ms"] > before["p50_ms"] * (1 + tolerance):
+            slower.append({**row, "baseline_p50_ms": before["p50_ms"], "ratio": row["p50_ms"] / before["p50_ms"]})
+    return slower
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batches", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--lines", type=int, nargs="+", default=[0, 1000, 100_000])
+    parser.add_argument("--operations", nargs="+", choices=OPERATIONS, default=list(OPERATIONS))
+    parser.add_argument("--samples", type=int, default=200, help="maximum timed calls per case")
+    parser.add_argument("--max-seconds", type=float, default=1.0, help="time budget per case (at least 3 calls are timed)")
+    parser.add_argument("--json", dest="json_path", help="write results to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run; exit 1 if any median regressed")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    rows = run(args.batches, args.lines, args.operations, max_samples=args.samples, max_seconds=args.max_seconds)
+    print_table(rows)
+
+    if args.json_path:
+        report = {
+            "benchmark": "domain",
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": rows,
+        }
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            slower = regressions(rows, json.load(f)["results"], tolerance=args.tolerance)
+        if slower:
+            print(f"\n{len(slower)} case(s) regressed by more than {args.tolerance:.0%}:", file=sys.stderr)
+            columns = ("operation", "batches", "lines", "baseline_p50_ms", "p50_ms", "ratio")
+            print_table([{key: row[key] for key in columns} for row in slower])
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Load and write latency of event-sourced products (PRODUCT_STORE=events) against the tables, as history grows.
+
+One SKU per store churns through allocations: every step allocates a new order line and deallocates the
+one from --live steps before, so the product always holds about --live lines while its history grows by
+two records per step. At each --history size (in steps) `load_ms` times loading the product in a fresh
+unit of work and `write_ms` times one allocation through the message bus, availability included.
+"events (no snapshots)" replays the whole stream on every load, which is what snapshots avoid.
+
+    python -m benchmarks.event_store --history 100 500 1500
+    python -m benchmarks.event_store --db-uri sqlite:////tmp/es.db --snapshot-every 50 --json es.json
+"""
+
+import argparse
+import json
+import sys
+import time
+from typing import Dict, List, Optional
+
+from allocation.domain import events
+from allocation.service_layer import handlers
+from allocation.service_layer.messagebus import MessageBus
+from allocation.service_layer.unit_of_work import EventSourcedUnitOfWork, SqlAlchemyUnitOfWork
+from benchmarks.utils import make_session_factory, print_table, summarize
+
+
+def grow(uow, sku: str, start: int, stop: int, live: int) -> None:
+    for step in range(start, stop):
+        MessageBus.handle(events.AllocationRequired(orderId=f"o-{step}", sku=sku, qty=1), uow=uow)
+        if step >= live:
+            handlers.deallocate(sku=sku, orderId=f"o-{step - live}", qty=1, uow=uow)
+            MessageBus.handle_new_events(uow=uow)
+
+
+def measure(uow, sku: str, step: int, live: int, samples: int) -> Dict:
+    loads, writes = [], []
+    for i in range(samples):
+        started = time.perf_counter()
+        with uow:
+            uow.products.get(sku)
+        loads.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        MessageBus.handle(events.AllocationRequired(orderId=f"sample-{step}-{i}", sku=sku, qty=1), uow=uow)
+        writes.append(time.perf_counter() - started)
+        # Keep the product at the same size for the next sample and history size.
+        handlers.deallocate(sku=sku, orderId=f"sample-{step}-{i}", qty=1, uow=uow)
+        MessageBus.handle_new_events(uow=uow)
+    return {"load_ms": summarize(loads)["p50_ms"], "write_ms": summarize(writes)["p50_ms"]}
+
+
+def run(db_uri: str, history: List[int], live: int, samples: int, snapshot_every: int) -> List[Dict]:
+    session_factory = make_session_factory(db_uri)
+    stores = {
+        "tables": SqlAlchemyUnitOfWork(session_factory=session_factory),
+        "events": EventSourcedUnitOfWork(session_factory=session_factory, snapshot_every=snapshot_every),
+        "events (no snapshots)": EventSourcedUnitOfWork(session_factory=session_factory, snapshot_every=sys.maxsize),
+    }
+    rows = []
+    for i, (store, uow) in enumerate(stores.items()):
+        sku = f"ES-BENCH-{i}"
+        MessageBus.handle(events.BatchCreated(ref=f"batch-{sku}", sku=sku, qty=10**9, eta=None), uow=uow)
+        done = 0
+        for steps in sorted(history):
+            grow(uow, sku, done, steps, live)
+            done = steps
+            rows.append({"store": store, "history": steps, **measure(uow, sku, steps, live, samples)})
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-uri", default="", help="defaults to allocation.config.get_db_uri()")
+    parser.add_argument("--history", type=int, nargs="+", default=[100, 500, 1500], help="allocate/deallocate steps")
+    parser.add_argument("--live", type=int, default=50, help="order lines the product holds at any time")
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--snapshot-every", type=int, default=100)
+    parser.add_argument("--json", dest="json_path", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    rows = run(args.db_uri, args.history, args.live, args.samples, args.snapshot_every)
+    print_table(rows)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"benchmark": "event_store", "args": vars(args), "results": rows}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""
+End-to-end load test: httpx (asyncio) -> FastAPI -> MessageBus -> SqlAlchemyUnitOfWork -> database.
+
+By default the app runs in-process (ASGI transport) against --db-uri, so handler retries can be
+reported too. Point --url at a running server (e.g. `uvicorn allocation.entrypoints.main:app`)
+to include the HTTP server in the measurement.
+
+    python -m benchmarks.loadtest --db-uri sqlite:////tmp/load.db --users 16 --requests 2000
+    python -m benchmarks.loadtest --url http://localhost:8000 --mix allocate=60,deallocate=20,get=15,batches=5 \\
+        --skus 50 --hot-skus 1 --hot-share 0.8
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.utils import print_table, summarize
+
+OPERATIONS = ("allocate", "deallocate", "get", "batches")
+BATCH_QTY = 10**9
+
+
+def parse_mix(raw: str) -> Dict[str, float]:
+    mix = {}
+    for item in filter(None, (part.strip() for part in raw.split(","))):
+        operation, _, weight = item.partition("=")
+        if operation not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {operation!r}, expected one of {OPERATIONS}")
+        mix[operation] = float(weight)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("the mix needs at least one operation with a positive weight")
+    return mix
+
+
+@dataclass
+class Workload:
+    skus: List[str]
+    hot_skus: int
+    hot_share: float
+    rng: random.Random
+    batches: Dict[str, List[str]] = field(default_factory=dict)
+    allocated: List[Tuple[str, str]] = field(default_factory=list)
+    counter: int = 0
+
+    def pick_sku(self) -> str:
+        """`hot_share` of the traffic goes to the first `hot_skus` SKUs, the rest is spread uniformly."""
+        if self.hot_skus and self.rng.random() < self.hot_share:
+            return self.rng.choice(self.skus[: self.hot_skus])
+        return self.rng.choice(self.skus)
+
+    def next_id(self, prefix: str) -> str:
+        self.counter += 1
+        return f"{prefix}-{self.counter}"
+
+
+@dataclass
+class Results:
+    latencies: Dict[str, List[float]] = field(default_factory=lambda: {operation: [] for operation in OPERATIONS})
+    errors: Dict[str, Dict[int, int]] = field(default_factory=lambda: {operation: {} for operation in OPERATIONS})
+
+    def record(self, operation: str, elapsed: float, status_code: int) -> None:
+        self.latencies[operation].append(elapsed)
+        if status_code >= 400:
+            self.errors[operation][status_code] = self.errors[operation].get(status_code, 0) + 1
+
+
+async def seed(client: httpx.AsyncClient, workload: Workload) -> None:
+    for sku in workload.skus:
+        ref = workload.next_id(f"load-batch-{sku}")
+        r = await client.post("/batches/", json={"reference": ref, "sku": sku, "qty": BATCH_QTY, "eta": None})
+        r.raise_for_status()
+        workload.batches[sku] = [ref]
+
+
+async def request(client: httpx.AsyncClient, workload: Workload, operation: str) -> Optional[httpx.Response]:
+    sku = workload.pick_sku()
+    if operation == "allocate":
+        orderid = workload.next_id("load-order")
+        r = await client.post("/allocate", json={"orderid": orderid, "sku": sku, "qty": 1})
+        if r.status_code == 201 and r.json()["batchref"]:
+            workload.allocated.append((orderid, sku))
+        return r
+    if operation == "deallocate":
+        if not workload.allocated:
+            return None
+        orderid, sku = workload.allocated.pop(workload.rng.randrange(len(workload.allocated)))
+        return await client.post("/deallocate", json={"orderid": orderid, "sku": sku, "qty": 1})
+    if operation == "get":
+        return await client.get(f"/batches/{workload.rng.choice(workload.batches[sku])}", params={"sku": sku})
+    ref = workload.next_id(f"load-batch-{sku}")
+    r = await client.post("/batches/", json={"reference": ref, "sku": sku, "qty": BATCH_QTY, "eta": None})
+    if r.status_code == 201:
+        workload.batches[sku].append(ref)
+    return r
+
+
+async def user(client: httpx.AsyncClient, workload: Workload, mix: Dict[str, float], remaining: List[int], results: Results):
+    operations, weights = zip(*mix.items())
+    while remaining[0] > 0:
+        remaining[0] -= 1
+        operation = workload.rng.choices(operations, weights)[0]
+        started = time.perf_counter()
+        try:
+            r = await request(client, workload, operation)
+        except httpx.HTTPError:
+            results.record(operation, time.perf_counter() - started, 599)
+            continue
+        if r is not None:
+            results.record(operation, time.perf_counter() - started, r.status_code)
+
+
+async def run(client: httpx.AsyncClient, args: argparse.Namespace) -> Tuple[Results, float]:
+    workload = Workload(
+        skus=[f"LOAD-{args.run_id}-{i}" for i in range(args.skus)],
+        hot_skus=args.hot_skus,
+        hot_share=args.hot_share,
+        rng=random.Random(args.seed),
+    )
+    await seed(client, workload)
+    results = Results()
+    remaining = [args.requests]
+    started = time.perf_counter()
+    await asyncio.gather(*(user(client, workload, args.mix, remaining, results) for _ in range(args.users)))
+    return results, time.perf_counter() - started
+
+
+def in_process_client(db_uri: str) -> httpx.AsyncClient:
+    from allocation.entrypoints import main as api
+    from allocation.service_layer.unit_of_work import SqlAlchemyUnitOfWork
+    from benchmarks.utils import make_session_factory
+
+    api.uow = SqlAlchemyUnitOfWork(session_factory=make_session_factory(db_uri))
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://loadtest")
+
+
+def report(results: Results, wall: float, retry_stats) -> List[Dict]:
+    rows = []
+    for operation in OPERATIONS:
+        latencies = results.latencies[operation]
+        if not latencies:
+            continue
+        errors = results.errors[operation]
+        rows.append(
+            {
+                "operation": operation,
+                **summarize(latencies),
+                "rps": len(latencies) / wall,
+                "errors": sum(errors.values()),
+                "by_status": ",".join(f"{status}:{count}" for status, count in sorted(errors.items())) or "-",
+            }
+        )
+    total = sum(len(latencies) for latencies in results.latencies.values())
+    all_latencies = [latency for latencies in results.latencies.values() for latency in latencies]
+    rows.append(
+        {
+            "operation": "total",
+            **summarize(all_latencies),
+            "rps": total / wall,
+            "errors": sum(sum(errors.values()) for errors in results.errors.values()),
+            "by_status": "-",
+        }
+    )
+    if retry_stats is not None:
+        for row in rows:
+            row["retries"] = retry_stats.retries if row["operation"] == "total" else ""
+            row["exhausted"] = retry_stats.exhausted if row["operation"] == "total" else ""
+    return rows
+
+
+async def main_async(args: argparse.Namespace) -> List[Dict]:
+    retry_stats = None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+    else:
+        from allocation.service_layer import retry
+
+        client = in_process_client(args.db_uri)
+        retry.stats.reset()
+        retry_stats = retry.stats
+    async with client:
+        results, wall = await run(client, args)
+    rows = report(results, wall, retry_stats)
+    print_table(rows)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", help="load a running server instead of the in-process app")
+    target.add_argument("--db-uri", default="", help="in-process database; defaults to allocation.config.get_db_uri()")
+    parser.add_argument("--users", type=int, default=16, help="concurrent virtual users")
+    parser.add_argument("--requests", type=int, default=2000, help="total requests across all users")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("allocate=60,deallocate=20,get=15,batches=5"))
+    parser.add_argument("--skus", type=int, default=20)
+    parser.add_argument("--hot-skus", type=int, default=0, help="number of hot SKUs (0 = uniform traffic)")
+    parser.add_argument("--hot-share", type=float, default=0.8, help="share of requests sent to the hot SKUs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--json", dest="json_path", help="write the report rows to this file")
+    args = parser.parse_args()
+    args.run_id = int(time.time())
+
+    rows = asyncio.run(main_async(args))
+    if args.json_path:
+        payload = {"benchmark": "loadtest", "args": {k: v for k, v in vars(args).items() if k != "json_path"}, "results": rows}
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
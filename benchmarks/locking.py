@@ -0,0 +1,108 @@
+"""
+Optimistic versioning versus pessimistic per-SKU locking and per-batch versioning.
+
+For every lock mode and contention level, THREADS allocators share THREADS / contention
+SKUs (contention = allocators per SKU). Meaningful only against Postgres: on SQLite the
+row/advisory modes fall back to optimistic versioning.
+
+With --large-share, every SKU gets a small early batch and a large later one, and that share
+of the allocators orders more than the early batch holds, so their lines land on the later
+batch: product versioning ("optimistic") makes them conflict with the small orders, per-batch
+versioning ("batch") does not.
+
+    python -m benchmarks.locking --threads 16 --contention 1 4 16
+    python -m benchmarks.locking --modes optimistic batch --contention 16 --large-share 0.5
+"""
+
+import argparse
+import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from allocation.adapters.repository import LOCK_MODES, LockPolicy
+from allocation.domain import events, exceptions
+from allocation.service_layer import handlers, retry
+from allocation.service_layer.unit_of_work import SqlAlchemyUnitOfWork
+from benchmarks.utils import make_session_factory, print_table, summarize
+
+
+def run(session_factory, mode: str, threads: int, contention: int, allocations: int, large_share: float = 0.0) -> Dict:
+    policy = LockPolicy(default=mode)
+    sku_count = max(1, threads // contention)
+    skus = [f"LOCK-{mode}-{contention}-{large_share}-{i}" for i in range(sku_count)]
+    # Room for every small (qty 1) line, but not for a single large one.
+    small_capacity = threads * allocations
+    seed_uow = SqlAlchemyUnitOfWork(session_factory=session_factory, lock_policy=policy)
+    for sku in skus:
+        if large_share:
+            handlers.add_batch(events.BatchCreated(ref=f"small-{sku}", sku=sku, qty=small_capacity, eta=None), uow=seed_uow)
+            later = datetime.date.today() + datetime.timedelta(days=30)
+            handlers.add_batch(events.BatchCreated(ref=f"batch-{sku}", sku=sku, qty=10**9, eta=later), uow=seed_uow)
+        else:
+            handlers.add_batch(events.BatchCreated(ref=f"batch-{sku}", sku=sku, qty=10**9, eta=None), uow=seed_uow)
+
+    retry.stats.reset()
+    barrier = threading.Barrier(threads)
+    latencies: List[float] = []
+    failures = 0
+    lock = threading.Lock()
+
+    def worker(worker_id: int):
+        nonlocal failures
+        uow = SqlAlchemyUnitOfWork(session_factory=session_factory, lock_policy=policy)
+        sku = skus[worker_id % sku_count]
+        # Spread large allocators evenly over the workers of each SKU.
+        qty = small_capacity + 1 if (worker_id // sku_count) % contention < round(contention * large_share) else 1
+        barrier.wait()
+        for i in range(allocations):
+            started = time.perf_counter()
+            try:
+                handlers.allocate(event=events.AllocationRequired(orderId=f"o-{worker_id}-{i}", sku=sku, qty=qty), uow=uow)
+            except exceptions.ConcurrencyError:
+                with lock:
+                    failures += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(worker, range(threads)))
+    wall = time.perf_counter() - started
+
+    summary = summarize(latencies)
+    return {
+        "mode": mode,
+        "allocators_per_sku": contention,
+        "large_share": large_share,
+        "throughput_rps": len(latencies) / wall,
+        "retries": retry.stats.retries,
+        "failed": failures,
+        "p50_ms": summary.get("p50_ms", 0.0),
+        "p99_ms": summary.get("p99_ms", 0.0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-uri", default="", help="defaults to allocation.config.get_db_uri()")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--contention", type=int, nargs="+", default=[1, 4, 16], help="allocators per SKU")
+    parser.add_argument("--allocations", type=int, default=50, help="allocations per thread")
+    parser.add_argument("--modes", nargs="+", default=list(LOCK_MODES), choices=LOCK_MODES)
+    parser.add_argument("--large-share", type=float, default=0.0, help="share of allocators whose lines skip the early batch")
+    args = parser.parse_args()
+
+    session_factory = make_session_factory(args.db_uri)
+    rows = [
+        run(session_factory, mode, args.threads, contention, args.allocations, large_share=args.large_share)
+        for contention in args.contention
+        for mode in args.modes
+    ]
+    print_table(rows)
+
+
+if __name__ == "__main__":
+    main()
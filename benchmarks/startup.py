@@ -0,0 +1,134 @@
+"""
+Import-time benchmark: how long `import <module>` takes in a fresh interpreter.
+
+Every run starts `python -X importtime -c "import <module>"` and sums the cumulative time of the
+top-level imports it reports, leaving out those that `python -c pass` makes too (site, encodings),
+so interpreter start-up itself is not counted. The median over --runs is reported per module. Use
+--budget to fail when a module gets slower than an absolute limit, or --compare to fail on
+regressions against an earlier --json run.
+
+    python -m benchmarks.startup --runs 10 --json startup.json
+    python -m benchmarks.startup --budget allocation.service_layer.unit_of_work=400 --compare startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from benchmarks.utils import print_table
+
+MODULES = (
+    "allocation.config",
+    "allocation.domain.model",
+    "allocation.adapters.orm",
+    "allocation.service_layer.unit_of_work",
+    "allocation.entrypoints.cli",
+    "allocation.entrypoints.main",
+)
+
+
+def parse_importtime(stderr: str, skip: FrozenSet[str] = frozenset()) -> Tuple[float, List[Tuple[str, float]]]:
+    """Total milliseconds spent in top-level imports, and the self time of every imported module."""
+    total_us = 0
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        if name.strip() in skip:
+            continue
+        modules.append((name.strip(), int(self_us) / 1000))
+        if not name[1:].startswith(" "):
+            total_us += int(cumulative_us)
+    return total_us / 1000, modules
+
+
+def _importtime(code: str) -> str:
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, ["src", os.environ.get("PYTHONPATH")]))}
+    return subprocess.run([sys.executable, "-X", "importtime", "-c", code], env=env, capture_output=True, text=True, check=True).stderr
+
+
+def interpreter_modules() -> FrozenSet[str]:
+    return frozenset(name for name, _ in parse_importtime(_importtime("pass"))[1])
+
+
+def measure(module: str, runs: int, skip: FrozenSet[str] = frozenset()) -> Dict:
+    totals = []
+    slowest: Dict[str, float] = {}
+    for _ in range(runs):
+        total, modules = parse_importtime(_importtime(f"import {module}"), skip=skip)
+        totals.append(total)
+        for name, self_ms in modules:
+            slowest[name] = min(self_ms, slowest.get(name, self_ms))
+    heaviest = sorted(slowest.items(), key=lambda item: item[1], reverse=True)[:3]
+    return {
+        "module": module,
+        "runs": runs,
+        "median_ms": statistics.median(totals),
+        "min_ms": min(totals),
+        "heaviest": ", ".join(f"{name} {self_ms:.1f}" for name, self_ms in heaviest),
+    }
+
+
+def parse_budget(raw: str) -> Tuple[str, float]:
+    module, _, limit = raw.partition("=")
+    try:
+        return module, float(limit)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected MODULE=MILLISECONDS, got {raw!r}")
+
+
+def over_budget(rows: List[Dict], budgets: Dict[str, float]) -> List[Dict]:
+    over = [row for row in rows if row["median_ms"] > budgets.get(row["module"], float("inf"))]
+    return [{**row, "budget_ms": budgets[row["module"]]} for row in over]
+
+
+def regressions(rows: List[Dict], baseline: List[Dict], tolerance: float) -> List[Dict]:
+    """Modules whose median import time grew by more than `tolerance` (0.25 = 25%) over the baseline's."""
+    previous = {row["module"]: row for row in baseline}
+    slower = []
+    for row in rows:
+        before = previous.get(row["module"])
+        if before and row["median_ms"] > before["median_ms"] * (1 + tolerance):
+            slower.append({**row, "baseline_ms": before["median_ms"], "ratio": row["median_ms"] / before["median_ms"]})
+    return slower
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=list(MODULES))
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per module")
+    parser.add_argument("--budget", type=parse_budget, action="append", default=[], help="MODULE=MILLISECONDS; exit 1 when exceeded")
+    parser.add_argument("--json", dest="json_path", help="write results to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run; exit 1 if any median regressed")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    skip = interpreter_modules()
+    rows = [measure(module, runs=args.runs, skip=skip) for module in args.modules]
+    print_table(rows)
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"benchmark": "startup", "python": sys.version.split()[0], "results": rows}, f, indent=2)
+
+    failed = over_budget(rows, dict(args.budget))
+    if failed:
+        print(f"\n{len(failed)} module(s) over their import budget:", file=sys.stderr)
+        print_table([{key: row[key] for key in ("module", "budget_ms", "median_ms")} for row in failed])
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            slower = regressions(rows, json.load(f)["results"], tolerance=args.tolerance)
+        if slower:
+            print(f"\n{len(slower)} module(s) regressed by more than {args.tolerance:.0%}:", file=sys.stderr)
+            print_table([{key: row[key] for key in ("module", "baseline_ms", "median_ms", "ratio")} for row in slower])
+            failed += slower
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+Per-call cost of the repository's hot lookups, built per call (as before) versus cached statements.
+
+Each case runs the same query both ways against the same rows: "adhoc" builds a new query or
+select() on every call, "cached" goes through the repository's lambda/prebuilt statements. On an
+in-memory SQLite database the difference is almost all Python-side statement construction and
+cache-key generation, which is what the cached statements save.
+
+    python -m benchmarks.statements --calls 5000
+    python -m benchmarks.statements --db-uri postgresql://... --calls 2000 --json statements.json
+"""
+
+import argparse
+import json
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import insert, select, update
+
+from allocation.adapters import orm
+from allocation.adapters.repository import SQLAlchemyAvailabilityRepository, SQLAlchemyRepository
+from allocation.domain.model import Batch, Product
+from benchmarks.utils import make_session_factory, print_table, summarize
+
+SKUS = [f"STATEMENTS-{i}" for i in range(100)]
+
+
+def seed(session) -> None:
+    for i, sku in enumerate(SKUS):
+        session.add(Product(sku=sku, batches=[Batch(ref=f"statements-batch-{i}", sku=sku, qty=100, eta=None)]))
+    session.commit()
+
+
+def adhoc_cases(session) -> Dict[str, Callable[[int], object]]:
+    def get(i):
+        return session.query(Product).filter_by(sku=SKUS[i % len(SKUS)]).first()
+
+    def get_by_batchref(i):
+        reference = f"statements-batch-{i % len(SKUS)}"
+        sku = session.execute(select(orm.batches.c.sku).where(orm.batches.c.reference == reference).limit(1)).scalar()
+        return session.query(Product).filter_by(sku=sku).first()
+
+    def get_version(i):
+        return session.execute(select(orm.products.c.version_number).where(orm.products.c.sku == SKUS[i % len(SKUS)])).scalar()
+
+    def adjust(i):
+        table = orm.availability
+        sku = SKUS[i % len(SKUS)]
+        result = session.execute(
+            update(table).where(table.c.sku == sku, table.c.eta.is_not_distinct_from(None)).values(qty=table.c.qty + 1)
+        )
+        if result.rowcount == 0:
+            session.execute(insert(table).values(sku=sku, eta=None, qty=1))
+
+    return {"get": get, "get_by_batchref": get_by_batchref, "get_version": get_version, "adjust_availability": adjust}
+
+
+def cached_cases(session) -> Dict[str, Callable[[int], object]]:
+    products = SQLAlchemyRepository(session)
+    availability = SQLAlchemyAvailabilityRepository(session)
+    return {
+        "get": lambda i: products.get(SKUS[i % len(SKUS)]),
+        "get_by_batchref": lambda i: products.get_by_batchref(f"statements-batch-{i % len(SKUS)}"),
+        "get_version": lambda i: products.get_version(SKUS[i % len(SKUS)]),
+        "adjust_availability": lambda i: availability.adjust(SKUS[i % len(SKUS)], None, 1),
+    }
+
+
+def measure(session, call: Callable[[int], object], calls: int) -> List[float]:
+    samples = []
+    for i in range(calls):
+        started = time.perf_counter()
+        call(i)
+        samples.append(time.perf_counter() - started)
+        # Keep the identity map from turning repeated gets into no-ops.
+        session.expunge_all()
+    session.rollback()
+    return samples
+
+
+def run(db_uri: str, calls: int) -> List[Dict]:
+    session = make_session_factory(db_uri)()
+    seed(session)
+    adhoc, cached = adhoc_cases(session), cached_cases(session)
+    rows: List[Dict[str, Any]] = []
+    for operation in adhoc:
+        for variant, cases in (("adhoc", adhoc), ("cached", cached)):
+            measure(session, cases[operation], min(calls, 200))  # warm up the compiled cache
+            rows.append({"operation": operation, "variant": variant, **summarize(measure(session, cases[operation], calls))})
+        adhoc_row, cached_row = rows[-2], rows[-1]
+        cached_row["saved_us"] = (adhoc_row["mean_ms"] - cached_row["mean_ms"]) * 1000
+        adhoc_row["saved_us"] = ""
+    session.close()
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-uri", default="sqlite://", help="defaults to an in-memory SQLite database")
+    parser.add_argument("--calls", type=int, default=5000, help="timed calls per operation and variant")
+    parser.add_argument("--json", dest="json_path", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    rows = run(args.db_uri, args.calls)
+    print_table(rows)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"benchmark": "statements", "args": vars(args), "results": rows}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
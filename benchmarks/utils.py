@@ -0,0 +1,73 @@
+import statistics
+from typing import Callable, Dict, List, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from allocation import config
+from allocation.adapters.orm import metadata, start_mappers
+from allocation.interfaces.main import ISession
+from allocation.service_layer.unit_of_work import make_engine
+
+TRUNCATE_TABLES = (
+    "allocations",
+    "order_lines",
+    "batches",
+    "products",
+    "archived_order_lines",
+    "archived_batches",
+    "product_events",
+    "product_snapshots",
+    "product_streams",
+)
+
+
+def percentile(samples: Sequence[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: Sequence[float]) -> Dict[str, float]:
+    """Latencies in seconds, summary in milliseconds."""
+    if not latencies:
+        return {"count": 0}
+    return {
+        "count": len(latencies),
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
+
+
+def make_session_factory(db_uri: str = "", **mapper_kwargs) -> Callable[[], ISession]:
+    """Fresh mappers plus a session factory on an emptied schema; Postgres by default."""
+    # Configured as the service configures it, e.g. SQLite in WAL mode.
+    engine = make_engine(db_uri or config.get_db_uri())
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        for table in TRUNCATE_TABLES:
+            conn.execute(text(f"DELETE FROM {table}"))
+    clear_mappers()
+    start_mappers(**mapper_kwargs)
+    return sessionmaker(bind=engine)
+
+
+def print_table(rows: List[Dict]) -> None:
+    if not rows:
+        return
+    headers = list(rows[0].keys())
+    widths = {h: max(len(h), *(len(_fmt(row.get(h))) for row in rows)) for h in headers}
+    print("  ".join(h.rjust(widths[h]) for h in headers))
+    for row in rows:
+        print("  ".join(_fmt(row.get(h)).rjust(widths[h]) for h in headers))
+
+
+def _fmt(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
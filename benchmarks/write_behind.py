@@ -0,0 +1,98 @@
+"""
+Allocation latency on the database path versus write-behind (WRITE_BEHIND_SKUS) for one hot SKU.
+
+THREADS allocators hammer the same SKU through the message bus, as the API does: "database" commits
+every allocation to the database, "write-behind" commits it to memory plus an fsync'd journal and
+leaves the database to the background writer. `drain_s` is how long the writer then needed to catch up.
+--no-fsync shows how much of the write-behind latency is the journal's fsync.
+
+    python -m benchmarks.write_behind --threads 8 --allocations 200
+    python -m benchmarks.write_behind --db-uri sqlite:////tmp/wb.db --journal /tmp/wb.journal --no-fsync
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from allocation.adapters.journal import Journal
+from allocation.domain import events, exceptions
+from allocation.interfaces.main import IUnitOfWork
+from allocation.service_layer.messagebus import MessageBus
+from allocation.service_layer.unit_of_work import SqlAlchemyUnitOfWork
+from allocation.service_layer.write_behind import WriteBehind
+from benchmarks.utils import make_session_factory, print_table, summarize
+
+
+def allocate_concurrently(uow: IUnitOfWork, sku: str, threads: int, allocations: int) -> Dict:
+    barrier = threading.Barrier(threads)
+    latencies: List[float] = []
+    failures = 0
+    lock = threading.Lock()
+
+    def worker(worker_id: int):
+        nonlocal failures
+        barrier.wait()
+        for i in range(allocations):
+            started = time.perf_counter()
+            try:
+                MessageBus.handle(events.AllocationRequired(orderId=f"o-{worker_id}-{i}", sku=sku, qty=1), uow=uow)
+            except exceptions.ConcurrencyError:
+                with lock:
+                    failures += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(worker, range(threads)))
+    wall = time.perf_counter() - started
+    return {"throughput_rps": len(latencies) / wall, "failed": failures, **summarize(latencies)}
+
+
+def run(db_uri: str, journal_path: str, threads: int, allocations: int, fsync: bool) -> List[Dict]:
+    database = SqlAlchemyUnitOfWork(session_factory=make_session_factory(db_uri))
+    for sku in ("WB-DATABASE", "WB-MEMORY"):
+        MessageBus.handle(events.BatchCreated(ref=f"batch-{sku}", sku=sku, qty=10**9, eta=None), uow=database)
+
+    rows = [{"path": "database", **allocate_concurrently(database, "WB-DATABASE", threads, allocations), "drain_s": 0.0}]
+
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
+    write_behind = WriteBehind(["WB-MEMORY"], journal=Journal(journal_path, fsync=fsync), uow=database)
+    write_behind.start()
+    path = "write-behind" if fsync else "write-behind (no fsync)"
+    row = {"path": path, **allocate_concurrently(write_behind.uow, "WB-MEMORY", threads, allocations)}
+    started = time.perf_counter()
+    write_behind.stop()
+    rows.append({**row, "drain_s": time.perf_counter() - started})
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-uri", default="", help="defaults to allocation.config.get_db_uri()")
+    parser.add_argument("--journal", default=os.path.join(tempfile.gettempdir(), "benchmark-write-behind.journal"))
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--allocations", type=int, default=200, help="allocations per thread")
+    parser.add_argument("--no-fsync", dest="fsync", action="store_false", help="do not fsync the journal on commit")
+    parser.add_argument("--json", dest="json_path", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    rows = run(args.db_uri, args.journal, args.threads, args.allocations, fsync=args.fsync)
+    columns = ("path", "throughput_rps", "failed", "p50_ms", "p95_ms", "p99_ms", "drain_s")
+    print_table([{column: row.get(column, 0.0) for column in columns} for row in rows])
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"benchmark": "write_behind", "args": vars(args), "results": rows}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+"""Added availability summary
+
+Revision ID: 3f9a1c2d7e51
+Revises: 80cbc4ac4346
+Create Date: 2026-10-19 10:12:41.518230
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3f9a1c2d7e51"
+down_revision: Union[str, Sequence[str], None] = "80cbc4ac4346"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "availability",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("sku", sa.String(length=255), nullable=False),
+        sa.Column("eta", sa.Date(), nullable=True),
+        sa.Column("qty", sa.Integer(), server_default="0", nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("sku", "eta", name="uq_availability_sku_eta", postgresql_nulls_not_distinct=True),
+    )
+    # Seed the summary from the current batches and allocations.
+    op.execute(
+        """
+        INSERT INTO availability (sku, eta, qty)
+        SELECT b.sku, b.eta, SUM(b._purchase_quantity - COALESCE(a.allocated, 0))
+        FROM batches AS b
+        LEFT JOIN (
+            SELECT al.batch_id, SUM(ol.qty) AS allocated
+            FROM allocations AS al JOIN order_lines AS ol ON ol.id = al.orderline_id
+            GROUP BY al.batch_id
+        ) AS a ON a.batch_id = b.id
+        GROUP BY b.sku, b.eta
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("availability")
@@ -0,0 +1,29 @@
+"""Added version to batches
+
+Revision ID: 5b3e0d9a7c21
+Revises: e29b7f4c1a85
+Create Date: 2026-10-19 16:02:51.604117
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5b3e0d9a7c21"
+down_revision: Union[str, Sequence[str], None] = "e29b7f4c1a85"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("batches", sa.Column("version_number", sa.Integer(), server_default="0", nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("batches", "version_number")
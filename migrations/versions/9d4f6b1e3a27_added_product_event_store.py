@@ -0,0 +1,54 @@
+"""Added product event store
+
+Revision ID: 9d4f6b1e3a27
+Revises: 5b3e0d9a7c21
+Create Date: 2026-10-19 18:42:10.517204
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9d4f6b1e3a27"
+down_revision: Union[str, Sequence[str], None] = "5b3e0d9a7c21"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "product_streams",
+        sa.Column("sku", sa.String(length=255), nullable=False),
+        sa.Column("version", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("sku"),
+    )
+    op.create_table(
+        "product_events",
+        sa.Column("sku", sa.String(length=255), nullable=False),
+        sa.Column("version", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("reference", sa.String(length=255), nullable=False),
+        sa.Column("record", sa.Text(), nullable=False),
+        sa.Column("recorded_at", sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint("sku", "version"),
+    )
+    op.create_index(op.f("ix_product_events_reference"), "product_events", ["reference"], unique=False)
+    op.create_table(
+        "product_snapshots",
+        sa.Column("sku", sa.String(length=255), nullable=False),
+        sa.Column("version", sa.Integer(), nullable=False),
+        sa.Column("state", sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint("sku"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("product_snapshots")
+    op.drop_index(op.f("ix_product_events_reference"), table_name="product_events")
+    op.drop_table("product_events")
+    op.drop_table("product_streams")
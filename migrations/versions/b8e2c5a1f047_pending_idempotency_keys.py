@@ -0,0 +1,33 @@
+"""Pending idempotency keys
+
+Revision ID: b8e2c5a1f047
+Revises: 9d4f6b1e3a27
+Create Date: 2026-10-19 21:05:43.118302
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b8e2c5a1f047"
+down_revision: Union[str, Sequence[str], None] = "9d4f6b1e3a27"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # A key is reserved before its request runs; status_code and response stay NULL until it completes.
+    op.alter_column("idempotency_keys", "status_code", existing_type=sa.Integer(), nullable=True)
+    op.alter_column("idempotency_keys", "response", existing_type=sa.Text(), nullable=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DELETE FROM idempotency_keys WHERE status_code IS NULL")
+    op.alter_column("idempotency_keys", "response", existing_type=sa.Text(), nullable=False)
+    op.alter_column("idempotency_keys", "status_code", existing_type=sa.Integer(), nullable=False)
@@ -0,0 +1,49 @@
+"""Unique order lines
+
+Revision ID: c4e8d2a6f913
+Revises: a71c52e9d0b4
+Create Date: 2026-10-19 14:21:05.377402
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c4e8d2a6f913"
+down_revision: Union[str, Sequence[str], None] = "a71c52e9d0b4"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # The same compaction as `python -m allocation.entrypoints.cli compact-order-lines`, so the constraint can be created:
+    # lines no batch holds any more, then every (orderId, sku) line but the oldest.
+    op.execute("DELETE FROM order_lines WHERE id NOT IN (SELECT orderline_id FROM allocations WHERE orderline_id IS NOT NULL)")
+    keep = 'SELECT MIN(id) FROM order_lines GROUP BY "orderId", sku'
+    op.execute(f"DELETE FROM allocations WHERE orderline_id NOT IN ({keep})")
+    op.execute(f"DELETE FROM order_lines WHERE id NOT IN ({keep})")
+    # Dropped duplicate allocations were counted in the availability summary; rebuild it.
+    op.execute("DELETE FROM availability")
+    op.execute(
+        """
+        INSERT INTO availability (sku, eta, qty)
+        SELECT b.sku, b.eta, SUM(b._purchase_quantity - COALESCE(a.allocated, 0))
+        FROM batches AS b
+        LEFT JOIN (
+            SELECT al.batch_id, SUM(ol.qty) AS allocated
+            FROM allocations AS al JOIN order_lines AS ol ON ol.id = al.orderline_id
+            GROUP BY al.batch_id
+        ) AS a ON a.batch_id = b.id
+        GROUP BY b.sku, b.eta
+        """
+    )
+    op.create_unique_constraint("uq_order_lines_order_sku", "order_lines", ["orderId", "sku"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint("uq_order_lines_order_sku", "order_lines", type_="unique")
@@ -0,0 +1,49 @@
+"""Archive surrogate keys
+
+Revision ID: d3a7f0c9b264
+Revises: b8e2c5a1f047
+Create Date: 2026-10-19 21:48:12.604917
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "d3a7f0c9b264"
+down_revision: Union[str, Sequence[str], None] = "b8e2c5a1f047"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ("archived_batches", "archived_order_lines")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing rows keep their ids, which were the original ones, so archived lines still point at their batches.
+    op.add_column("archived_batches", sa.Column("batch_id", sa.Integer(), nullable=True))
+    op.execute("UPDATE archived_batches SET batch_id = id")
+    op.alter_column("archived_batches", "batch_id", existing_type=sa.Integer(), nullable=False)
+    op.create_index(op.f("ix_archived_batches_batch_id"), "archived_batches", ["batch_id"], unique=False)
+    op.add_column("archived_order_lines", sa.Column("orderline_id", sa.Integer(), nullable=True))
+    op.execute("UPDATE archived_order_lines SET orderline_id = id")
+    op.alter_column("archived_order_lines", "orderline_id", existing_type=sa.Integer(), nullable=False)
+    op.create_index("ix_archived_order_lines_order_sku", "archived_order_lines", ["orderId", "sku"], unique=False)
+    for table in TABLES:
+        op.execute(f"CREATE SEQUENCE {table}_id_seq OWNED BY {table}.id")
+        op.execute(f"SELECT setval('{table}_id_seq', COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)")
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{table}_id_seq')")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in TABLES:
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN id DROP DEFAULT")
+        op.execute(f"DROP SEQUENCE {table}_id_seq")
+    op.drop_index("ix_archived_order_lines_order_sku", table_name="archived_order_lines")
+    op.drop_column("archived_order_lines", "orderline_id")
+    op.drop_index(op.f("ix_archived_batches_batch_id"), table_name="archived_batches")
+    op.drop_column("archived_batches", "batch_id")
@@ -0,0 +1,52 @@
+"""Added batch archive
+
+Revision ID: e29b7f4c1a85
+Revises: c4e8d2a6f913
+Create Date: 2026-10-19 15:06:44.120358
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e29b7f4c1a85"
+down_revision: Union[str, Sequence[str], None] = "c4e8d2a6f913"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "archived_batches",
+        sa.Column("id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("reference", sa.String(length=255), nullable=True),
+        sa.Column("sku", sa.String(length=255), nullable=False),
+        sa.Column("_purchase_quantity", sa.Integer(), nullable=False),
+        sa.Column("eta", sa.Date(), nullable=True),
+        sa.Column("archived_at", sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_archived_batches_sku_reference", "archived_batches", ["sku", "reference"], unique=False)
+    op.create_table(
+        "archived_order_lines",
+        sa.Column("id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("batch_id", sa.Integer(), nullable=False),
+        sa.Column("orderId", sa.String(length=255), nullable=True),
+        sa.Column("sku", sa.String(length=255), nullable=True),
+        sa.Column("qty", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_archived_order_lines_batch_id"), "archived_order_lines", ["batch_id"], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f("ix_archived_order_lines_batch_id"), table_name="archived_order_lines")
+    op.drop_table("archived_order_lines")
+    op.drop_index("ix_archived_batches_sku_reference", table_name="archived_batches")
+    op.drop_table("archived_batches")
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Collection, Optional, Set
+
+from allocation import config
+from allocation.domain import events
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop"
+DISCONNECT = "disconnect"
+OVERFLOW_POLICIES = (DROP_OLDEST, DISCONNECT)
+
+STREAMED_EVENTS = (
+    events.Allocated,
+    events.Deallocated,
+    events.OutOfStock,
+    events.BatchCreated,
+    events.BatchQuantityAdjusted,
+    events.BatchDeleted,
+)
+
+_CLOSED = object()
+
+
+class Subscription:
+    def __init__(self, broadcaster: "EventBroadcaster", skus: Optional[Set[str]], buffer_size: int, overflow: str):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow!r}, expected one of {OVERFLOW_POLICIES}")
+        self.broadcaster = broadcaster
+        self.skus = skus
+        self.overflow = overflow
+        self.dropped = 0
+        self.closed = False
+        self.queue: "asyncio.Queue" = asyncio.Queue(maxsize=buffer_size)
+
+    def wants(self, event: events.Event) -> bool:
+        return self.skus is None or getattr(event, "sku", None) in self.skus
+
+    def offer(self, event: events.Event) -> None:
+        """Called on the event loop; never blocks the publisher."""
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(event)
+            return
+        except asyncio.QueueFull:
+            pass
+        if self.overflow == DROP_OLDEST:
+            self.queue.get_nowait()
+            self.queue.put_nowait(event)
+            self.dropped += 1
+        else:
+            logger.info("Disconnecting event stream subscriber that fell %s events behind", self.queue.maxsize)
+            self.close()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.broadcaster.unsubscribe(self)
+        # Wake the consumer; anything still buffered is discarded with the subscription.
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(_CLOSED)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[events.Event]:
+        """Next event, or None when `timeout` expires first; raises StopAsyncIteration once closed."""
+        try:
+            item = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if item is _CLOSED:
+            raise StopAsyncIteration
+        return item
+
+    def __aiter__(self) -> AsyncIterator[events.Event]:
+        return self
+
+    async def __anext__(self) -> events.Event:
+        event = await self.get()
+        assert event is not None
+        return event
+
+
+class EventBroadcaster:
+    """
+    Fans committed domain events out to asyncio subscribers. publish() may be called from any
+    thread; each subscriber gets a bounded buffer, so a slow consumer only loses its own events.
+    """
+
+    def __init__(self, buffer_size: int = 1000, overflow: str = DROP_OLDEST):
+        self.buffer_size = buffer_size
+        self.overflow = overflow
+        self._subscriptions: Set[Subscription] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @classmethod
+    def from_config(cls) -> "EventBroadcaster":
+        return cls(buffer_size=config.get_event_stream_buffer_size(), overflow=config.get_event_stream_overflow())
+
+    def subscribe(
+        self, skus: Optional[Collection[str]] = None, buffer_size: Optional[int] = None, overflow: Optional[str] = None
+    ) -> Subscription:
+        """Must be called from the event loop that will consume the subscription."""
+        self._loop = asyncio.get_running_loop()
+        subscription = Subscription(
+            broadcaster=self,
+            skus=set(skus) if skus else None,
+            buffer_size=buffer_size or self.buffer_size,
+            overflow=overflow or self.overflow,
+        )
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscriptions.discard(subscription)
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscriptions)
+
+    def publish(self, event: events.Event) -> None:
+        if not isinstance(event, STREAMED_EVENTS) or not self._subscriptions or self._loop is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._fan_out, event)
+        except RuntimeError:
+            # The loop that owned the subscriptions has been closed.
+            self._loop = None
+
+    def _fan_out(self, event: events.Event) -> None:
+        for subscription in list(self._subscriptions):
+            if subscription.wants(event):
+                subscription.offer(event)
@@ -0,0 +1,275 @@
+import json
+import time
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.orm.exc import StaleDataError
+
+from allocation.adapters import ndjson, orm, timing
+from allocation.adapters.journal import RECORD_TYPES, apply_record, outcome_records
+from allocation.adapters.repository import IN_CHUNK_SIZE
+from allocation.domain import events, model
+from allocation.domain.exceptions import UnsupportedOperation
+from allocation.interfaces.main import IRepository, ISession
+
+_streams, _events, _snapshots = orm.product_streams, orm.product_events, orm.product_snapshots
+
+_STREAM_VERSION = select(_streams.c.version).where(_streams.c.sku == bindparam("sku"))
+_SKU_OF_BATCH = select(_events.c.sku).where(_events.c.reference == bindparam("reference")).order_by(_events.c.version.desc()).limit(1)
+_LAST_BATCH_RECORD = (
+    select(_events.c.record)
+    .where(_events.c.sku == bindparam("sku"), _events.c.reference == bindparam("reference"))
+    .order_by(_events.c.version.desc())
+    .limit(1)
+)
+# The expected-version check: an append only goes ahead if nobody appended since the stream was read.
+_ADVANCE_STREAM = (
+    update(_streams)
+    .where(_streams.c.sku == bindparam("b_sku"), _streams.c.version == bindparam("expected"))
+    .values(version=bindparam("version"))
+)
+_UPDATE_SNAPSHOT = (
+    update(_snapshots).where(_snapshots.c.sku == bindparam("b_sku")).values(version=bindparam("version"), state=bindparam("state"))
+)
+
+
+def encode_state(product: model.Product) -> str:
+    """The aggregate as a snapshot: its batches in order, each with the (orderId, qty) of the lines it holds."""
+    return json.dumps(
+        [
+            [
+                b.reference,
+                b._purchase_quantity,
+                b.eta.isoformat() if b.eta else None,
+                sorted([line.orderId, line.qty] for line in b._allocations),
+            ]
+            for b in product.batches
+        ]
+    )
+
+
+def decode_state(sku: str, state: str) -> model.Product:
+    batches = []
+    for reference, qty, eta, lines in json.loads(state):
+        batch = model.Batch(ref=reference, sku=sku, qty=qty, eta=date.fromisoformat(eta) if eta else None)
+        batch._allocations.update(model.OrderLine(orderId=order_id, sku=sku, qty=line_qty) for order_id, line_qty in lines)
+        batches.append(batch)
+    return model.Product(sku=sku, batches=batches)
+
+
+def _reference(record: events.Event) -> str:
+    return record.batchref if isinstance(record, (events.Allocated, events.Deallocated)) else record.ref  # type: ignore[attr-defined]
+
+
+@dataclass
+class _Stream:
+    """A loaded product and the stream version it was loaded at (or last appended up to)."""
+
+    product: model.Product
+    version: int
+    references: Set[str]
+    # product.events before this index are already in the stream.
+    appended_events: int = 0
+    new: bool = False
+
+
+class EventSourcedRepository(IRepository):
+    """
+    Products stored as append-only streams of outcome records (journal.RECORD_TYPES) instead of rows per batch
+    and line, so nothing is ever rewritten and the history of every allocation is kept. Loading reads the
+    latest snapshot and replays the records after it; save() appends what changed since the load in one
+    INSERT, behind a compare-and-set of the stream version, and snapshots every `snapshot_every` records.
+    Archiving and order line compaction concern the tables, not the streams.
+    """
+
+    def __init__(self, orm_session: ISession, snapshot_every: int = 100):
+        self.orm_session = orm_session
+        self.snapshot_every = snapshot_every
+        self.seen = set()
+        self.events: List[events.Event] = []
+        self._streams: Dict[str, _Stream] = {}
+
+    def add(self, product: model.Product):
+        self._streams[product.sku] = _Stream(product=product, version=0, references=set(), new=True)
+        self.seen.add(product)
+
+    def get(self, sku: str) -> Optional[model.Product]:
+        return next(iter(self.get_many([sku])), None)
+
+    def get_by_batchref(self, batchref: str) -> Optional[model.Product]:
+        # Batches added in this unit of work are not in the stream yet.
+        loaded = next((s.product for s in self._streams.values() if any(b.reference == batchref for b in s.product.batches)), None)
+        if loaded:
+            return loaded
+        with timing.phase("load"):
+            sku = self.orm_session.execute(_SKU_OF_BATCH, dict(reference=batchref)).scalar()
+        product = self.get(sku) if sku else None
+        if product and any(batch.reference == batchref for batch in product.batches):
+            return product
+        return None
+
+    def get_many(self, skus: Iterable[str]) -> List[model.Product]:
+        skus = sorted(set(skus))
+        products = [self._streams[sku].product for sku in skus if sku in self._streams]
+        for product, version in self._load([sku for sku in skus if sku not in self._streams]):
+            self._streams[product.sku] = _Stream(product=product, version=version, references={b.reference for b in product.batches})
+            products.append(product)
+        self.seen.update(products)
+        return sorted(products, key=lambda p: p.sku)
+
+    def get_version(self, sku: str) -> Optional[int]:
+        return self.orm_session.execute(_STREAM_VERSION, dict(sku=sku)).scalar()
+
+    def get_batch_version(self, sku: str, reference: str) -> Optional[Tuple[int, int]]:
+        last = self.orm_session.execute(_LAST_BATCH_RECORD, dict(sku=sku, reference=reference)).scalar()
+        if last is None or isinstance(ndjson.decode_event(last, types=RECORD_TYPES), events.BatchDeleted):
+            return None
+        # Every change moves the stream version; batches are not versioned on their own.
+        version = self.get_version(sku)
+        return (version, 0) if version is not None else None
+
+    def list(self) -> List[model.Product]:
+        return self.get_many(self.orm_session.execute(select(_streams.c.sku)).scalars())
+
+    def iter_all(self, batch_size: int = 500, read_only: bool = True) -> Iterator[model.Product]:
+        after = None
+        while True:
+            skus = [sku for sku, _ in self.page_products(after=after, limit=batch_size)]
+            if not skus:
+                return
+            if read_only:
+                yield from (product for product, _ in self._load(skus))
+            else:
+                yield from self.get_many(skus)
+            after = skus[-1]
+
+    def page_products(self, after: Optional[str], limit: int) -> List[Tuple[str, int]]:
+        query = select(_streams.c.sku, _streams.c.version).order_by(_streams.c.sku).limit(limit)
+        if after is not None:
+            query = query.where(_streams.c.sku > after)
+        return [(sku, version) for sku, version in self.orm_session.execute(query)]
+
+    def page_batches(self, sku: str, after: Optional[str], limit: int, archived: bool = False) -> List[dict]:
+        if archived:
+            # Event-sourced products keep every batch in their stream; nothing is archived.
+            return []
+        loaded = self._streams.get(sku)
+        product = loaded.product if loaded else next((product for product, _ in self._load([sku])), None)
+        candidates = product.batches if product else []
+        batches = sorted((b for b in candidates if after is None or b.reference > after), key=lambda b: b.reference)
+        return [
+            {"reference": b.reference, "sku": b.sku, "eta": b.eta, "qty": b._purchase_quantity, "allocated": b.allocated_quantity}
+            for b in batches[:limit]
+        ]
+
+    def archive_batches(self, before: date, limit: int) -> int:
+        raise UnsupportedOperation("Event-sourced products keep their history in the stream; archiving is for PRODUCT_STORE=tables")
+
+    def get_archived_allocations(self, order_ids: Iterable[str], skus: Iterable[str]) -> Dict[Tuple[str, str], str]:
+        # Every allocation stays in its product's stream, where Product.allocate finds it.
+        return {}
+
+    def compact_order_lines(self) -> Dict[str, int]:
+        raise UnsupportedOperation("Event-sourced products have no order line rows; compaction is for PRODUCT_STORE=tables")
+
+    def delete(self, sku: str):
+        self.delete_products([sku])
+
+    def delete_batches(self, references: Iterable[str], sku: Optional[str] = None) -> int:
+        deleted = 0
+        for reference in sorted(set(references)):
+            product = self.get_by_batchref(reference)
+            if product and (sku is None or product.sku == sku):
+                product.delete_batch(reference=reference)
+                deleted += 1
+        return deleted
+
+    def delete_products(self, skus: Iterable[str]) -> int:
+        """Delete products with their whole history; the lost allocations and batches still raise events."""
+        doomed = self.get_many(skus)
+        for product in doomed:
+            for batch in list(product.batches):
+                product.delete_batch(reference=batch.reference)
+            self.events.extend(product.events)
+            product.events.clear()
+            del self._streams[product.sku]
+            self.seen.discard(product)
+        skus = [product.sku for product in doomed]
+        for start in range(0, len(skus), IN_CHUNK_SIZE):
+            chunk = skus[start : start + IN_CHUNK_SIZE]
+            for table in (_events, _snapshots, _streams):
+                self.orm_session.execute(delete(table).where(table.c.sku.in_(chunk)))
+        return len(doomed)
+
+    def save(self) -> None:
+        """
+        Append the records of every change to the loaded products, one INSERT per product. Raises StaleDataError
+        (retried like any optimistic-lock conflict) when another transaction appended to a stream since it was loaded.
+        """
+        recorded_at = time.time()
+        for sku, stream in self._streams.items():
+            product = stream.product
+            records = outcome_records(product, stream.references, product.events[stream.appended_events :])
+            if not records and not stream.new:
+                continue
+            version = stream.version + len(records)
+            if stream.new:
+                # A concurrent creation of the same sku violates the primary key, which is retried too.
+                self.orm_session.execute(insert(_streams), dict(sku=sku, version=version))
+            elif self.orm_session.execute(_ADVANCE_STREAM, dict(b_sku=sku, expected=stream.version, version=version)).rowcount != 1:
+                raise StaleDataError(f"Stream {sku} was appended to concurrently: expected version {stream.version}")
+            if records:
+                rows = [
+                    dict(
+                        sku=sku,
+                        version=stream.version + i,
+                        reference=_reference(record),
+                        record=ndjson.encode_event(record),
+                        recorded_at=recorded_at,
+                    )
+                    for i, record in enumerate(records, start=1)
+                ]
+                self.orm_session.execute(insert(_events), rows)
+            if version // self.snapshot_every > stream.version // self.snapshot_every:
+                self._snapshot(product, version, new=stream.new)
+            product.version_number = stream.version = version
+            stream.references = {batch.reference for batch in product.batches}
+            stream.appended_events = len(product.events)
+            stream.new = False
+
+    def rollback(self) -> None:
+        """Forget the loaded products: after the transaction rolled back they are reloaded from the streams."""
+        self._streams.clear()
+
+    def _snapshot(self, product: model.Product, version: int, new: bool) -> None:
+        state = encode_state(product)
+        if new or self.orm_session.execute(_UPDATE_SNAPSHOT, dict(b_sku=product.sku, version=version, state=state)).rowcount == 0:
+            self.orm_session.execute(insert(_snapshots), dict(sku=product.sku, version=version, state=state))
+
+    def _load(self, skus: List[str]) -> Iterator[Tuple[model.Product, int]]:
+        """(product, stream version) for the skus that have a stream: the latest snapshot plus the records after it."""
+        for start in range(0, len(skus), IN_CHUNK_SIZE):
+            chunk = skus[start : start + IN_CHUNK_SIZE]
+            with timing.phase("load"):
+                heads = self.orm_session.execute(
+                    select(_streams.c.sku, _streams.c.version, _snapshots.c.version, _snapshots.c.state)
+                    .outerjoin(_snapshots, _snapshots.c.sku == _streams.c.sku)
+                    .where(_streams.c.sku.in_(chunk))
+                ).all()
+                records = self.orm_session.execute(
+                    select(_events.c.sku, _events.c.record)
+                    .outerjoin(_snapshots, _snapshots.c.sku == _events.c.sku)
+                    .where(_events.c.sku.in_(chunk), _events.c.version > func.coalesce(_snapshots.c.version, 0))
+                    .order_by(_events.c.sku, _events.c.version)
+                ).all()
+            replay: Dict[str, List[str]] = {}
+            for sku, record in records:
+                replay.setdefault(sku, []).append(record)
+            for sku, version, _, state in sorted(heads):
+                product = decode_state(sku, state) if state else model.Product(sku=sku, batches=[])
+                for record in replay.get(sku, ()):
+                    apply_record(product, ndjson.decode_event(record, types=RECORD_TYPES))
+                product.version_number = version
+                yield product, version
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Tuple
+
+from sqlalchemy import and_, delete, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from allocation import config
+from allocation.adapters import orm
+from allocation.domain.exceptions import IdempotencyKeyConflict, IdempotencyKeyInProgress
+from allocation.interfaces.main import ISession
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    fingerprint: str
+    # None while the request is still running.
+    status_code: Optional[int]
+    body: Any
+    created_at: float
+
+    @property
+    def pending(self) -> bool:
+        return self.status_code is None
+
+
+def fingerprint(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Responses of write requests keyed by (Idempotency-Key, endpoint), kept for `ttl` seconds
+    in the idempotency_keys table behind a bounded in-process LRU cache. A request reserve()s its
+    key before it runs, so a retry that arrives meanwhile is refused instead of running it twice,
+    then complete()s it with its response, or release()s it if it failed. A reservation neither
+    completed nor released within `lease` seconds, e.g. by a crashed worker, no longer holds the key.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], ISession],
+        ttl: Optional[float] = None,
+        cache_size: Optional[int] = None,
+        lease: Optional[float] = None,
+    ):
+        self.session_factory = session_factory
+        self.ttl = config.get_idempotency_ttl() if ttl is None else ttl
+        self.lease = config.get_idempotency_lease() if lease is None else lease
+        self.cache_size = config.get_idempotency_cache_size() if cache_size is None else cache_size
+        self._cache: "OrderedDict[Tuple[str, str], StoredResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, endpoint: str, request_fingerprint: str) -> Optional[StoredResponse]:
+        stored = self._cached(key, endpoint)
+        if stored is None:
+            stored = self._load(key, endpoint)
+            if stored is not None and not stored.pending:
+                self._remember(key, endpoint, stored)
+        if stored is None:
+            return None
+        if stored.fingerprint != request_fingerprint:
+            raise IdempotencyKeyConflict(f"Idempotency key {key} was already used for a different {endpoint} request")
+        return stored
+
+    def reserve(self, key: str, endpoint: str, request_fingerprint: str) -> Optional[StoredResponse]:
+        """
+        Claim the key for a request about to run and return None, or return the response stored for it
+        before. Raises IdempotencyKeyInProgress while the request holding the key is still running, and
+        IdempotencyKeyConflict when the key was used for a different request.
+        """
+        # A repeated request is answered from the cache or a read, without a write transaction.
+        stored = self.get(key=key, endpoint=endpoint, request_fingerprint=request_fingerprint)
+        if stored is None:
+            if self._claim(key, endpoint, request_fingerprint):
+                return None
+            # Another request claimed the key first; whatever it left is read again.
+            return self.reserve(key=key, endpoint=endpoint, request_fingerprint=request_fingerprint)
+        if stored.pending:
+            raise IdempotencyKeyInProgress(f"A request with idempotency key {key} is still in progress")
+        return stored
+
+    def complete(self, key: str, endpoint: str, request_fingerprint: str, status_code: int, body: Any) -> None:
+        """Store the response of the request that reserved the key."""
+        stored = StoredResponse(fingerprint=request_fingerprint, status_code=status_code, body=body, created_at=time.time())
+        table = orm.idempotency_keys
+        session = self.session_factory()
+        try:
+            session.execute(
+                update(table)
+                .where(table.c.key == key, table.c.endpoint == endpoint, table.c.status_code.is_(None))
+                .values(status_code=stored.status_code, response=json.dumps(stored.body, default=str), created_at=stored.created_at)
+            )
+            session.commit()
+        finally:
+            session.close()
+        self._remember(key, endpoint, stored)
+
+    def release(self, key: str, endpoint: str) -> None:
+        """Give up a reservation, e.g. because the request failed, so that a retry runs it again."""
+        table = orm.idempotency_keys
+        session = self.session_factory()
+        try:
+            session.execute(delete(table).where(table.c.key == key, table.c.endpoint == endpoint, table.c.status_code.is_(None)))
+            session.commit()
+        finally:
+            session.close()
+
+    def purge_expired(self) -> int:
+        cutoff = time.time() - self.ttl
+        session = self.session_factory()
+        try:
+            result = session.execute(delete(orm.idempotency_keys).where(orm.idempotency_keys.c.created_at < cutoff))
+            session.commit()
+        finally:
+            session.close()
+        with self._lock:
+            for cache_key in [k for k, v in self._cache.items() if v.created_at < cutoff]:
+                del self._cache[cache_key]
+        return result.rowcount
+
+    def _claim(self, key: str, endpoint: str, request_fingerprint: str) -> bool:
+        table = orm.idempotency_keys
+        now = time.time()
+        session = self.session_factory()
+        try:
+            # An expired response, or a reservation past its lease, no longer holds the key.
+            session.execute(
+                delete(table).where(
+                    table.c.key == key,
+                    table.c.endpoint == endpoint,
+                    or_(table.c.created_at < now - self.ttl, and_(table.c.status_code.is_(None), table.c.created_at < now - self.lease)),
+                )
+            )
+            # The primary key lets exactly one of several concurrent requests insert the pending row.
+            session.execute(insert(table).values(key=key, endpoint=endpoint, fingerprint=request_fingerprint, created_at=now))
+            session.commit()
+            return True
+        except IntegrityError:
+            session.rollback()
+            return False
+        finally:
+            session.close()
+
+    def _expired(self, stored: StoredResponse) -> bool:
+        age = time.time() - stored.created_at
+        return age > self.ttl or (stored.pending and age > self.lease)
+
+    def _cached(self, key: str, endpoint: str) -> Optional[StoredResponse]:
+        with self._lock:
+            stored = self._cache.get((key, endpoint))
+            if stored is None:
+                return None
+            if self._expired(stored):
+                del self._cache[(key, endpoint)]
+                return None
+            self._cache.move_to_end((key, endpoint))
+            return stored
+
+    def _load(self, key: str, endpoint: str) -> Optional[StoredResponse]:
+        table = orm.idempotency_keys
+        session = self.session_factory()
+        try:
+            row = session.execute(
+                select(table.c.fingerprint, table.c.status_code, table.c.response, table.c.created_at).where(
+                    table.c.key == key, table.c.endpoint == endpoint
+                )
+            ).first()
+        finally:
+            session.close()
+        if row is None:
+            return None
+        body = None if row.response is None else json.loads(row.response)
+        stored = StoredResponse(fingerprint=row.fingerprint, status_code=row.status_code, body=body, created_at=row.created_at)
+        return None if self._expired(stored) else stored
+
+    def _remember(self, key: str, endpoint: str, stored: StoredResponse) -> None:
+        with self._lock:
+            self._cache[(key, endpoint)] = stored
+            self._cache.move_to_end((key, endpoint))
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
@@ -0,0 +1,205 @@
+import logging
+import os
+import threading
+from datetime import date
+from typing import BinaryIO, Collection, Dict, Iterator, List, Optional, Sequence, Tuple, Type
+
+from allocation.adapters import ndjson
+from allocation.domain import events, model
+
+logger = logging.getLogger(__name__)
+
+# Outcomes, not requests: replaying them never decides anything again (see apply_record).
+RECORD_TYPES: Dict[str, Type[events.Event]] = {
+    cls.__name__: cls
+    for cls in (events.BatchCreated, events.BatchQuantityChanged, events.Allocated, events.Deallocated, events.BatchDeleted)
+}
+
+
+def outcome_records(product: model.Product, known: Collection[str], raised: Sequence[events.Event]) -> List[events.Event]:
+    """
+    The records of what happened to `product` since it held the batches `known`, given the events it raised since.
+    """
+    # Product.add_batch raises no event; new batches go first, as later changes may refer to them.
+    records: List[events.Event] = [
+        events.BatchCreated(ref=batch.reference, sku=product.sku, qty=batch._purchase_quantity, eta=batch.eta)
+        for batch in product.batches
+        if batch.reference not in known
+    ]
+    batches = {batch.reference: batch for batch in product.batches}
+    for event in raised:
+        if isinstance(event, events.BatchQuantityAdjusted) and event.ref in batches:
+            # The resulting quantity rather than the delta, so that applying the record twice changes nothing.
+            records.append(events.BatchQuantityChanged(ref=event.ref, qty=batches[event.ref]._purchase_quantity))
+        elif isinstance(event, (events.Allocated, events.Deallocated, events.BatchDeleted)):
+            records.append(event)
+    return records
+
+
+def apply_record(
+    product: model.Product,
+    record: events.Event,
+    released: Optional[Dict[Tuple[str, str], model.OrderLine]] = None,
+) -> Optional[Tuple[Optional[date], int]]:
+    """
+    Apply a journal record to `product` as it happened, without deciding anything again (such as which
+    batch a line goes to). Returns the (eta, delta) it makes to availability, or None when the product
+    already shows it: records the database has partly stored can be applied again.
+
+    Lines deallocated into `released` are moved, not recreated, when a later record allocates them again,
+    so a session storing both records in one flush never holds two order lines for one (orderId, sku).
+    """
+    reference = record.batchref if isinstance(record, (events.Allocated, events.Deallocated)) else record.ref  # type: ignore[attr-defined]
+    batch = next((b for b in product.batches if b.reference == reference), None)
+    if isinstance(record, events.BatchCreated):
+        if batch:
+            return None
+        product.batches.append(model.Batch(ref=record.ref, sku=record.sku, qty=record.qty, eta=record.eta))
+        change = record.eta, record.qty
+    elif batch is None:
+        return None
+    elif isinstance(record, events.BatchQuantityChanged):
+        if batch._purchase_quantity == record.qty:
+            return None
+        change = batch.eta, record.qty - batch._purchase_quantity
+        batch._purchase_quantity = record.qty
+    elif isinstance(record, events.Allocated):
+        if any(b.allocated_line(record.orderId) for b in product.batches):
+            return None
+        line = released.pop((record.orderId, record.sku), None) if released is not None else None
+        if line is None:
+            line = model.OrderLine(orderId=record.orderId, sku=record.sku, qty=record.qty)
+        line.qty = record.qty
+        batch._allocations.add(line)
+        change = batch.eta, -record.qty
+    elif isinstance(record, events.Deallocated):
+        line = batch.allocated_line(record.orderId)
+        if line is None:
+            return None
+        batch.deallocate(line)
+        if released is not None:
+            released[line.orderId, line.sku] = line
+        change = batch.eta, line.qty
+    elif isinstance(record, events.BatchDeleted):
+        product.batches.remove(batch)
+        change = batch.eta, -batch.available_quantity
+    else:
+        raise TypeError(f"{type(record).__name__} is not a journal record")
+    product.version_number += 1
+    return change
+
+
+class Journal:
+    """
+    Append-only log of committed write-behind records, one `<seq>\\t<sku>\\t<NDJSON event>` line each.
+
+    append() returns once the records are on disk (fsync), which is what makes a write-behind commit
+    durable. Records are numbered in append order; once the writer has stored them in the database it
+    discards them, so the file only holds what the database may still be missing.
+    """
+
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._discard_lock = threading.Lock()
+        self.last_seq = self._repair()
+        self._file = open(path, "ab")
+
+    def append(self, records: List[Tuple[str, events.Event]]) -> List[int]:
+        """Persist (sku, record) pairs; returns their sequence numbers."""
+        if not records:
+            return []
+        with self._lock:
+            first = self.last_seq + 1
+            lines = [f"{first + i}\t{sku}\t{ndjson.encode_event(record)}\n" for i, (sku, record) in enumerate(records)]
+            self._file.write("".join(lines).encode())
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self.last_seq += len(records)
+            return list(range(first, self.last_seq + 1))
+
+    def read(self) -> Iterator[Tuple[int, str, events.Event]]:
+        """(seq, sku, record) of every record still in the journal, oldest first."""
+        with self._lock:
+            lines = self._lines()
+        for line in lines:
+            seq, sku, record = line.rstrip(b"\n").split(b"\t", 2)
+            yield int(seq), sku.decode(), ndjson.decode_event(record, types=RECORD_TYPES)
+
+    def discard_through(self, seq: int) -> None:
+        """
+        Drop the records up to and including `seq`, e.g. once they are stored in the database.
+
+        The records kept are copied and synced without holding the lock, so appends carry on meanwhile;
+        only what they wrote in the mean time is carried over while the new file is swapped in.
+        """
+        with self._discard_lock:
+            with self._lock:
+                end = os.fstat(self._file.fileno()).st_size
+            with open(self.path, "rb") as f:
+                head = f.read(end)
+            tmp = self._write_tmp([line for line in head.splitlines(keepends=True) if int(line.split(b"\t", 1)[0]) > seq])
+            with self._lock:
+                with open(self.path, "rb") as f:
+                    f.seek(end)
+                    tail = f.read()
+                if tail:
+                    with open(tmp, "ab") as f:
+                        f.write(tail)
+                        self._sync(f)
+                self._file.close()
+                os.replace(tmp, self.path)
+                self._file = open(self.path, "ab")
+            self._sync_directory()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+    def _lines(self) -> List[bytes]:
+        try:
+            with open(self.path, "rb") as f:
+                return [line for line in f if line.endswith(b"\n")]
+        except FileNotFoundError:
+            return []
+
+    def _repair(self) -> int:
+        """Cut off a record torn by a crash mid-append (its commit never returned); returns the last sequence number."""
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+        complete = data[: data.rfind(b"\n") + 1]
+        if len(complete) != len(data):
+            logger.warning("Discarding a torn record at the end of %s", self.path)
+            self._rewrite(complete.splitlines(keepends=True))
+        last = complete[complete.rstrip(b"\n").rfind(b"\n") + 1 :]
+        return int(last.split(b"\t", 1)[0]) if last else 0
+
+    def _rewrite(self, lines: List[bytes]) -> None:
+        os.replace(self._write_tmp(lines), self.path)
+        self._sync_directory()
+
+    def _write_tmp(self, lines: List[bytes]) -> str:
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "wb") as f:
+            f.writelines(lines)
+            self._sync(f)
+        return tmp
+
+    def _sync(self, f: BinaryIO) -> None:
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+
+    def _sync_directory(self) -> None:
+        if self.fsync:
+            # Make the rename itself durable.
+            directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
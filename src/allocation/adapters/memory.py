@@ -0,0 +1,334 @@
+import heapq
+import threading
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from allocation.domain import events, model
+from allocation.interfaces.main import IAvailabilityRepository, IRepository
+
+
+def copy_batch(batch: model.Batch) -> model.Batch:
+    copy = model.Batch(ref=batch.reference, sku=batch.sku, qty=batch._purchase_quantity, eta=batch.eta)
+    copy._allocations.update(model.OrderLine(orderId=line.orderId, sku=line.sku, qty=line.qty) for line in batch._allocations)
+    return copy
+
+
+def copy_product(product: model.Product) -> model.Product:
+    """A copy of a product that shares no objects with it, and belongs to no session."""
+    return model.Product(sku=product.sku, batches=[copy_batch(batch) for batch in product.batches], version_number=product.version_number)
+
+
+class InMemoryStore:
+    """
+    Products indexed by sku and by batch reference, archived batches by sku and the availability
+    summaries, shared by every InMemoryRepository of an InMemoryUnitOfWork. `lock` is held by one
+    unit of work at a time, as SQLite holds its write lock.
+    """
+
+    def __init__(self, products: Iterable[model.Product] = ()):
+        self.products: Dict[str, model.Product] = {}
+        self.batchrefs: Dict[str, str] = {}
+        self.archived: Dict[str, List[model.Batch]] = {}
+        self.availability: Dict[str, Dict[Optional[date], int]] = {}
+        self.lock = threading.RLock()
+        for product in products:
+            self.put(product)
+
+    def put(self, product: model.Product) -> None:
+        self.products[product.sku] = product
+        self.index(product)
+
+    def index(self, product: model.Product, previous: Iterable[str] = ()) -> None:
+        """Point the batch references of `product` at it, dropping `previous` references it no longer has."""
+        for reference in previous:
+            if self.batchrefs.get(reference) == product.sku:
+                del self.batchrefs[reference]
+        if self.products.get(product.sku) is product:
+            for batch in product.batches:
+                self.batchrefs[batch.reference] = product.sku
+
+    def snapshot(self) -> "InMemoryStore":
+        """A copy of everything held, e.g. to restore() a known state later; take it outside a unit of work."""
+        copy = InMemoryStore(copy_product(product) for product in self.products.values())
+        copy.archived = {sku: [copy_batch(batch) for batch in batches] for sku, batches in self.archived.items()}
+        copy.availability = {sku: dict(buckets) for sku, buckets in self.availability.items()}
+        return copy
+
+    def restore(self, snapshot: "InMemoryStore") -> None:
+        """Replace everything held with a copy of `snapshot`, which stays usable for another restore()."""
+        copy = snapshot.snapshot()
+        self.products, self.batchrefs = copy.products, copy.batchrefs
+        self.archived, self.availability = copy.archived, copy.availability
+
+
+@dataclass
+class _Checkpoint:
+    """
+    A product's state as of the last commit. restore() puts it back into the same objects by undoing, newest
+    first, the events raised since, so a checkpoint keeps the list of batches rather than a copy of every allocation.
+    """
+
+    product: model.Product
+    new: bool = False
+    version_number: int = 0
+    # product.events before this index were raised before the checkpoint.
+    committed_events: int = 0
+    # (batch, its version_number); a new product has none yet, so every batch it holds counts as added.
+    batches: List[Tuple[model.Batch, int]] = field(default_factory=list)
+
+    @classmethod
+    def of(cls, product: model.Product, new: bool = False) -> "_Checkpoint":
+        return cls(
+            product=product,
+            new=new,
+            version_number=product.version_number,
+            committed_events=len(product.events),
+            batches=[] if new else [(b, b.version_number) for b in product.batches],
+        )
+
+    def references(self) -> List[str]:
+        return [batch.reference for batch, _ in self.batches]
+
+    def restore(self) -> None:
+        product = self.product
+        batches = {batch.reference: batch for batch in (*(batch for batch, _ in self.batches), *product.batches)}
+        for event in reversed(product.events[self.committed_events :]):
+            if isinstance(event, events.Allocated) and event.batchref in batches:
+                batches[event.batchref].deallocate(model.OrderLine(orderId=event.orderId, sku=event.sku, qty=event.qty))
+            elif isinstance(event, events.Deallocated) and event.batchref in batches:
+                batches[event.batchref]._allocations.add(model.OrderLine(orderId=event.orderId, sku=event.sku, qty=event.qty))
+            elif isinstance(event, events.BatchQuantityAdjusted) and event.ref in batches:
+                batches[event.ref]._purchase_quantity -= event.delta
+        for batch, version_number in self.batches:
+            batch.version_number = version_number
+        # Drops batches added since, and brings back removed ones.
+        product.batches[:] = [batch for batch, _ in self.batches]
+        product.version_number = self.version_number
+        del product.events[self.committed_events :]
+
+
+class InMemoryRepository(IRepository):
+    """
+    Repository over an InMemoryStore for one unit of work: every lookup is a dict access. Products are
+    changed in place; the first time this unit of work touches one its state is recorded, so rollback()
+    can put back whatever was not committed, and commit() updates the batch reference index.
+    """
+
+    def __init__(self, store: Optional[InMemoryStore] = None):
+        self.store = store if store is not None else InMemoryStore()
+        self.begin()
+
+    def begin(self) -> None:
+        """Start a unit of work, forgetting the products the previous one loaded."""
+        self.seen: Set[model.Product] = set()
+        self.events: List[events.Event] = []
+        self._checkpoints: Dict[str, _Checkpoint] = {}
+        self._archived: List[model.Batch] = []
+
+    def add(self, product: model.Product):
+        self._checkpoints.setdefault(product.sku, _Checkpoint.of(product, new=True))
+        self.store.put(product)
+        self.seen.add(product)
+
+    def get(self, sku: str) -> Optional[model.Product]:
+        product = self.store.products.get(sku)
+        if product:
+            self._track(product)
+        return product
+
+    def get_by_batchref(self, batchref: str) -> Optional[model.Product]:
+        sku = self.store.batchrefs.get(batchref)
+        product = self.store.products.get(sku) if sku else None
+        if product is None or not _has_batch(product, batchref):
+            # Batches added or moved in this unit of work are indexed on commit.
+            product = next((p for p in self.seen if _has_batch(p, batchref)), None)
+        if product:
+            self._track(product)
+        return product
+
+    def get_many(self, skus: Iterable[str]) -> List[model.Product]:
+        products = [product for sku in sorted(set(skus)) if (product := self.store.products.get(sku))]
+        for product in products:
+            self._track(product)
+        return products
+
+    def get_version(self, sku: str) -> Optional[int]:
+        product = self.store.products.get(sku)
+        return product.version_number if product else None
+
+    def get_batch_version(self, sku: str, reference: str) -> Optional[Tuple[int, int]]:
+        product = self.store.products.get(sku)
+        if product is None:
+            return None
+        batch = next((b for b in product.batches if b.reference == reference), None)
+        return (product.version_number, batch.version_number) if batch else None
+
+    def list(self) -> List[model.Product]:
+        return self.get_many(self.store.products)
+
+    def iter_all(self, batch_size: int = 500, read_only: bool = True) -> Iterator[model.Product]:
+        for sku in sorted(self.store.products):
+            product = self.store.products.get(sku)
+            if product is None:
+                continue
+            if not read_only:
+                self._track(product)
+            yield product
+
+    def page_products(self, after: Optional[str], limit: int) -> List[Tuple[str, int]]:
+        skus = heapq.nsmallest(limit, (sku for sku in self.store.products if after is None or sku > after))
+        return [(sku, self.store.products[sku].version_number) for sku in skus]
+
+    def page_batches(self, sku: str, after: Optional[str], limit: int, archived: bool = False) -> List[dict]:
+        if archived:
+            candidates = [*self.store.archived.get(sku, []), *(b for b in self._archived if b.sku == sku)]
+        else:
+            product = self.store.products.get(sku)
+            candidates = product.batches if product else []
+        batches = heapq.nsmallest(limit, (b for b in candidates if after is None or b.reference > after), key=lambda b: b.reference)
+        return [
+            {"reference": b.reference, "sku": b.sku, "eta": b.eta, "qty": b._purchase_quantity, "allocated": b.allocated_quantity}
+            for b in batches
+        ]
+
+    def archive_batches(self, before: date, limit: int) -> int:
+        archived = 0
+        for sku in sorted(self.store.products):
+            product = self.store.products[sku]
+            closed = [b for b in product.batches if b.available_quantity <= 0 and (b.eta is None or b.eta < before)][: limit - archived]
+            if closed:
+                self._track(product)
+                for batch in closed:
+                    product.batches.remove(batch)
+                product.version_number += 1
+                self._archived += closed
+                archived += len(closed)
+            if archived >= limit:
+                break
+        return archived
+
+    def get_archived_allocations(self, order_ids: Iterable[str], skus: Iterable[str]) -> Dict[Tuple[str, str], str]:
+        order_ids = set(order_ids)
+        return {
+            (line.orderId, line.sku): batch.reference
+            for sku in set(skus)
+            for batch in [*self.store.archived.get(sku, []), *(b for b in self._archived if b.sku == sku)]
+            for line in batch._allocations
+            if line.orderId in order_ids
+        }
+
+    def delete(self, sku: str):
+        product = self.get(sku)
+        if product:
+            del self.store.products[sku]
+            self.seen.discard(product)
+
+    def delete_batches(self, references: Iterable[str], sku: Optional[str] = None) -> int:
+        deleted = 0
+        for reference in sorted(set(references)):
+            product = self.get_by_batchref(reference)
+            if product and (sku is None or product.sku == sku):
+                product.delete_batch(reference=reference)
+                deleted += 1
+        return deleted
+
+    def delete_products(self, skus: Iterable[str]) -> int:
+        doomed = self.get_many(skus)
+        for product in doomed:
+            for batch in list(product.batches):
+                product.delete_batch(reference=batch.reference)
+            # The product leaves `seen`, so its events are collected from the repository instead.
+            self.events.extend(product.events)
+            product.events.clear()
+            self.delete(product.sku)
+        return len(doomed)
+
+    def compact_order_lines(self) -> Dict[str, int]:
+        # Lines exist only while allocated here, so there are never orphans; duplicates can only be restored ones.
+        duplicates = 0
+        for product in list(self.store.products.values()):
+            held: Set[Tuple[str, str]] = set()
+            for batch in product.batches:
+                for line in [line for line in batch._allocations if (line.orderId, line.sku) in held]:
+                    self._track(product)
+                    batch.deallocate(line)
+                    product.version_number += 1
+                    product._record_deallocation(batch, line)
+                    duplicates += 1
+                held.update((line.orderId, line.sku) for line in batch._allocations)
+        return {"orphans": 0, "duplicates": duplicates}
+
+    def commit(self) -> None:
+        for sku, checkpoint in self._checkpoints.items():
+            self.store.index(checkpoint.product, previous=checkpoint.references())
+        for batch in self._archived:
+            self.store.archived.setdefault(batch.sku, []).append(batch)
+        self._archived = []
+        self._checkpoints = {
+            sku: _Checkpoint.of(checkpoint.product)
+            for sku, checkpoint in self._checkpoints.items()
+            if self.store.products.get(sku) is checkpoint.product
+        }
+
+    def rollback(self) -> None:
+        for sku, checkpoint in self._checkpoints.items():
+            if checkpoint.new:
+                if self.store.products.get(sku) is checkpoint.product:
+                    del self.store.products[sku]
+                self.store.index(checkpoint.product, previous=[b.reference for b in checkpoint.product.batches])
+                self.seen.discard(checkpoint.product)
+                continue
+            checkpoint.restore()
+            self.store.products[sku] = checkpoint.product
+            self.seen.add(checkpoint.product)
+        self._archived = []
+        self._checkpoints = {sku: checkpoint for sku, checkpoint in self._checkpoints.items() if not checkpoint.new}
+
+    def _track(self, product: model.Product) -> None:
+        if product.sku not in self._checkpoints:
+            self._checkpoints[product.sku] = _Checkpoint.of(product)
+        self.seen.add(product)
+
+
+def _has_batch(product: model.Product, reference: str) -> bool:
+    return any(batch.reference == reference for batch in product.batches)
+
+
+class InMemoryAvailabilityRepository(IAvailabilityRepository):
+    """Availability in an InMemoryStore, changed in place; rollback() puts back the buckets as of the last commit."""
+
+    def __init__(self, store: Optional[InMemoryStore] = None):
+        self.store = store if store is not None else InMemoryStore()
+        self._before: Dict[str, Optional[Dict[Optional[date], int]]] = {}
+
+    def begin(self) -> None:
+        self._before.clear()
+
+    def adjust(self, sku: str, eta: Optional[date], delta: int):
+        self._remember(sku)
+        buckets = self.store.availability.setdefault(sku, {})
+        buckets[eta] = buckets.get(eta, 0) + delta
+
+    def get(self, sku: str) -> Dict[Optional[date], int]:
+        return dict(self.store.availability.get(sku, {}))
+
+    def replace(self, sku: str, buckets: Dict[Optional[date], int]):
+        self._remember(sku)
+        self.store.availability[sku] = dict(buckets)
+
+    def commit(self) -> None:
+        self._before.clear()
+
+    def rollback(self) -> None:
+        for sku, buckets in self._before.items():
+            if buckets is None:
+                self.store.availability.pop(sku, None)
+            else:
+                self.store.availability[sku] = buckets
+        self._before.clear()
+
+    def _remember(self, sku: str) -> None:
+        if sku not in self._before:
+            buckets = self.store.availability.get(sku)
+            self._before[sku] = dict(buckets) if buckets is not None else None
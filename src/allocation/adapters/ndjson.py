@@ -0,0 +1,65 @@
+import dataclasses
+import json
+import types as pytypes
+import typing
+from datetime import date
+from typing import Any, Dict, Type, Union
+
+from allocation.domain import events
+
+EVENT_TYPES: Dict[str, Type[events.Event]] = {
+    cls.__name__: cls for cls in (events.BatchCreated, events.AllocationRequired, events.BatchQuantityChanged, events.OutOfStock)
+}
+
+
+# Type hints per event class, resolved once.
+_FIELD_TYPES: Dict[Type[events.Event], Dict[str, Any]] = {}
+
+
+def _field_types(cls: Type[events.Event]) -> Dict[str, Any]:
+    hints = _FIELD_TYPES.get(cls)
+    if hints is None:
+        hints = _FIELD_TYPES[cls] = typing.get_type_hints(cls)
+    return hints
+
+
+def _decode_field(name: str, hint: Any, value: Any) -> Any:
+    """`value` as JSON decoded it, checked against the field's type hint; dates arrive as ISO strings."""
+    if value is None and type(None) in typing.get_args(hint):
+        return None
+    if typing.get_origin(hint) in (Union, pytypes.UnionType):
+        hint = next(arg for arg in typing.get_args(hint) if arg is not type(None))
+    if hint is date and isinstance(value, str):
+        return date.fromisoformat(value)
+    if typing.get_origin(hint) is dict and isinstance(value, dict):
+        key_type, value_type = typing.get_args(hint)
+        return {_decode_field(name, key_type, k): _decode_field(name, value_type, v) for k, v in value.items()}
+    # bool is an int to isinstance(), but not a quantity.
+    if hint in (str, int, bool) and isinstance(value, hint) and (hint is bool or not isinstance(value, bool)):
+        return value
+    raise TypeError(f"{name} must be {getattr(hint, '__name__', hint)}, not {type(value).__name__}")
+
+
+def decode_event(line: Union[str, bytes], types: Dict[str, Type[events.Event]] = EVENT_TYPES) -> events.Event:
+    """
+    Parse one NDJSON record like {"type": "BatchCreated", "ref": ..., "sku": ..., "qty": ..., "eta": "2026-01-01"}.
+    Raises ValueError for a record that is not a JSON object of a known type, TypeError for a missing,
+    unexpected or wrongly typed field.
+    """
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError(f"Expected a JSON object, got {type(record).__name__}")
+    event_type = record.pop("type", None)
+    cls = types.get(event_type) if isinstance(event_type, str) else None
+    if cls is None:
+        raise ValueError(f"Unknown event type {event_type!r}")
+    hints = _field_types(cls)
+    unexpected = record.keys() - hints.keys()
+    if unexpected:
+        raise TypeError(f"Unexpected fields for {event_type}: {', '.join(sorted(unexpected))}")
+    return cls(**{name: _decode_field(name, hints[name], value) for name, value in record.items()})
+
+
+def encode_event(event: events.Event) -> str:
+    record = {"type": type(event).__name__, **dataclasses.asdict(event)}  # type: ignore[call-overload]
+    return json.dumps(record, default=lambda value: value.isoformat() if isinstance(value, date) else str(value))
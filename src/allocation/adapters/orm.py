@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Date, ForeignKey, Integer, String, Table, event
-from sqlalchemy.orm import registry, relationship
+from sqlalchemy import Column, Date, Float, ForeignKey, Index, Integer, String, Table, Text, UniqueConstraint, event, inspect
+from sqlalchemy.orm import backref, registry, relationship
 
 from allocation.domain.model import Batch, OrderLine, Product
 
@@ -13,6 +13,8 @@ order_lines = Table(
     Column("sku", String(255)),
     Column("qty", Integer, nullable=False),
     Column("orderId", String(255)),
+    # One row per line: a line lives exactly as long as its allocation (see the delete-orphan cascade below).
+    UniqueConstraint("orderId", "sku", name="uq_order_lines_order_sku"),
 )
 
 products = Table(
@@ -30,6 +32,7 @@ batches = Table(
     Column("sku", ForeignKey("products.sku")),
     Column("_purchase_quantity", Integer, nullable=False),
     Column("eta", Date, nullable=True),
+    Column("version_number", Integer, nullable=False, server_default="0"),
 )
 
 allocations = Table(
@@ -40,8 +43,91 @@ allocations = Table(
     Column("batch_id", ForeignKey("batches.id")),
 )
 
+# Closed batches and the lines they held, moved out of the hot tables by SQLAlchemyRepository.archive_batches.
+# Rows get ids of their own, as the original ids can be reused once their rows are gone (SQLite reuses rowids),
+# and keep the original ones as plain columns; there are no foreign keys, so history outlives deleted products.
+archived_batches = Table(
+    "archived_batches",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("batch_id", Integer, nullable=False, index=True),
+    Column("reference", String(255)),
+    Column("sku", String(255), nullable=False),
+    Column("_purchase_quantity", Integer, nullable=False),
+    Column("eta", Date, nullable=True),
+    Column("archived_at", Float, nullable=False),
+    Index("ix_archived_batches_sku_reference", "sku", "reference"),
+)
+
+archived_order_lines = Table(
+    "archived_order_lines",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("orderline_id", Integer, nullable=False),
+    # The archived_batches row, not the original batch.
+    Column("batch_id", Integer, nullable=False, index=True),
+    Column("orderId", String(255)),
+    Column("sku", String(255)),
+    Column("qty", Integer, nullable=False),
+    # Archived lines still count as allocated: see IRepository.get_archived_allocations.
+    Index("ix_archived_order_lines_order_sku", "orderId", "sku"),
+)
+
+availability = Table(
+    "availability",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("sku", String(255), nullable=False),
+    Column("eta", Date, nullable=True),
+    Column("qty", Integer, nullable=False, server_default="0"),
+    UniqueConstraint("sku", "eta", name="uq_availability_sku_eta", postgresql_nulls_not_distinct=True),
+)
+
+idempotency_keys = Table(
+    "idempotency_keys",
+    metadata,
+    Column("key", String(255), primary_key=True),
+    Column("endpoint", String(255), primary_key=True),
+    Column("fingerprint", String(64), nullable=False),
+    # NULL while the request that reserved the key is still running.
+    Column("status_code", Integer, nullable=True),
+    Column("response", Text, nullable=True),
+    Column("created_at", Float, nullable=False, index=True),
+)
+
+# Event-sourced products (adapters.event_store): each sku's outcome records in order, the stream's current
+# version (what appends compare-and-set) and the latest snapshot of the aggregate. Not mapped to classes.
+product_streams = Table(
+    "product_streams",
+    metadata,
+    Column("sku", String(255), primary_key=True),
+    Column("version", Integer, nullable=False),
+)
+
+product_events = Table(
+    "product_events",
+    metadata,
+    Column("sku", String(255), primary_key=True),
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    # The batch the record is about, to find a product by batch reference.
+    Column("reference", String(255), nullable=False, index=True),
+    Column("record", Text, nullable=False),
+    Column("recorded_at", Float, nullable=False),
+)
+
+product_snapshots = Table(
+    "product_snapshots",
+    metadata,
+    Column("sku", String(255), primary_key=True),
+    Column("version", Integer, nullable=False),
+    Column("state", Text, nullable=False),
+)
+
 
 def start_mappers() -> None:
+    """Map the domain classes; a no-op when they are already mapped, so callers need not coordinate."""
+    if inspect(Product, raiseerr=False) is not None:
+        return
     mapper_registry.map_imperatively(OrderLine, order_lines)
 
     mapper_registry.map_imperatively(
@@ -52,9 +138,16 @@ def start_mappers() -> None:
                 OrderLine,
                 secondary=allocations,
                 collection_class=set,
-                backref="batches",
+                # Deleting a line never needs its batches loaded: the allocation row goes with the collection change.
+                backref=backref("batches", passive_deletes=True),
+                lazy="selectin",
+                # A deallocated line is deleted with its allocation instead of being left behind in order_lines.
+                cascade="all, delete-orphan",
+                single_parent=True,
             )
         },
+        # Only checked when something writes the batch row; allocations do so under LOCK_MODE=batch.
+        version_id_col=batches.c.version_number,
     )
 
     mapper_registry.map_imperatively(
@@ -67,6 +160,9 @@ def start_mappers() -> None:
                 primaryjoin=products.c.sku == batches.c.sku,
                 backref="product",
                 cascade="all, delete-orphan",
+                # Products are always used with all batches and allocations; load them in a fixed number
+                # of statements instead of one per batch.
+                lazy="selectin",
             )
         },
         primary_key=[products.c.sku],
@@ -77,3 +173,4 @@ def start_mappers() -> None:
 @event.listens_for(Product, "load")
 def receive_load(product, _):
     product.events = []
+    product.batch_versioning = False
@@ -0,0 +1,76 @@
+import contextvars
+import cProfile
+import functools
+import io
+import pstats
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Optional, TypeVar
+
+from allocation import config
+
+T = TypeVar("T")
+
+
+@dataclass
+class ProfiledRequest:
+    """A request that asked to be profiled; the profiler runs only inside `profiled` functions."""
+
+    profiler: cProfile.Profile = field(default_factory=cProfile.Profile)
+    depth: int = 0
+    calls: int = 0
+    # Calls that ran unprofiled because another request's profiler was active.
+    skipped: int = 0
+
+    def report(self, limit: int = 60) -> str:
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+        return out.getvalue()
+
+    def dump(self, path: str) -> None:
+        self.profiler.dump_stats(path)
+
+
+_current: contextvars.ContextVar[Optional[ProfiledRequest]] = contextvars.ContextVar("profiled_request", default=None)
+# Held while a profiler is enabled: only one can be active per interpreter.
+_active = threading.Lock()
+
+
+def start() -> ProfiledRequest:
+    request = ProfiledRequest()
+    _current.set(request)
+    return request
+
+
+def profiled(func: Callable[..., T]) -> Callable[..., T]:
+    """
+    Profile calls of `func` made while handling a profiled request. This wraps the code that runs in
+    FastAPI's worker threads rather than the middleware, so the profile covers the request's own work.
+    cProfile records every thread while it is enabled, and a second profiler cannot be enabled
+    meanwhile: calls made while another request is being profiled run unprofiled and are counted in
+    `skipped`. Returns `func` itself unless PROFILING_ENABLED is set at import time.
+    """
+    if not config.get_profiling_enabled():
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs) -> T:
+        request = _current.get()
+        if request is None or request.depth:
+            return func(*args, **kwargs)
+        if not _active.acquire(blocking=False):
+            request.skipped += 1
+            return func(*args, **kwargs)
+        request.depth += 1
+        request.calls += 1
+        try:
+            request.profiler.enable()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                request.profiler.disable()
+        finally:
+            request.depth -= 1
+            _active.release()
+
+    return wrapper
@@ -1,32 +1,201 @@
-from typing import List, Optional
+import hashlib
+import time
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
-from allocation.domain.model import Batch, Product
-from allocation.interfaces.main import IRepository, ISession
+from sqlalchemy import ColumnElement, Date, and_, bindparam, delete, func, insert, inspect, lambda_stmt, literal, select, text, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm.exc import StaleDataError
+
+from allocation import config
+from allocation.adapters import orm, timing
+from allocation.domain import events
+from allocation.domain.model import Product
+from allocation.interfaces.main import IAvailabilityRepository, IRepository, ISession
+
+OPTIMISTIC = "optimistic"
+ROW_LOCK = "row"
+ADVISORY_LOCK = "advisory"
+# Optimistic, but allocations are checked against the versions of the batches they land on (see Product._changed).
+BATCH_VERSION = "batch"
+LOCK_MODES = (OPTIMISTIC, ROW_LOCK, ADVISORY_LOCK, BATCH_VERSION)
+# Keeps IN (...) lists well below the bind parameter limits of SQLite and Postgres.
+IN_CHUNK_SIZE = 1000
+
+
+# Hot-path statements are built once; executing them reuses the compiled form from the engine's cache
+# without rebuilding and re-hashing the statement on every call.
+_BATCH_SKU = select(orm.batches.c.sku).where(orm.batches.c.reference == bindparam("reference")).limit(1)
+_PRODUCT_VERSION = select(orm.products.c.version_number).where(orm.products.c.sku == bindparam("sku"))
+_BATCH_PRODUCT_VERSION = (
+    select(orm.products.c.version_number, orm.batches.c.version_number)
+    .join(orm.batches, orm.batches.c.sku == orm.products.c.sku)
+    .where(orm.products.c.sku == bindparam("sku"), orm.batches.c.reference == bindparam("reference"))
+    .limit(1)
+)
+_ADVISORY_LOCK = text("SELECT pg_advisory_xact_lock(:key)")
+_ADJUST_AVAILABILITY = (
+    update(orm.availability)
+    .where(orm.availability.c.sku == bindparam("b_sku"), orm.availability.c.eta.is_not_distinct_from(bindparam("b_eta", type_=Date)))
+    .values(qty=orm.availability.c.qty + bindparam("delta"))
+)
+_INSERT_AVAILABILITY = insert(orm.availability)
+
+
+def _upsert_availability():
+    statement = postgresql.insert(orm.availability)
+    return statement.on_conflict_do_update(
+        constraint="uq_availability_sku_eta", set_=dict(qty=orm.availability.c.qty + statement.excluded.qty)
+    )
+
+
+_UPSERT_AVAILABILITY = _upsert_availability()
+
+
+def _product_by_sku(sku: str, for_update: bool = False, for_share: bool = False):
+    # Lambda statements are cached by their code location, so building one costs a cache lookup rather than a
+    # new select(); `sku` becomes a bound parameter. Product is mapped lazily, hence not a module-level select,
+    # and the mapper is part of the cache key so that re-mapping (as the tests do) never reuses a stale one.
+    statement = lambda_stmt(lambda: select(Product).where(orm.products.c.sku == sku), track_on=[inspect(Product)])
+    if for_update:
+        statement += lambda s: s.with_for_update()
+    elif for_share:
+        statement += lambda s: s.with_for_update(read=True)
+    return statement
+
+
+def advisory_lock_key(sku: str) -> int:
+    """Stable signed 64-bit key for pg_advisory_xact_lock."""
+    return int.from_bytes(hashlib.blake2b(sku.encode(), digest_size=8).digest(), "big", signed=True)
+
+
+@dataclass(frozen=True)
+class LockPolicy:
+    default: str = OPTIMISTIC
+    overrides: Dict[str, str] = field(default_factory=dict)
+
+    def __post_init__(self):
+        for mode in (self.default, *self.overrides.values()):
+            if mode not in LOCK_MODES:
+                raise ValueError(f"Unknown lock mode {mode!r}, expected one of {LOCK_MODES}")
+
+    @classmethod
+    def from_config(cls) -> "LockPolicy":
+        return cls(default=config.get_lock_mode(), overrides=config.get_lock_mode_overrides())
+
+    def mode_for(self, sku: str) -> str:
+        return self.overrides.get(sku, self.default)
+
+    @property
+    def is_pessimistic(self) -> bool:
+        return any(mode in (ROW_LOCK, ADVISORY_LOCK) for mode in (self.default, *self.overrides.values()))
+
+
+def _allocated_per_batch():
+    """Subquery of (batch_id, qty): the quantity allocated from each active batch."""
+    return (
+        select(orm.allocations.c.batch_id, func.sum(orm.order_lines.c.qty).label("qty"))
+        .join(orm.order_lines, orm.order_lines.c.id == orm.allocations.c.orderline_id)
+        .group_by(orm.allocations.c.batch_id)
+        .subquery()
+    )
+
+
+def _chunks(values: List, size: int = IN_CHUNK_SIZE) -> Iterator[List]:
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
 
 
 class SQLAlchemyRepository(IRepository):
-    def __init__(self, orm_session: ISession):
+    def __init__(self, orm_session: ISession, lock_policy: Optional[LockPolicy] = None):
         self.orm_session = orm_session
+        self.lock_policy = lock_policy or LockPolicy()
         self.seen = set()
+        # Events of set-based writes that bypass the aggregates, collected by the unit of work.
+        self.events: List[events.Event] = []
 
     def add(self, product: Product):
+        product.batch_versioning = self.lock_policy.mode_for(product.sku) == BATCH_VERSION
         self.seen.add(product)
         self.orm_session.add(product)
 
     def get(self, sku: str) -> Optional[Product]:
-        product = self.orm_session.query(Product).filter_by(sku=sku).first()
+        with timing.phase("load"):
+            mode = self.lock_policy.mode_for(sku)
+            for_update = for_share = False
+            if mode != OPTIMISTIC and self._dialect_name() == "postgresql":
+                if mode == BATCH_VERSION:
+                    # Held until commit: whatever gives a batch more room bumps the product row, so it waits for
+                    # us or fails our REPEATABLE READ transaction, and first-fit holds without writing the row.
+                    for_share = True
+                else:
+                    self._use_read_committed()
+                if mode == ROW_LOCK:
+                    for_update = True
+                elif mode == ADVISORY_LOCK:
+                    self.orm_session.execute(_ADVISORY_LOCK, dict(key=advisory_lock_key(sku)))
+            product = self.orm_session.execute(_product_by_sku(sku, for_update=for_update, for_share=for_share)).scalars().first()
         if product:
+            product.batch_versioning = mode == BATCH_VERSION
             self.seen.add(product)
         return product
 
     def get_by_batchref(self, batchref: str) -> Optional[Product]:
-        batch = self.orm_session.query(Batch).filter_by(reference=batchref).first()
-        if not batch:
+        if self.lock_policy.is_pessimistic and self._dialect_name() == "postgresql":
+            self._use_read_committed()
+        with timing.phase("load"):
+            sku = self.orm_session.execute(_BATCH_SKU, dict(reference=batchref)).scalar()
+        if sku is None:
             return None
-        product = batch.product
-        if product:
-            self.seen.add(product)
-        return product
+        return self.get(sku=sku)
+
+    def get_many(self, skus: Iterable[str]) -> List[Product]:
+        skus = sorted(set(skus))
+        if not skus:
+            return []
+        with timing.phase("load"):
+            query = self.orm_session.query(Product).filter(orm.products.c.sku.in_(skus)).order_by(orm.products.c.sku)
+            modes = {sku: self.lock_policy.mode_for(sku) for sku in skus}
+            if set(modes.values()) != {OPTIMISTIC} and self._dialect_name() == "postgresql":
+                if set(modes.values()) & {ROW_LOCK, ADVISORY_LOCK}:
+                    self._use_read_committed()
+                # Always lock in sku order, so two multi-sku orders cannot deadlock each other.
+                for sku in skus:
+                    if modes[sku] == ADVISORY_LOCK:
+                        self.orm_session.execute(_ADVISORY_LOCK, dict(key=advisory_lock_key(sku)))
+                if ROW_LOCK in modes.values():
+                    query = query.with_for_update()
+                elif BATCH_VERSION in modes.values():
+                    query = query.with_for_update(read=True)
+            products = query.all()
+        for product in products:
+            product.batch_versioning = modes[product.sku] == BATCH_VERSION
+        self.seen.update(products)
+        return products
+
+    def verify_versions(self) -> None:
+        """
+        Call after flushing, before committing. A batch-versioned product is not written when it is only
+        allocated to, so nothing would notice a concurrent change that gave a skipped batch more room.
+        Postgres holds FOR SHARE on the product row for that; elsewhere (SQLite serializes writers once
+        the flush has begun a transaction) the versions are read again.
+        """
+        products = {product.sku: product for product in self.seen if product.batch_versioning}
+        if not products or self._dialect_name() == "postgresql":
+            return
+        table = orm.products
+        versions = dict(self.orm_session.execute(select(table.c.sku, table.c.version_number).where(table.c.sku.in_(products))).all())
+        for sku, product in products.items():
+            if versions.get(sku) != product.version_number:
+                raise StaleDataError(f"Product {sku} changed concurrently: version {versions.get(sku)}, expected {product.version_number}")
+
+    def get_version(self, sku: str) -> Optional[int]:
+        return self.orm_session.execute(_PRODUCT_VERSION, dict(sku=sku)).scalar()
+
+    def get_batch_version(self, sku: str, reference: str) -> Optional[Tuple[int, int]]:
+        row = self.orm_session.execute(_BATCH_PRODUCT_VERSION, dict(sku=sku, reference=reference)).first()
+        return tuple(row) if row else None
 
     def list(self) -> List[Product]:
         products = self.orm_session.query(Product).all()
@@ -34,10 +203,245 @@ class SQLAlchemyRepository(IRepository):
             self.seen.add(product)
         return products
 
+    def iter_all(self, batch_size: int = 500, read_only: bool = True) -> Iterator[Product]:
+        """
+        Stream every product in sku order, fetching `batch_size` rows at a time (a server-side cursor
+        on Postgres). Read-only products are not tracked in `seen`, so each can be garbage collected
+        once the caller moves on; do not modify them.
+        """
+        query = select(Product).order_by(orm.products.c.sku).execution_options(yield_per=batch_size)
+        for product in self.orm_session.execute(query).scalars():
+            if not read_only:
+                self.seen.add(product)
+            yield product
+
+    def page_products(self, after: Optional[str], limit: int) -> List[Tuple[str, int]]:
+        """(sku, version_number) of up to `limit` products with sku > `after`, without loading aggregates."""
+        table = orm.products
+        query = select(table.c.sku, table.c.version_number).order_by(table.c.sku).limit(limit)
+        if after is not None:
+            query = query.where(table.c.sku > after)
+        return [(sku, version) for sku, version in self.orm_session.execute(query)]
+
+    def page_batches(self, sku: str, after: Optional[str], limit: int, archived: bool = False) -> List[dict]:
+        """
+        Up to `limit` batches of `sku` with reference > `after`, with allocated quantities summed in SQL.
+        `archived` pages through the batches moved out by archive_batches instead of the active ones.
+        """
+        if archived:
+            batches, lines = orm.archived_batches, orm.archived_order_lines
+            allocated = select(lines.c.batch_id, func.sum(lines.c.qty).label("qty")).group_by(lines.c.batch_id).subquery()
+        else:
+            batches, allocated = orm.batches, _allocated_per_batch()
+        query = (
+            select(batches.c.reference, batches.c.eta, batches.c._purchase_quantity, func.coalesce(allocated.c.qty, 0))
+            .outerjoin(allocated, allocated.c.batch_id == batches.c.id)
+            .where(batches.c.sku == sku)
+            .order_by(batches.c.reference)
+            .limit(limit)
+        )
+        if after is not None:
+            query = query.where(batches.c.reference > after)
+        return [
+            {"reference": reference, "sku": sku, "eta": eta, "qty": qty, "allocated": allocated_qty}
+            for reference, eta, qty, allocated_qty in self.orm_session.execute(query)
+        ]
+
+    def archive_batches(self, before: date, limit: int) -> int:
+        """
+        Move up to `limit` closed batches, those fully allocated and in stock (no eta, or an eta before
+        `before`), into the archive tables with the lines they hold; returns how many were moved.
+        A closed batch adds nothing to availability, so the summaries are unaffected, but its
+        allocations become final: they are no longer part of the product and cannot be deallocated.
+        """
+        batches, allocations, order_lines = orm.batches, orm.allocations, orm.order_lines
+        allocated = _allocated_per_batch()
+        closed = self.orm_session.execute(
+            select(batches.c.id, batches.c.sku)
+            .outerjoin(allocated, allocated.c.batch_id == batches.c.id)
+            .where(
+                (batches.c.eta.is_(None)) | (batches.c.eta < before),
+                batches.c._purchase_quantity - func.coalesce(allocated.c.qty, 0) <= 0,
+            )
+            .order_by(batches.c.id)
+            .limit(limit)
+        ).all()
+        if not closed:
+            return 0
+        archived_at = time.time()
+        archive = orm.archived_batches
+        batch_ids = [batch.id for batch in closed]
+        line_ids = []
+        for chunk in _chunks(batch_ids):
+            archive_ids = (
+                self.orm_session.execute(
+                    insert(archive)
+                    .from_select(
+                        ["batch_id", "reference", "sku", "_purchase_quantity", "eta", "archived_at"],
+                        select(
+                            batches.c.id,
+                            batches.c.reference,
+                            batches.c.sku,
+                            batches.c._purchase_quantity,
+                            batches.c.eta,
+                            literal(archived_at),
+                        ).where(batches.c.id.in_(chunk)),
+                    )
+                    .returning(archive.c.id)
+                )
+                .scalars()
+                .all()
+            )
+            # Older archive rows may carry the same original batch ids, so match on the rows just inserted.
+            held = (
+                select(order_lines.c.id, archive.c.id.label("archive_id"), order_lines.c.orderId, order_lines.c.sku, order_lines.c.qty)
+                .join(allocations, allocations.c.orderline_id == order_lines.c.id)
+                .join(archive, archive.c.batch_id == allocations.c.batch_id)
+                .where(archive.c.id.in_(archive_ids))
+            )
+            self.orm_session.execute(
+                insert(orm.archived_order_lines).from_select(["orderline_id", "batch_id", "orderId", "sku", "qty"], held)
+            )
+            line_ids += self.orm_session.execute(select(held.subquery().c.id)).scalars().all()
+        self._remove_batches(batch_ids, line_ids, skus={batch.sku for batch in closed})
+        return len(closed)
+
+    def get_archived_allocations(self, order_ids: Iterable[str], skus: Iterable[str]) -> Dict[Tuple[str, str], str]:
+        lines, archive = orm.archived_order_lines, orm.archived_batches
+        skus = sorted(set(skus))
+        allocations = {}
+        for chunk in _chunks(sorted(set(order_ids))):
+            query = (
+                select(lines.c.orderId, lines.c.sku, archive.c.reference)
+                .join(archive, archive.c.id == lines.c.batch_id)
+                .where(lines.c.orderId.in_(chunk), lines.c.sku.in_(skus))
+            )
+            allocations.update({(order_id, sku): reference for order_id, sku, reference in self.orm_session.execute(query)})
+        return allocations
+
     def delete(self, sku: str) -> int:
-        product = self.orm_session.query(Product).filter_by(sku=sku).first()
-        if not product:
+        return self.delete_products([sku])
+
+    def delete_batches(self, references: Iterable[str], sku: Optional[str] = None) -> int:
+        """Delete batches (optionally only of `sku`) with a few set-based statements; returns how many were deleted."""
+        deleted = 0
+        for chunk in _chunks(sorted(set(references))):
+            condition: ColumnElement[bool] = orm.batches.c.reference.in_(chunk)
+            if sku is not None:
+                condition = and_(condition, orm.batches.c.sku == sku)
+            deleted += self._delete_batches_where(condition)
+        return deleted
+
+    def delete_products(self, skus: Iterable[str]) -> int:
+        """Delete products with all of their batches and allocations; returns how many products were deleted."""
+        skus = sorted(set(skus))
+        deleted = 0
+        for chunk in _chunks(skus):
+            self._delete_batches_where(orm.batches.c.sku.in_(chunk))
+            deleted += self.orm_session.execute(delete(orm.products).where(orm.products.c.sku.in_(chunk))).rowcount
+        return deleted
+
+    def compact_order_lines(self) -> Dict[str, int]:
+        """
+        Delete order lines that no batch holds any more, then every (orderId, sku) line but the oldest.
+        Lines left by older releases, which neither removed deallocated lines nor prevented duplicates.
+        """
+        batches, allocations, order_lines = orm.batches, orm.allocations, orm.order_lines
+        allocated = select(allocations.c.orderline_id).where(allocations.c.orderline_id.is_not(None))
+        orphans = self.orm_session.execute(delete(order_lines).where(order_lines.c.id.not_in(allocated))).rowcount
+
+        # Every remaining line is allocated, so a duplicate is a second allocation of the same line: give it up.
+        keep = select(func.min(order_lines.c.id)).group_by(order_lines.c.orderId, order_lines.c.sku)
+        lost_lines = self.orm_session.execute(
+            select(order_lines.c.orderId, order_lines.c.sku, order_lines.c.qty, batches.c.reference, batches.c.eta)
+            .join(allocations, allocations.c.orderline_id == order_lines.c.id)
+            .join(batches, batches.c.id == allocations.c.batch_id)
+            .where(order_lines.c.id.not_in(keep))
+        ).all()
+        for chunk in _chunks(sorted({line.sku for line in lost_lines})):
+            self.orm_session.execute(
+                update(orm.products).where(orm.products.c.sku.in_(chunk)).values(version_number=orm.products.c.version_number + 1)
+            )
+        self.orm_session.execute(delete(allocations).where(allocations.c.orderline_id.not_in(keep)))
+        duplicates = self.orm_session.execute(delete(order_lines).where(order_lines.c.id.not_in(keep))).rowcount
+        for line in lost_lines:
+            self.events.append(events.Deallocated(orderId=line.orderId, sku=line.sku, qty=line.qty, batchref=line.reference, eta=line.eta))
+        return {"orphans": orphans, "duplicates": duplicates}
+
+    def _delete_batches_where(self, condition) -> int:
+        """Aggregates already loaded in this session are not updated; load them again after deleting."""
+        batches, allocations, order_lines = orm.batches, orm.allocations, orm.order_lines
+        doomed = self.orm_session.execute(
+            select(batches.c.id, batches.c.reference, batches.c.sku, batches.c.eta, batches.c._purchase_quantity).where(condition)
+        ).all()
+        if not doomed:
             return 0
-        self.orm_session.delete(product)
-        self.seen.discard(product)
-        return 1
+        batch_ids = [batch.id for batch in doomed]
+        lost_lines = []
+        for chunk in _chunks(batch_ids):
+            lost_lines += self.orm_session.execute(
+                select(allocations.c.batch_id, order_lines.c.id, order_lines.c.orderId, order_lines.c.sku, order_lines.c.qty)
+                .join(order_lines, order_lines.c.id == allocations.c.orderline_id)
+                .where(allocations.c.batch_id.in_(chunk))
+            ).all()
+
+        self._remove_batches(batch_ids, [line.id for line in lost_lines], skus={batch.sku for batch in doomed})
+
+        lines_by_batch: Dict[int, list] = {}
+        for line in lost_lines:
+            lines_by_batch.setdefault(line.batch_id, []).append(line)
+        for batch in doomed:
+            for line in lines_by_batch.get(batch.id, []):
+                self.events.append(
+                    events.Deallocated(orderId=line.orderId, sku=line.sku, qty=line.qty, batchref=batch.reference, eta=batch.eta)
+                )
+            self.events.append(events.BatchDeleted(ref=batch.reference, sku=batch.sku, eta=batch.eta, qty=batch._purchase_quantity))
+        return len(doomed)
+
+    def _remove_batches(self, batch_ids: List[int], line_ids: List[int], skus: Set[str]) -> None:
+        # Bump the versions so that writers still holding one of these products fail their optimistic check.
+        for chunk in _chunks(sorted(skus)):
+            self.orm_session.execute(
+                update(orm.products).where(orm.products.c.sku.in_(chunk)).values(version_number=orm.products.c.version_number + 1)
+            )
+        for chunk in _chunks(batch_ids):
+            self.orm_session.execute(delete(orm.allocations).where(orm.allocations.c.batch_id.in_(chunk)))
+        for chunk in _chunks(line_ids):
+            self.orm_session.execute(delete(orm.order_lines).where(orm.order_lines.c.id.in_(chunk)))
+        for chunk in _chunks(batch_ids):
+            self.orm_session.execute(delete(orm.batches).where(orm.batches.c.id.in_(chunk)))
+
+    def _dialect_name(self) -> str:
+        return self.orm_session.get_bind().dialect.name
+
+    def _use_read_committed(self) -> None:
+        # Under REPEATABLE READ the snapshot predates the lock wait and the commit
+        # would fail anyway, so locked reads run the transaction in READ COMMITTED.
+        if not self.orm_session.in_transaction():
+            self.orm_session.connection(execution_options={"isolation_level": "READ COMMITTED"})
+
+
+class SQLAlchemyAvailabilityRepository(IAvailabilityRepository):
+    def __init__(self, orm_session: ISession):
+        self.orm_session = orm_session
+
+    def adjust(self, sku: str, eta: Optional[date], delta: int):
+        if self.orm_session.get_bind().dialect.name == "postgresql":
+            # One statement, and two transactions creating the same bucket cannot both insert it.
+            self.orm_session.execute(_UPSERT_AVAILABILITY, dict(sku=sku, eta=eta, qty=delta))
+            return
+        # SQLite runs one writer at a time, and its unique constraint would not match a NULL eta anyway.
+        result = self.orm_session.execute(_ADJUST_AVAILABILITY, dict(b_sku=sku, b_eta=eta, delta=delta))
+        if result.rowcount == 0:
+            self.orm_session.execute(_INSERT_AVAILABILITY, dict(sku=sku, eta=eta, qty=delta))
+
+    def get(self, sku: str) -> Dict[Optional[date], int]:
+        table = orm.availability
+        rows = self.orm_session.execute(select(table.c.eta, table.c.qty).where(table.c.sku == sku))
+        return {eta: qty for eta, qty in rows}
+
+    def replace(self, sku: str, buckets: Dict[Optional[date], int]):
+        table = orm.availability
+        self.orm_session.execute(delete(table).where(table.c.sku == sku))
+        if buckets:
+            self.orm_session.execute(insert(table), [dict(sku=sku, eta=eta, qty=qty) for eta, qty in buckets.items()])
@@ -0,0 +1,50 @@
+from typing import Dict
+
+from sqlalchemy import Engine, event
+
+from allocation import config
+
+# Execution option of the connections of read-only units of work, which begin DEFERRED.
+READ_ONLY = "sqlite_read_only"
+
+
+def pragmas() -> Dict[str, object]:
+    """Set on every new connection; the database file keeps WAL mode once set."""
+    return {
+        # Readers no longer block the writer, nor the writer readers.
+        "journal_mode": "WAL",
+        # In WAL mode NORMAL stays consistent after a crash; a power loss may lose the last commits.
+        "synchronous": config.get_sqlite_synchronous(),
+        "foreign_keys": "ON",
+        # Wait for the write lock instead of failing straight away with "database is locked".
+        "busy_timeout": config.get_sqlite_busy_timeout_ms(),
+        # Negative: KiB rather than pages.
+        "cache_size": -config.get_sqlite_cache_size_mb() * 1024,
+        "temp_store": "MEMORY",
+        "mmap_size": config.get_sqlite_mmap_size_mb() * 1024 * 1024,
+    }
+
+
+def configure(engine: Engine) -> None:
+    """
+    Tune a SQLite engine for a single-node deployment. Transactions begin IMMEDIATE, taking the write lock
+    up front: a transaction that read a product and then writes it could otherwise fail on a concurrent
+    commit without waiting (busy_timeout does not apply to that upgrade), so writers queue rather than retry.
+    Connections with the READ_ONLY execution option begin DEFERRED instead, so reads never wait for writers.
+    """
+    settings = pragmas()
+
+    @event.listens_for(engine, "connect")
+    def _connect(dbapi_connection, connection_record):
+        # Leave BEGIN to the "begin" listener below rather than to the driver.
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in settings.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def _begin(connection):
+        mode = "DEFERRED" if connection.get_execution_options().get(READ_ONLY) else "IMMEDIATE"
+        # On the driver connection, so sqlstats does not count it as a statement.
+        connection.connection.driver_connection.execute(f"BEGIN {mode}")
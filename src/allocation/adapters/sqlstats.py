@@ -0,0 +1,90 @@
+import contextlib
+import contextvars
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+@dataclass
+class QueryStats:
+    statements: int = 0
+    seconds: float = 0.0
+    keep_statements: bool = False
+    executed: List[str] = field(default_factory=list, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def record(self, statement: str, seconds: float) -> None:
+        with self._lock:
+            self.statements += 1
+            self.seconds += seconds
+            if self.keep_statements:
+                self.executed.append(statement)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.statements = 0
+            self.seconds = 0.0
+            self.executed.clear()
+
+
+# Process-wide totals, e.g. for metrics; scoped counts come from count_queries().
+totals = QueryStats()
+_active: contextvars.ContextVar[Tuple[QueryStats, ...]] = contextvars.ContextVar("active_query_stats", default=())
+
+
+def push(keep_statements: bool = False) -> Tuple[QueryStats, contextvars.Token]:
+    """Start counting the statements of the current context; pass the token to pop() to stop."""
+    stats = QueryStats(keep_statements=keep_statements)
+    return stats, _active.set((*_active.get(), stats))
+
+
+def pop(token: contextvars.Token) -> None:
+    _active.reset(token)
+
+
+@contextlib.contextmanager
+def count_queries(keep_statements: bool = False) -> Iterator[QueryStats]:
+    """Count the statements executed in the block by this thread, or by threadpool calls made from it."""
+    stats, token = push(keep_statements=keep_statements)
+    try:
+        yield stats
+    finally:
+        pop(token)
+
+
+@contextlib.contextmanager
+def assert_max_queries(limit: int) -> Iterator[QueryStats]:
+    with count_queries(keep_statements=True) as stats:
+        yield stats
+    if stats.statements > limit:
+        listing = "\n".join(f"  {n}. {statement}" for n, statement in enumerate(stats.executed, start=1))
+        raise AssertionError(f"Expected at most {limit} SQL statements, {stats.statements} were executed:\n{listing}")
+
+
+def current() -> Optional[QueryStats]:
+    active = _active.get()
+    return active[-1] if active else None
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    totals.record(statement, elapsed)
+    for stats in _active.get():
+        stats.record(statement, elapsed)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    started = context.connection.info.get("query_started") if context.connection is not None else None
+    if started:
+        started.pop()
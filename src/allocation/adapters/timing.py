@@ -0,0 +1,67 @@
+import contextlib
+import contextvars
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
+
+
+@dataclass
+class RequestTimings:
+    """
+    Exclusive wall-clock time per phase of one request: time spent in a nested phase (e.g. "load"
+    inside "handler") is not counted again for the enclosing one.
+    """
+
+    started: float = field(default_factory=time.perf_counter)
+    phases: Dict[str, float] = field(default_factory=dict)
+    _nested: List[float] = field(default_factory=list, repr=False)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def breakdown(self, total: Optional[float] = None) -> Dict[str, float]:
+        """Phases in milliseconds, plus "other" (validation, serialization, middleware) and "total"."""
+        total = self.elapsed if total is None else total
+        result = {name: seconds * 1000 for name, seconds in self.phases.items()}
+        result["other"] = max(total - sum(self.phases.values()), 0.0) * 1000
+        result["total"] = total * 1000
+        return result
+
+    def server_timing(self, total: Optional[float] = None) -> str:
+        return ", ".join(f"{name};dur={ms:.2f}" for name, ms in self.breakdown(total).items())
+
+
+_current: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar("request_timings", default=None)
+
+
+def start() -> RequestTimings:
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+
+def current() -> Optional[RequestTimings]:
+    return _current.get()
+
+
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Attribute the enclosed block to `name` on the current request; a no-op outside of one."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    timings._nested.append(0.0)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        nested = timings._nested.pop()
+        timings.add(name, elapsed - nested)
+        if timings._nested:
+            timings._nested[-1] += elapsed
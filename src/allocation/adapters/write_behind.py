@@ -0,0 +1,149 @@
+import threading
+from datetime import date
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from allocation.adapters import journal
+from allocation.adapters.memory import InMemoryRepository, InMemoryStore
+from allocation.domain import events, model
+from allocation.domain.exceptions import UnsupportedOperation
+from allocation.interfaces.main import IAvailabilityRepository
+
+
+class HotProducts(InMemoryStore):
+    """
+    The products of the write-behind SKUs, held in memory as their source of truth, with a lock per SKU
+    in place of the store-wide `lock`, and the availability summaries under their own lock. Used through
+    the repositories below.
+    """
+
+    def __init__(self, skus: Iterable[str]):
+        super().__init__()
+        self.skus = frozenset(skus)
+        # Reentrant, so a unit of work holding a SKU can still page its batches.
+        self.locks = {sku: threading.RLock() for sku in self.skus}
+        self.availability_lock = threading.Lock()
+
+    def load(self, products: Iterable[model.Product]) -> None:
+        """Replace the held products, e.g. with those rebuilt by recovery; availability is recomputed from them."""
+        self.products, self.batchrefs, self.availability = {}, {}, {}
+        for product in products:
+            self.put(product)
+            buckets = self.availability[product.sku] = {}
+            for batch in product.batches:
+                buckets[batch.eta] = buckets.get(batch.eta, 0) + batch.available_quantity
+
+
+class HotProductRepository(InMemoryRepository):
+    """
+    InMemoryRepository over HotProducts for one unit of work, which locks each SKU it loads until release()
+    instead of the whole store. pending_records() turns the changes since the last commit into journal records;
+    commit() is called once they are durable.
+    """
+
+    store: HotProducts
+
+    def __init__(self, store: HotProducts):
+        super().__init__(store)
+        self._locked: List[str] = []
+
+    def add(self, product: model.Product):
+        if not self._lock(product.sku):
+            raise ValueError(f"{product.sku} is not a write-behind sku")
+        super().add(product)
+
+    def get(self, sku: str) -> Optional[model.Product]:
+        return super().get(sku) if self._lock(sku) else None
+
+    def get_by_batchref(self, batchref: str) -> Optional[model.Product]:
+        sku = self.store.batchrefs.get(batchref)
+        if sku:
+            self._lock(sku)
+        return super().get_by_batchref(batchref)
+
+    def get_many(self, skus: Iterable[str]) -> List[model.Product]:
+        # Always lock in sku order, so two multi-sku orders cannot deadlock each other.
+        return [product for sku in sorted(set(skus)) if (product := self.get(sku))]
+
+    def iter_all(self, batch_size: int = 500, read_only: bool = True) -> Iterator[model.Product]:
+        yield from self.get_many(list(self.store.products))
+
+    def page_batches(self, sku: str, after: Optional[str], limit: int, archived: bool = False) -> List[dict]:
+        if archived:
+            raise UnsupportedOperation("Archived batches are only kept in the database")
+        if sku not in self.store.locks:
+            return []
+        with self.store.locks[sku]:
+            return super().page_batches(sku, after, limit)
+
+    def delete(self, sku: str):
+        raise UnsupportedOperation("Write-behind products cannot be deleted while they are held in memory")
+
+    def delete_products(self, skus: Iterable[str]) -> int:
+        raise UnsupportedOperation("Write-behind products cannot be deleted while they are held in memory")
+
+    def archive_batches(self, before: date, limit: int) -> int:
+        raise UnsupportedOperation("Archiving runs against the database; stop write-behind for these SKUs first")
+
+    def get_archived_allocations(self, order_ids: Iterable[str], skus: Iterable[str]) -> Dict[Tuple[str, str], str]:
+        # Held products are never archived.
+        return {}
+
+    def compact_order_lines(self) -> Dict[str, int]:
+        raise UnsupportedOperation("Compaction runs against the database; stop write-behind for these SKUs first")
+
+    def pending_records(self) -> List[Tuple[str, events.Event]]:
+        """(sku, journal record) for every change since the last commit, in the order they were made."""
+        records: List[Tuple[str, events.Event]] = []
+        for sku, checkpoint in self._checkpoints.items():
+            raised = checkpoint.product.events[checkpoint.committed_events :]
+            records += [(sku, record) for record in journal.outcome_records(checkpoint.product, set(checkpoint.references()), raised)]
+        return records
+
+    def release(self) -> None:
+        """Unlock every SKU this unit of work loaded, keeping the committed events for collection."""
+        for checkpoint in self._checkpoints.values():
+            self.events.extend(checkpoint.product.events)
+            checkpoint.product.events.clear()
+        self._checkpoints.clear()
+        while self._locked:
+            self.store.locks[self._locked.pop()].release()
+
+    def _lock(self, sku: str) -> bool:
+        lock = self.store.locks.get(sku)
+        if lock is None:
+            return False
+        if sku not in self._locked:
+            lock.acquire()
+            self._locked.append(sku)
+        return True
+
+
+class HotAvailabilityRepository(IAvailabilityRepository):
+    """Availability of the write-behind SKUs in memory; changes are applied when the unit of work commits."""
+
+    def __init__(self, store: HotProducts):
+        self.store = store
+        self._pending: List[Callable[[Dict[str, Dict[Optional[date], int]]], None]] = []
+
+    def adjust(self, sku: str, eta: Optional[date], delta: int):
+        def apply(availability):
+            buckets = availability.setdefault(sku, {})
+            buckets[eta] = buckets.get(eta, 0) + delta
+
+        self._pending.append(apply)
+
+    def get(self, sku: str) -> Dict[Optional[date], int]:
+        with self.store.availability_lock:
+            return dict(self.store.availability.get(sku, {}))
+
+    def replace(self, sku: str, buckets: Dict[Optional[date], int]):
+        self._pending.append(lambda availability: availability.__setitem__(sku, dict(buckets)))
+
+    def commit(self) -> None:
+        with self.store.availability_lock:
+            for apply in self._pending:
+                apply(self.store.availability)
+        self._pending.clear()
+
+    def rollback(self) -> None:
+        self._pending.clear()
@@ -1,22 +1,152 @@
 import os
-import dotenv
 import pathlib
 
 
 def get_db_uri():
+    """DB_URI, e.g. "sqlite:////var/lib/allocation/allocation.db", overrides the Postgres settings below."""
+    uri = os.environ.get("DB_URI")
+    if uri:
+        return uri
     host = os.environ.get("DB_HOST", "localhost")
     port = os.environ.get("DB_PORT", 17432)
     password = os.environ.get("DB_PASSWORD")
     user = os.environ.get("DB_USER", "allocation")
     db_name = os.environ.get("DB_NAME", "allocation")
     if not password:
+        import dotenv
+
         pg_env_file = pathlib.Path(__file__).parent.parent.parent / "env" / "postgres.env"
         dotenv.load_dotenv(dotenv_path=pg_env_file)
         password = os.environ.get("POSTGRES_PASSWORD")
     return f"postgresql://{user}:{password}@{host}:{port}/{db_name}"
 
 
+def get_db_prepare_threshold():
+    """
+    DB_PREPARE_THRESHOLD=N switches Postgres to the psycopg (3) driver, which prepares a statement
+    server-side once it has run N times on a connection; unset keeps psycopg2 without prepared statements.
+    """
+    raw = os.environ.get("DB_PREPARE_THRESHOLD", "")
+    return int(raw) if raw else None
+
+
+def get_sqlite_synchronous() -> str:
+    return os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+
+
+def get_sqlite_busy_timeout_ms() -> int:
+    return int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+
+def get_sqlite_cache_size_mb() -> int:
+    return int(os.environ.get("SQLITE_CACHE_SIZE_MB", 64))
+
+
+def get_sqlite_mmap_size_mb() -> int:
+    return int(os.environ.get("SQLITE_MMAP_SIZE_MB", 256))
+
+
+def get_product_store() -> str:
+    """How products are persisted: "tables" (rows per batch and line) or "events" (event-sourced streams)."""
+    return os.environ.get("PRODUCT_STORE", "tables")
+
+
+def get_event_store_snapshot_every() -> int:
+    return int(os.environ.get("EVENT_STORE_SNAPSHOT_EVERY", 100))
+
+
 def get_api_url():
     host = os.environ.get("API_HOST", "localhost")
     port = 8000 if host == "localhost" else 80
     return f"http://{host}:{port}"
+
+
+def get_retry_attempts() -> int:
+    return int(os.environ.get("RETRY_ATTEMPTS", 5))
+
+
+def get_retry_base_delay() -> float:
+    return float(os.environ.get("RETRY_BASE_DELAY", 0.005))
+
+
+def get_retry_max_delay() -> float:
+    return float(os.environ.get("RETRY_MAX_DELAY", 0.2))
+
+
+def get_lock_mode() -> str:
+    return os.environ.get("LOCK_MODE", "optimistic")
+
+
+def get_lock_mode_overrides() -> dict:
+    """Per-SKU lock modes, e.g. LOCK_MODE_OVERRIDES="HOT-LAMP=row,HOT-SOFA=advisory"."""
+    raw = os.environ.get("LOCK_MODE_OVERRIDES", "")
+    overrides = {}
+    for item in filter(None, (part.strip() for part in raw.split(","))):
+        sku, _, mode = item.partition("=")
+        overrides[sku.strip()] = mode.strip()
+    return overrides
+
+
+def get_allocation_batch_window() -> float:
+    """Seconds to collect concurrent /allocate calls per SKU; 0 disables micro-batching."""
+    return float(os.environ.get("ALLOCATION_BATCH_WINDOW_MS", 0)) / 1000
+
+
+def get_allocation_batch_max_size() -> int:
+    return int(os.environ.get("ALLOCATION_BATCH_MAX_SIZE", 500))
+
+
+def get_write_behind_skus() -> frozenset:
+    """SKUs held in memory and written to the database in the background, e.g. WRITE_BEHIND_SKUS="HOT-LAMP,HOT-SOFA"."""
+    return frozenset(filter(None, (sku.strip() for sku in os.environ.get("WRITE_BEHIND_SKUS", "").split(","))))
+
+
+def get_write_behind_journal() -> str:
+    return os.environ.get("WRITE_BEHIND_JOURNAL", "write-behind.journal")
+
+
+def get_write_behind_flush_interval() -> float:
+    return float(os.environ.get("WRITE_BEHIND_FLUSH_MS", 50)) / 1000
+
+
+def get_write_behind_flush_size() -> int:
+    return int(os.environ.get("WRITE_BEHIND_FLUSH_SIZE", 1000))
+
+
+def get_idempotency_ttl() -> float:
+    return float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 24 * 60 * 60))
+
+
+def get_idempotency_lease() -> float:
+    """Seconds a pending reservation holds its key; past that it is taken to be left behind by a crashed worker."""
+    return float(os.environ.get("IDEMPOTENCY_LEASE_SECONDS", 60))
+
+
+def get_idempotency_cache_size() -> int:
+    return int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", 10_000))
+
+
+def get_event_stream_buffer_size() -> int:
+    return int(os.environ.get("EVENT_STREAM_BUFFER_SIZE", 1000))
+
+
+def get_event_stream_overflow() -> str:
+    """What happens to a subscriber whose buffer is full: "drop" its oldest event or "disconnect" it."""
+    return os.environ.get("EVENT_STREAM_OVERFLOW", "drop")
+
+
+def get_slow_request_threshold() -> float:
+    """Seconds above which a request's timing breakdown is logged; 0 disables the slow-request log."""
+    return float(os.environ.get("SLOW_REQUEST_THRESHOLD_MS", 0)) / 1000
+
+
+def get_profiling_enabled() -> bool:
+    return os.environ.get("PROFILING_ENABLED", "").lower() in ("1", "true", "yes")
+
+
+def get_profiling_secret() -> str:
+    return os.environ.get("PROFILING_SECRET", "")
+
+
+def get_profiling_dir() -> str:
+    return os.environ.get("PROFILING_DIR", "profiles")
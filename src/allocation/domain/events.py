@@ -1,6 +1,6 @@
 from dataclasses import dataclass
 from datetime import date
-from typing import Optional
+from typing import Dict, Optional
 
 
 class Event:
@@ -27,7 +27,50 @@ class AllocationRequired(Event):
     qty: int
 
 
+@dataclass
+class OrderAllocationRequired(Event):
+    """All lines of one order, as sku -> qty; with all_or_nothing nothing is kept unless every line fits."""
+
+    orderId: str
+    lines: Dict[str, int]
+    all_or_nothing: bool = False
+
+
 @dataclass
 class BatchQuantityChanged(Event):
     ref: str
     qty: int
+
+
+@dataclass
+class Allocated(Event):
+    orderId: str
+    sku: str
+    qty: int
+    batchref: str
+    eta: Optional[date]
+
+
+@dataclass
+class Deallocated(Event):
+    orderId: str
+    sku: str
+    qty: int
+    batchref: str
+    eta: Optional[date]
+
+
+@dataclass
+class BatchQuantityAdjusted(Event):
+    ref: str
+    sku: str
+    eta: Optional[date]
+    delta: int
+
+
+@dataclass
+class BatchDeleted(Event):
+    ref: str
+    sku: str
+    eta: Optional[date]
+    qty: int
@@ -26,3 +26,27 @@ class UnallocatedLine(DeallocationError):
     """Raised when trying to deallocate a line that was not allocated."""
 
     pass
+
+
+class ConcurrencyError(Exception):
+    """Raised when an aggregate keeps being modified concurrently and retries are exhausted."""
+
+    pass
+
+
+class UnsupportedOperation(Exception):
+    """Raised when the product store in use cannot carry out an operation, e.g. archiving products held in memory."""
+
+    pass
+
+
+class IdempotencyKeyConflict(Exception):
+    """Raised when an idempotency key is reused for a different request."""
+
+    pass
+
+
+class IdempotencyKeyInProgress(Exception):
+    """Raised when an idempotency key is repeated while the request that reserved it is still running."""
+
+    pass
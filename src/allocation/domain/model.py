@@ -22,6 +22,7 @@ class Batch:
         self.eta = eta
         self._purchase_quantity = qty
         self._allocations: Set[OrderLine] = set()
+        self.version_number = 0
 
     def __eq__(self, other: Any) -> bool:
         if not isinstance(other, Batch):
@@ -84,25 +85,37 @@ class Product:
         self.sku = sku
         self.batches = batches or []
         self.version_number = version_number
+        # Opt-in per-batch versioning (LOCK_MODE=batch), set by the repository: see _changed.
+        self.batch_versioning = False
         self.events: List[events.Event] = []
 
     def allocate(self, line: OrderLine) -> Optional[Batch]:
+        allocated_to = next((b for b in self.batches if b.allocated_line(line.orderId)), None)
+        if allocated_to:
+            return allocated_to
         try:
             batch = next(b for b in sorted(self.batches) if b.can_allocate(line))
             batch.allocate(line)
-            self.version_number += 1
+            self._changed(batch, gives_room=False)
         except StopIteration:
             self.events.append(events.OutOfStock(sku=line.sku))
             return None
+        self.events.append(events.Allocated(orderId=line.orderId, sku=line.sku, qty=line.qty, batchref=batch.reference, eta=batch.eta))
         return batch
 
+    def can_allocate(self, line: OrderLine) -> bool:
+        """Whether allocate(line) would succeed, without changing anything."""
+        return any(b.allocated_line(line.orderId) or b.can_allocate(line) for b in self.batches)
+
     def deallocate(self, line: OrderLine) -> str:
-        try:
-            batch = next(b for b in self.batches if b.allocated_line(line.orderId))
-            batch.deallocate(line)
-            return batch.reference
-        except StopIteration:
-            raise exceptions.UnallocatedLine(f"Order line {line.orderId} is not allocated to any batch in Product {self.sku}")
+        for batch in self.batches:
+            allocated = batch.allocated_line(line.orderId)
+            if allocated:
+                batch.deallocate(allocated)
+                self.version_number += 1
+                self._record_deallocation(batch, allocated)
+                return batch.reference
+        raise exceptions.UnallocatedLine(f"Order line {line.orderId} is not allocated to any batch in Product {self.sku}")
 
     @property
     def batches_list(self) -> List[Batch]:
@@ -114,13 +127,40 @@ class Product:
             raise exceptions.InvalidBatchReference(f"Invalid batch reference {reference}")
         return batch
 
+    def add_batch(self, batch: Batch) -> None:
+        self.batches.append(batch)
+        self.version_number += 1
+
     def change_batch_quantity(self, reference: str, qty: int):
         batch = self.get_batch(reference=reference)
+        delta = qty - batch._purchase_quantity
         batch._purchase_quantity = qty
+        self._changed(batch, gives_room=delta > 0)
+        self.events.append(events.BatchQuantityAdjusted(ref=batch.reference, sku=batch.sku, eta=batch.eta, delta=delta))
         while batch.available_quantity < 0:
             line = batch.deallocate_one()
+            self._record_deallocation(batch, line)
             self.events.append(events.AllocationRequired(orderId=line.orderId, sku=line.sku, qty=line.qty))
 
     def delete_batch(self, reference: str) -> None:
         batch = self.get_batch(reference=reference)
+        lost_lines = list(batch._allocations)
         self.batches.remove(batch)
+        self.version_number += 1
+        for line in lost_lines:
+            self._record_deallocation(batch, line)
+        self.events.append(events.BatchDeleted(ref=batch.reference, sku=batch.sku, eta=batch.eta, qty=batch._purchase_quantity))
+
+    def _changed(self, batch: Batch, gives_room: bool) -> None:
+        """
+        With per-batch versioning a change that only takes room from `batch` bumps that batch alone, so
+        allocations landing on different batches do not conflict. Anything giving a batch more room still
+        bumps the product: an allocation that concurrently skipped that batch would no longer be first-fit.
+        """
+        if self.batch_versioning and not gives_room:
+            batch.version_number += 1
+        else:
+            self.version_number += 1
+
+    def _record_deallocation(self, batch: Batch, line: OrderLine) -> None:
+        self.events.append(events.Deallocated(orderId=line.orderId, sku=line.sku, qty=line.qty, batchref=batch.reference, eta=batch.eta))
@@ -0,0 +1,149 @@
+import argparse
+import json
+import sys
+import time
+from datetime import date
+from typing import Iterator
+
+from allocation import config
+from allocation.adapters.idempotency import IdempotencyStore
+from allocation.adapters.journal import Journal
+from allocation.domain import exceptions
+from allocation.service_layer import handlers, replay, unit_of_work
+from allocation.service_layer.messagebus import MessageBus
+from allocation.service_layer.write_behind import WriteBehindWriter
+
+
+def _positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+def _print_progress(report: replay.ReplayReport) -> None:
+    print(json.dumps(report.as_dict()), file=sys.stderr)
+
+
+def _unsupported(error: exceptions.UnsupportedOperation) -> int:
+    print(json.dumps({"error": str(error)}), file=sys.stderr)
+    return 2
+
+
+def replay_command(args: argparse.Namespace) -> int:
+    uow = unit_of_work.from_config()
+    stream = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8")
+    with stream:
+        report = replay.replay(stream, uow=uow, chunk_size=args.chunk_size, on_progress=None if args.quiet else _print_progress)
+    print(json.dumps(report.as_dict()))
+    return 0
+
+
+def _all_skus(uow, page_size: int = 500) -> Iterator[str]:
+    after = None
+    while True:
+        page = handlers.list_products(uow=uow, after=after, limit=page_size)
+        yield from (item["sku"] for item in page["items"])
+        if page["next"] is None:
+            return
+        after = page["next"]
+
+
+def check_availability_command(args: argparse.Namespace) -> int:
+    uow = unit_of_work.from_config()
+    skus = args.skus or _all_skus(uow)
+    inconsistent = 0
+    for sku in skus:
+        try:
+            result = handlers.check_availability(sku=sku, uow=uow, repair=args.repair)
+        except exceptions.InvalidSku as e:
+            result = {"sku": sku, "consistent": False, "error": str(e)}
+        inconsistent += not result["consistent"]
+        print(json.dumps(result))
+    return 1 if inconsistent and not args.repair else 0
+
+
+def purge_idempotency_keys_command(args: argparse.Namespace) -> int:
+    store = IdempotencyStore(session_factory=unit_of_work.get_session_factory(), ttl=args.ttl)
+    print(json.dumps({"purged": store.purge_expired()}))
+    return 0
+
+
+def compact_order_lines_command(args: argparse.Namespace) -> int:
+    uow = unit_of_work.from_config()
+    try:
+        compacted = handlers.compact_order_lines(uow=uow)
+    except exceptions.UnsupportedOperation as e:
+        return _unsupported(e)
+    # Dropped duplicate allocations raise Deallocated, which puts their quantity back into availability.
+    MessageBus.handle_new_events(uow=uow)
+    print(json.dumps(compacted))
+    return 0
+
+
+def archive_batches_command(args: argparse.Namespace) -> int:
+    uow = unit_of_work.from_config()
+    while True:
+        before = args.before or date.today()
+        archived = 0
+        try:
+            while moved := handlers.archive_batches(before=before, uow=uow, limit=args.chunk_size):
+                archived += moved
+        except exceptions.UnsupportedOperation as e:
+            return _unsupported(e)
+        print(json.dumps({"before": before.isoformat(), "archived": archived}))
+        if not args.every:
+            return 0
+        time.sleep(args.every)
+
+
+def flush_journal_command(args: argparse.Namespace) -> int:
+    journal = Journal(args.path or config.get_write_behind_journal())
+    writer = WriteBehindWriter(journal, uow=unit_of_work.from_config(), batch_size=args.chunk_size)
+    writer.submit(list(journal.read()))
+    print(json.dumps({"stored": writer.drain()}))
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m allocation.entrypoints.cli")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    replay_parser = commands.add_parser("replay", help="replay an NDJSON stream of BatchCreated/AllocationRequired/BatchQuantityChanged")
+    replay_parser.add_argument("path", help="NDJSON file, or - for stdin")
+    replay_parser.add_argument("--chunk-size", type=_positive_int, default=500)
+    replay_parser.add_argument("--quiet", action="store_true", help="do not report progress per chunk on stderr")
+    replay_parser.set_defaults(func=replay_command)
+
+    check_parser = commands.add_parser("check-availability", help="verify availability summaries against a full recompute")
+    check_parser.add_argument("skus", nargs="*", help="defaults to every product")
+    check_parser.add_argument("--repair", action="store_true", help="overwrite inconsistent summaries with the recomputed values")
+    check_parser.set_defaults(func=check_availability_command)
+
+    purge_parser = commands.add_parser("purge-idempotency-keys", help="delete stored responses older than the idempotency TTL")
+    purge_parser.add_argument("--ttl", type=float, default=None, help="seconds; defaults to IDEMPOTENCY_TTL_SECONDS")
+    purge_parser.set_defaults(func=purge_idempotency_keys_command)
+
+    archive_parser = commands.add_parser("archive-batches", help="move fully allocated, arrived batches into the archive tables")
+    archive_parser.add_argument("--before", type=date.fromisoformat, default=None, help="eta cutoff, YYYY-MM-DD; defaults to today")
+    archive_parser.add_argument("--chunk-size", type=_positive_int, default=500, help="batches archived per transaction")
+    archive_parser.add_argument("--every", type=float, default=0, help="keep running, archiving every N seconds")
+    archive_parser.set_defaults(func=archive_batches_command)
+
+    compact_parser = commands.add_parser("compact-order-lines", help="delete unallocated and duplicate (orderId, sku) order lines")
+    compact_parser.set_defaults(func=compact_order_lines_command)
+
+    flush_parser = commands.add_parser("flush-journal", help="store what a stopped write-behind service left in its journal")
+    flush_parser.add_argument("path", nargs="?", help="defaults to WRITE_BEHIND_JOURNAL")
+    flush_parser.add_argument("--chunk-size", type=_positive_int, default=1000, help="records stored per transaction")
+    flush_parser.set_defaults(func=flush_journal_command)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,76 +1,372 @@
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime
+from typing import Any, AsyncIterator, Iterator, List, Optional, cast
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
 
-from allocation.adapters import orm
+from allocation import config
+from allocation.adapters import ndjson, orm, profiling
+from allocation.adapters.broadcast import OVERFLOW_POLICIES, EventBroadcaster, Subscription
+from allocation.adapters.idempotency import IdempotencyStore, fingerprint
 from allocation.domain import events, exceptions
-from allocation.entrypoints.schemas import AddBatchRequest, AllocateRequest, DeallocateRequest
-from allocation.service_layer import handlers, unit_of_work
+from allocation.entrypoints.middleware import ProfilingMiddleware, TimingMiddleware
+from allocation.entrypoints.schemas import (
+    AddBatchRequest,
+    AllocateOrderRequest,
+    AllocateRequest,
+    DeallocateRequest,
+    DeleteBatchesRequest,
+    DeleteProductsRequest,
+)
+from allocation.interfaces.main import IUnitOfWork
+from allocation.service_layer import handlers, replay, unit_of_work
+from allocation.service_layer.batching import AllocationBatcher, allocate_bulk
 from allocation.service_layer.messagebus import MessageBus
+from allocation.service_layer.write_behind import WriteBehind
 
-orm.start_mappers()
-app = FastAPI()
-uow = unit_of_work.SqlAlchemyUnitOfWork()
 
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # Importing this module builds neither the engine nor the mappers; a serving process does it at
+    # startup instead of on its first request.
+    orm.start_mappers()
+    _ = uow.session_factory
+    if write_behind:
+        write_behind.start()
+    yield
+    if write_behind:
+        write_behind.stop()
 
-@app.post("/allocate", status_code=201)
-def allocate(payload: AllocateRequest):
-    orderId = payload.orderid
-    sku = payload.sku
-    qty = payload.qty
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(TimingMiddleware)
+if config.get_profiling_enabled():
+    app.add_middleware(ProfilingMiddleware)
+uow = unit_of_work.from_config()
+batcher = AllocationBatcher.from_config()
+write_behind = WriteBehind.from_config(uow)
+idempotency = IdempotencyStore(session_factory=lambda: uow.session_factory())
+broadcaster = EventBroadcaster.from_config()
+MessageBus.LISTENERS.append(broadcaster.publish)
+
+SSE_KEEPALIVE_SECONDS = 15.0
+
+
+def _uow_for(*skus: str) -> IUnitOfWork:
+    """The in-memory unit of work for write-behind SKUs, the database one for the rest; one request cannot mix them."""
+    if write_behind is None:
+        return uow
+    owned = {write_behind.owns(sku) for sku in skus}
+    if owned == {True}:
+        return write_behind.uow
+    if True in owned:
+        raise HTTPException(status_code=400, detail="Write-behind SKUs cannot be combined with other SKUs in one request")
+    return uow
+
+
+def _reject_write_behind(skus=(), references=()) -> None:
+    """Set-based maintenance only sees the database, which lags behind the write-behind products in memory."""
+    if write_behind and (any(map(write_behind.owns, skus)) or any(map(write_behind.owns_batch, references))):
+        raise HTTPException(status_code=400, detail="Not available for write-behind SKUs")
+
+
+def _payload_fingerprint(payload: Any) -> str:
+    if isinstance(payload, list):
+        return fingerprint([item.model_dump() for item in payload])
+    return fingerprint(payload.model_dump() if isinstance(payload, BaseModel) else payload)
+
+
+@contextmanager
+def _idempotent(endpoint: str, key: Optional[str], payload: Any) -> Iterator[Optional[JSONResponse]]:
+    """
+    Yields the stored response for a repeated Idempotency-Key, served without touching the aggregate, or None
+    once the key is reserved for this request. A repeat that arrives while the first request still runs gets
+    409; the reservation is released if the request fails, so that a retry runs it again.
+    """
+    if key is None:
+        yield None
+        return
     try:
-        event = events.AllocationRequired(orderId=orderId, sku=sku, qty=qty)
-        result = MessageBus.handle(event=event, uow=uow)
-        batch_ref = result[0] if result else None
-        return {"batchref": batch_ref}
-    except exceptions.InvalidSku as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except exceptions.UnallocatedLine as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        stored = idempotency.reserve(key=key, endpoint=endpoint, request_fingerprint=_payload_fingerprint(payload))
+    except exceptions.IdempotencyKeyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except exceptions.IdempotencyKeyInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    # reserve() raises for a pending key, so a stored response is a complete one.
+    if stored is not None and stored.status_code is not None:
+        yield JSONResponse(status_code=stored.status_code, content=stored.body, headers={"Idempotent-Replayed": "true"})
+        return
+    try:
+        yield None
+    except BaseException:
+        idempotency.release(key=key, endpoint=endpoint)
+        raise
+
+
+def _remember_response(endpoint: str, key: Optional[str], payload: Any, status_code: int, body: Any) -> Any:
+    if key is not None:
+        idempotency.complete(
+            key=key, endpoint=endpoint, request_fingerprint=_payload_fingerprint(payload), status_code=status_code, body=body
+        )
+    return body
+
+
+@app.post("/allocate", status_code=201)
+@profiling.profiled
+def allocate(payload: AllocateRequest, idempotency_key: Optional[str] = Header(default=None)):
+    with _idempotent("/allocate", idempotency_key, payload) as replayed:
+        if replayed:
+            return replayed
+        orderId = payload.orderid
+        sku = payload.sku
+        qty = payload.qty
+        target = _uow_for(sku)
+        try:
+            event = events.AllocationRequired(orderId=orderId, sku=sku, qty=qty)
+            if batcher:
+                batch_ref = batcher.submit(event=event, uow=target)
+            else:
+                result = MessageBus.handle(event=event, uow=target)
+                batch_ref = result[0] if result else None
+            return _remember_response("/allocate", idempotency_key, payload, 201, {"batchref": batch_ref})
+        except exceptions.InvalidSku as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except exceptions.UnallocatedLine as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except exceptions.ConcurrencyError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.post("/allocate/bulk", status_code=200)
+@profiling.profiled
+def allocate_many(payload: List[AllocateRequest], idempotency_key: Optional[str] = Header(default=None)):
+    with _idempotent("/allocate/bulk", idempotency_key, payload) as replayed:
+        if replayed:
+            return replayed
+        batch = [events.AllocationRequired(orderId=item.orderid, sku=item.sku, qty=item.qty) for item in payload]
+        results = allocate_bulk(batch=batch, uow=_uow_for(*(event.sku for event in batch)))
+        return _remember_response("/allocate/bulk", idempotency_key, payload, 200, {"results": results})
+
+
+@app.post("/orders/allocate", status_code=200)
+@profiling.profiled
+def allocate_order(payload: AllocateOrderRequest, idempotency_key: Optional[str] = Header(default=None)):
+    with _idempotent("/orders/allocate", idempotency_key, payload) as replayed:
+        if replayed:
+            return replayed
+        lines = {line.sku: line.qty for line in payload.lines}
+        if len(lines) != len(payload.lines):
+            raise HTTPException(status_code=400, detail="An order can contain each sku only once")
+        event = events.OrderAllocationRequired(orderId=payload.orderid, lines=lines, all_or_nothing=payload.all_or_nothing)
+        try:
+            # allocate_order returns one result dict per line.
+            results = cast(List[dict], MessageBus.handle(event=event, uow=_uow_for(*lines))[0])
+        except exceptions.ConcurrencyError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        body = {"orderid": payload.orderid, "allocated": all(result["batchref"] for result in results), "results": results}
+        return _remember_response("/orders/allocate", idempotency_key, payload, 200, body)
 
 
 @app.post("/batches/", status_code=201)
+@profiling.profiled
 def add_batch(payload: AddBatchRequest):
     reference = payload.reference
     sku = payload.sku
     qty = payload.qty
     eta = None if payload.eta is None else datetime.fromisoformat(payload.eta).date()
     event = events.BatchCreated(ref=reference, sku=sku, qty=qty, eta=eta)
-    MessageBus.handle(event=event, uow=uow)
+    try:
+        MessageBus.handle(event=event, uow=_uow_for(sku))
+    except exceptions.ConcurrencyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
 
 @app.delete("/batches/{batchref}", status_code=204)
+@profiling.profiled
 def delete_batch(sku: str, batchref: str):
+    target = _uow_for(sku)
     try:
-        handlers.delete_batch(sku=sku, reference=batchref, uow=uow)
+        handlers.delete_batch(sku=sku, reference=batchref, uow=target)
+        MessageBus.handle_new_events(uow=target)
     except exceptions.InvalidSku as e:
         raise HTTPException(status_code=400, detail=str(e))
     except exceptions.InvalidBatchReference as e:
         raise HTTPException(status_code=404, detail=str(e))
 
 
-@app.post("/deallocate", status_code=200)
-def deallocate(payload: DeallocateRequest):
+@app.post("/batches/bulk-delete", status_code=200)
+@profiling.profiled
+def delete_batches(payload: DeleteBatchesRequest):
+    _reject_write_behind(references=payload.references)
     try:
-        batch_ref = handlers.deallocate(
-            sku=payload.sku,
-            orderId=payload.orderid,
-            qty=payload.qty,
-            uow=uow,
-        )
-        return {"batchref": batch_ref}
-    except exceptions.InvalidSku as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except exceptions.UnallocatedLine as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        deleted = handlers.delete_batches(references=payload.references, uow=uow)
+    except exceptions.ConcurrencyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    MessageBus.handle_new_events(uow=uow)
+    return {"deleted": deleted}
+
+
+@app.post("/products/bulk-delete", status_code=200)
+@profiling.profiled
+def delete_products(payload: DeleteProductsRequest):
+    _reject_write_behind(skus=payload.skus)
+    try:
+        deleted = handlers.delete_products(skus=payload.skus, uow=uow)
+    except exceptions.ConcurrencyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    MessageBus.handle_new_events(uow=uow)
+    return {"deleted": deleted}
+
+
+@app.post("/deallocate", status_code=200)
+@profiling.profiled
+def deallocate(payload: DeallocateRequest, idempotency_key: Optional[str] = Header(default=None)):
+    with _idempotent("/deallocate", idempotency_key, payload) as replayed:
+        if replayed:
+            return replayed
+        target = _uow_for(payload.sku)
+        try:
+            batch_ref = handlers.deallocate(
+                sku=payload.sku,
+                orderId=payload.orderid,
+                qty=payload.qty,
+                uow=target,
+            )
+            MessageBus.handle_new_events(uow=target)
+            return _remember_response("/deallocate", idempotency_key, payload, 200, {"batchref": batch_ref})
+        except exceptions.InvalidSku as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except exceptions.UnallocatedLine as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except exceptions.ConcurrencyError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+
+
+def _etag(product_version: int, batch_version: int) -> str:
+    # Under LOCK_MODE=batch, changes that only take room from a batch leave the product version alone.
+    return f'"v{product_version}.{batch_version}"'
+
+
+def _etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
 
 
 @app.get("/batches/{batchref}")
-def get(sku: str, batchref: str):
+@profiling.profiled
+def get(sku: str, batchref: str, response: Response, if_none_match: Optional[str] = Header(default=None)):
+    target = _uow_for(sku)
     try:
-        batch_data = handlers.get_batch(sku=sku, reference=batchref, uow=uow)
+        # The version is read before the batch, so the ETag is never newer than the body. An unknown sku or
+        # batch raises here, before If-None-Match is looked at, so even `*` never turns a 404 into a 304.
+        etag = _etag(*handlers.get_batch_version(sku=sku, reference=batchref, uow=target))
+        if _etag_matches(etag, if_none_match):
+            return Response(status_code=304, headers={"ETag": etag})
+        batch_data = handlers.get_batch(sku=sku, reference=batchref, uow=target)
+        response.headers["ETag"] = etag
         return batch_data
     except exceptions.InvalidSku as e:
         raise HTTPException(status_code=400, detail=str(e))
     except exceptions.InvalidBatchReference as e:
         raise HTTPException(status_code=404, detail=str(e))
+
+
+@app.get("/products")
+@profiling.profiled
+def list_products(after: Optional[str] = None, limit: int = Query(default=100, ge=1, le=1000)):
+    """Keyset-paginated products: pass the returned `next` as `after` to get the following page."""
+    return handlers.list_products(uow=uow, after=after, limit=limit)
+
+
+@app.get("/products/{sku}/batches")
+@profiling.profiled
+def list_batches(sku: str, after: Optional[str] = None, limit: int = Query(default=100, ge=1, le=1000), archived: bool = False):
+    try:
+        # Archived batches are only kept in the database.
+        return handlers.list_batches(sku=sku, uow=uow if archived else _uow_for(sku), after=after, limit=limit, archived=archived)
+    except exceptions.InvalidSku as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except exceptions.UnsupportedOperation as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/products/{sku}/availability")
+@profiling.profiled
+def get_availability(sku: str):
+    try:
+        return handlers.get_availability(sku=sku, uow=_uow_for(sku))
+    except exceptions.InvalidSku as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+async def _aiter_lines(request: Request) -> AsyncIterator[bytes]:
+    buffer = b""
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+def _replay_uow_for(event: events.Event) -> IUnitOfWork:
+    """Like _uow_for, per replayed event; a quantity change only names its batch."""
+    if write_behind is None:
+        return uow
+    if isinstance(event, events.BatchQuantityChanged):
+        owned = write_behind.owns_batch(event.ref)
+    else:
+        owned = isinstance(event, (events.BatchCreated, events.AllocationRequired)) and write_behind.owns(event.sku)
+    return write_behind.uow if owned else uow
+
+
+@profiling.profiled
+def _replay_lines(lines: List[bytes], report: replay.ReplayReport) -> None:
+    replay.replay_chunk(list(replay.parse_events(lines, report)), uow=uow, report=report, uow_for=_replay_uow_for)
+
+
+@app.post("/replay", status_code=200)
+async def replay_events(request: Request, chunk_size: int = Query(default=500, ge=1)):
+    """Replay an NDJSON event stream uploaded as the request body, chunk by chunk."""
+    report = replay.ReplayReport()
+    lines: List[bytes] = []
+    async for line in _aiter_lines(request):
+        lines.append(line)
+        if len(lines) >= chunk_size:
+            await run_in_threadpool(_replay_lines, lines, report)
+            lines = []
+    if lines:
+        await run_in_threadpool(_replay_lines, lines, report)
+    return report.finish().as_dict()
+
+
+def _sse_message(event: events.Event) -> str:
+    return f"event: {type(event).__name__}\ndata: {ndjson.encode_event(event)}\n\n"
+
+
+async def _sse_stream(subscription: Subscription) -> AsyncIterator[str]:
+    try:
+        while True:
+            try:
+                event = await subscription.get(timeout=SSE_KEEPALIVE_SECONDS)
+            except StopAsyncIteration:
+                # Disconnected for falling behind; EventSource clients reconnect on their own.
+                return
+            yield _sse_message(event) if event is not None else ": keepalive\n\n"
+    finally:
+        subscription.close()
+
+
+@app.get("/events/stream")
+async def stream_events(sku: Optional[List[str]] = Query(default=None), overflow: Optional[str] = None):
+    """Server-Sent Events of allocation changes as they are committed, optionally only for the given SKUs."""
+    if overflow is not None and overflow not in OVERFLOW_POLICIES:
+        raise HTTPException(status_code=400, detail=f"overflow must be one of {', '.join(OVERFLOW_POLICIES)}")
+    subscription = broadcaster.subscribe(skus=sku, overflow=overflow)
+    return StreamingResponse(_sse_stream(subscription), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
@@ -0,0 +1,132 @@
+import hmac
+import json
+import logging
+import os
+import re
+import time
+from typing import List, Optional, Tuple
+
+from allocation import config
+from allocation.adapters import profiling, sqlstats, timing
+
+logger = logging.getLogger("allocation.slow_requests")
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware that times each HTTP request by phase (see allocation.adapters.timing) and counts its
+    SQL statements, sends both in a Server-Timing header and logs requests slower than `slow_threshold` seconds.
+    """
+
+    def __init__(self, app, slow_threshold: Optional[float] = None):
+        self.app = app
+        self.slow_threshold = config.get_slow_request_threshold() if slow_threshold is None else slow_threshold
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = timing.start()
+        queries, queries_token = sqlstats.push()
+        status_code = 500
+        total: Optional[float] = None
+
+        async def send_with_timing(message):
+            nonlocal status_code, total
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                total = timings.elapsed
+                headers = list(message.get("headers", []))
+                sql = f'sql;desc="{queries.statements} statements";dur={queries.seconds * 1000:.2f}'
+                server_timing = f"{timings.server_timing(total)}, {sql}"
+                headers.append((b"server-timing", server_timing.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            sqlstats.pop(queries_token)
+            if self.slow_threshold > 0 and total is not None and total >= self.slow_threshold:
+                record = {
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status_code,
+                    "phases_ms": {name: round(ms, 2) for name, ms in timings.breakdown(total).items()},
+                    "sql_statements": queries.statements,
+                    "sql_ms": round(queries.seconds * 1000, 2),
+                }
+                logger.warning("slow request %s", json.dumps(record))
+
+
+def _skipped_header(request: profiling.ProfiledRequest) -> List[Tuple[bytes, bytes]]:
+    return [(b"x-profile-skipped", str(request.skipped).encode())] if request.skipped else []
+
+
+class ProfilingMiddleware:
+    """
+    Profiles single requests that carry `X-Profile: <PROFILING_SECRET>`. The profile is written to
+    `directory` (path returned in `X-Profile-Path`), or with `X-Profile-Output: inline` returned as the
+    text/plain response body instead of the real one (status in `X-Profiled-Status`). While another
+    request is being profiled the profile stays empty, flagged by `X-Profile-Skipped`.
+    Only installed when PROFILING_ENABLED is set.
+    """
+
+    def __init__(self, app, secret: Optional[str] = None, directory: Optional[str] = None):
+        self.app = app
+        self.secret = (config.get_profiling_secret() if secret is None else secret).encode()
+        self.directory = config.get_profiling_dir() if directory is None else directory
+
+    def _requested(self, scope) -> Optional[bool]:
+        """None when the request should not be profiled, else whether the profile goes inline."""
+        headers = dict(scope.get("headers", []))
+        token = headers.get(b"x-profile")
+        if not self.secret or token is None or not hmac.compare_digest(token, self.secret):
+            return None
+        return headers.get(b"x-profile-output", b"").lower() == b"inline"
+
+    def _path_for(self, scope) -> str:
+        name = re.sub(r"[^A-Za-z0-9]+", "-", scope["path"]).strip("-") or "root"
+        return os.path.join(self.directory, f"{time.strftime('%Y%m%dT%H%M%S')}-{time.perf_counter_ns()}-{scope['method']}-{name}.prof")
+
+    async def __call__(self, scope, receive, send):
+        inline = self._requested(scope) if scope["type"] == "http" else None
+        if inline is None:
+            await self.app(scope, receive, send)
+            return
+
+        request = profiling.start()
+        if inline:
+            await self._respond_inline(request, scope, receive, send)
+            return
+
+        async def send_with_profile_path(message):
+            if message["type"] == "http.response.start":
+                os.makedirs(self.directory, exist_ok=True)
+                path = self._path_for(scope)
+                request.dump(path)
+                headers = [*message.get("headers", []), (b"x-profile-path", path.encode()), *_skipped_header(request)]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_profile_path)
+
+    async def _respond_inline(self, request: profiling.ProfiledRequest, scope, receive, send):
+        status_code = 500
+
+        async def swallow(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+
+        await self.app(scope, receive, swallow)
+        body = request.report().encode()
+        headers = [
+            (b"content-type", b"text/plain; charset=utf-8"),
+            (b"content-length", str(len(body)).encode()),
+            (b"x-profiled-status", str(status_code).encode()),
+            *_skipped_header(request),
+        ]
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
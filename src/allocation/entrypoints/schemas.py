@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Optional
 
 
 class AllocateRequest(BaseModel):
@@ -8,6 +8,17 @@ class AllocateRequest(BaseModel):
     qty: int
 
 
+class OrderLineRequest(BaseModel):
+    sku: str
+    qty: int
+
+
+class AllocateOrderRequest(BaseModel):
+    orderid: str
+    lines: List[OrderLineRequest] = Field(min_length=1)
+    all_or_nothing: bool = False
+
+
 class DeallocateRequest(BaseModel):
     sku: str
     orderid: str
@@ -19,3 +30,11 @@ class AddBatchRequest(BaseModel):
     sku: str
     qty: int
     eta: Optional[str] = None
+
+
+class DeleteBatchesRequest(BaseModel):
+    references: List[str] = Field(min_length=1)
+
+
+class DeleteProductsRequest(BaseModel):
+    skus: List[str] = Field(min_length=1)
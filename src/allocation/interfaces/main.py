@@ -1,4 +1,6 @@
-from typing import Callable, Dict, List, Optional, Protocol, Set, Type
+from contextlib import contextmanager
+from datetime import date
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Protocol, Set, Tuple, Type
 
 from allocation.domain import events, model
 
@@ -29,6 +31,15 @@ class ISession(Protocol):
     def execute(self, statement, params=None):
         raise NotImplementedError
 
+    def get_bind(self):
+        raise NotImplementedError
+
+    def connection(self, *, execution_options=None):
+        raise NotImplementedError
+
+    def in_transaction(self) -> bool:
+        raise NotImplementedError
+
 
 class ICallableSession(Protocol):
     def __call__(self) -> ISession:
@@ -41,6 +52,7 @@ class IRepository(Protocol):
     """
 
     seen: Set[model.Product]
+    events: List[events.Event]
 
     def add(self, product: model.Product):
         raise NotImplementedError
@@ -51,16 +63,82 @@ class IRepository(Protocol):
     def get_by_batchref(self, batchref: str) -> Optional[model.Product]:
         raise NotImplementedError
 
+    def get_many(self, skus: Iterable[str]) -> List[model.Product]:
+        """Products for the given skus (unknown skus are skipped), loaded together."""
+        raise NotImplementedError
+
+    def get_version(self, sku: str) -> Optional[int]:
+        """Current version_number of a product without loading the aggregate."""
+        raise NotImplementedError
+
+    def get_batch_version(self, sku: str, reference: str) -> Optional[Tuple[int, int]]:
+        """
+        (version_number of the product, version_number of batch `reference`) without loading the aggregate, or None
+        unless the product holds that batch. Under LOCK_MODE=batch some changes only bump the batch's version.
+        """
+        raise NotImplementedError
+
     def list(self) -> List[model.Product]:
         raise NotImplementedError
 
+    def iter_all(self, batch_size: int = 500, read_only: bool = True) -> Iterator[model.Product]:
+        """Every product, streamed; read-only products are not tracked in `seen`."""
+        raise NotImplementedError
+
+    def page_products(self, after: Optional[str], limit: int) -> List[Tuple[str, int]]:
+        """Keyset page of (sku, version_number), ordered by sku."""
+        raise NotImplementedError
+
+    def page_batches(self, sku: str, after: Optional[str], limit: int, archived: bool = False) -> List[dict]:
+        """Keyset page of {"reference", "sku", "eta", "qty", "allocated"}, ordered by reference; `archived` pages history."""
+        raise NotImplementedError
+
+    def archive_batches(self, before: date, limit: int) -> int:
+        """Move up to `limit` fully allocated batches with no eta, or an eta before `before`, out of their products."""
+        raise NotImplementedError
+
+    def get_archived_allocations(self, order_ids: Iterable[str], skus: Iterable[str]) -> Dict[Tuple[str, str], str]:
+        """
+        {(orderId, sku): batch reference} of the lines among `order_ids` x `skus` held by archived batches.
+        Those lines are no longer part of their products but stay allocated, so they must not be allocated again.
+        """
+        raise NotImplementedError
+
     def delete(self, sku: str):
         raise NotImplementedError
 
+    def delete_batches(self, references: Iterable[str], sku: Optional[str] = None) -> int:
+        """Set-based delete; events for lost allocations and deleted batches are appended to `events`."""
+        raise NotImplementedError
+
+    def delete_products(self, skus: Iterable[str]) -> int:
+        raise NotImplementedError
+
+    def compact_order_lines(self) -> Dict[str, int]:
+        """Drop unallocated order lines and duplicate (orderId, sku) lines; lost allocations are appended to `events`."""
+        raise NotImplementedError
+
+
+class IAvailabilityRepository(Protocol):
+    """
+    Per-SKU available quantity, bucketed by batch ETA (None = in stock)
+    """
+
+    def adjust(self, sku: str, eta: Optional[date], delta: int):
+        raise NotImplementedError
+
+    def get(self, sku: str) -> Dict[Optional[date], int]:
+        raise NotImplementedError
+
+    def replace(self, sku: str, buckets: Dict[Optional[date], int]):
+        raise NotImplementedError
+
 
 class IUnitOfWork(Protocol):
-    session_factory: ICallableSession
+    # None for a unit of work that opens no database sessions, e.g. one over products held in memory.
+    session_factory: Optional[ICallableSession]
     products: IRepository
+    availability: IAvailabilityRepository
 
     def __enter__(self) -> "IUnitOfWork":
         return self
@@ -68,6 +146,12 @@ class IUnitOfWork(Protocol):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.rollback()
 
+    @contextmanager
+    def read_only(self) -> Iterator["IUnitOfWork"]:
+        """`with uow.read_only():` for a unit of work that never commits; a store may then skip taking its write lock."""
+        with self:
+            yield self
+
     def commit(self):
         raise NotImplementedError
 
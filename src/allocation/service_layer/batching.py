@@ -0,0 +1,112 @@
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from allocation import config
+from allocation.adapters import timing
+from allocation.domain import events, exceptions
+from allocation.interfaces.main import IUnitOfWork
+from allocation.service_layer import handlers
+from allocation.service_layer.messagebus import MessageBus
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingBatch:
+    def __init__(self):
+        self.items: List[Tuple[events.AllocationRequired, Future]] = []
+        self.full = threading.Event()
+
+
+class AllocationBatcher:
+    """
+    Group-commit dispatcher for AllocationRequired events.
+
+    The first caller for a SKU becomes the batch leader: it waits up to `window` seconds
+    (or until `max_size` lines arrived), allocates every collected line against one loaded
+    product, commits once and hands each waiting caller its own batchref.
+    """
+
+    def __init__(self, window: float, max_size: int = 500):
+        self.window = window
+        self.max_size = max_size
+        self._pending: Dict[str, _PendingBatch] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls) -> Optional["AllocationBatcher"]:
+        window = config.get_allocation_batch_window()
+        if window <= 0:
+            return None
+        return cls(window=window, max_size=config.get_allocation_batch_max_size())
+
+    def submit(self, event: events.AllocationRequired, uow: IUnitOfWork) -> Optional[str]:
+        future: Future = Future()
+        with self._lock:
+            pending = self._pending.get(event.sku)
+            is_leader = pending is None
+            if pending is None:
+                pending = self._pending[event.sku] = _PendingBatch()
+            pending.items.append((event, future))
+            if len(pending.items) >= self.max_size:
+                del self._pending[event.sku]
+                pending.full.set()
+
+        if is_leader:
+            with timing.phase("batch_wait"):
+                pending.full.wait(timeout=self.window)
+            with self._lock:
+                if self._pending.get(event.sku) is pending:
+                    del self._pending[event.sku]
+            self._flush(pending.items, uow)
+        with timing.phase("batch_wait"):
+            return future.result()
+
+    def _flush(self, items: List[Tuple[events.AllocationRequired, Future]], uow: IUnitOfWork) -> None:
+        try:
+            with timing.phase("handler"):
+                results = handlers.allocate_many(batch=[event for event, _ in items], uow=uow)
+            follow_ups = list(uow.collect_new_events())
+        except Exception as e:
+            for _, future in items:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(items, results):
+            future.set_result(result)
+        for follow_up in follow_ups:
+            try:
+                MessageBus.handle(event=follow_up, uow=uow, cascaded=True)
+            except Exception:
+                logger.exception("Failed to handle %r raised by a batched allocation", follow_up)
+
+
+def allocate_bulk(batch: List[events.AllocationRequired], uow: IUnitOfWork) -> List[dict]:
+    """
+    Allocate many order lines, loading each product once and committing once per SKU.
+    Returns one result per line, in input order; per-SKU failures are reported, not raised.
+    """
+    by_sku: Dict[str, List[int]] = {}
+    for index, event in enumerate(batch):
+        by_sku.setdefault(event.sku, []).append(index)
+
+    results: List[dict] = [{"orderid": event.orderId, "sku": event.sku, "batchref": None, "error": None} for event in batch]
+    for sku, indexes in by_sku.items():
+        try:
+            batchrefs = handlers.allocate_many(batch=[batch[i] for i in indexes], uow=uow)
+        except (exceptions.InvalidSku, exceptions.ConcurrencyError) as e:
+            for i in indexes:
+                results[i]["error"] = str(e)
+            continue
+        for i, batchref in zip(indexes, batchrefs):
+            results[i]["batchref"] = batchref
+            if batchref is None:
+                results[i]["error"] = f"Out of stock for sku {sku}"
+        try:
+            MessageBus.handle_new_events(uow=uow)
+        except Exception as e:
+            # The allocations are committed and keep their batchref; only what follows from them failed.
+            logger.exception("Failed to handle the events raised by allocating sku %s", sku)
+            for i in indexes:
+                results[i]["error"] = results[i]["error"] or f"Allocated, but handling its events failed: {e}"
+    return results
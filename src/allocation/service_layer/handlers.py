@@ -1,13 +1,34 @@
-from typing import Optional
+from datetime import date
+from typing import Dict, List, Optional, Tuple
 
 from allocation.adapters import email
 from allocation.domain import events, model
 from allocation.domain.exceptions import InvalidBatchReference, InvalidSku
 from allocation.interfaces.main import IUnitOfWork
+from allocation.service_layer.retry import retry_on_conflict
+
+
+def get_product_version(sku: str, uow: IUnitOfWork) -> int:
+    with uow.read_only():
+        version = uow.products.get_version(sku=sku)
+        if version is None:
+            raise InvalidSku(f"Invalid sku {sku}")
+        return version
+
+
+def get_batch_version(sku: str, reference: str, uow: IUnitOfWork) -> Tuple[int, int]:
+    """Versions of the product and of the batch, raising like get_batch for an unknown sku or reference."""
+    with uow.read_only():
+        version = uow.products.get_batch_version(sku=sku, reference=reference)
+        if version is not None:
+            return version
+        if uow.products.get_version(sku=sku) is None:
+            raise InvalidSku(f"Invalid sku {sku}")
+        raise InvalidBatchReference(f"Batch {reference} not found")
 
 
 def get_batch(sku: str, reference: str, uow: IUnitOfWork) -> dict:
-    with uow:
+    with uow.read_only():
         product = uow.products.get(sku=sku)
         if not product:
             raise InvalidSku(f"Invalid sku {sku}")
@@ -23,19 +44,111 @@ def get_batch(sku: str, reference: str, uow: IUnitOfWork) -> dict:
         }
 
 
+def _page(items: List[dict], limit: int, key: str) -> dict:
+    """Keyset page: `next` is the `after` value for the following page, None on the last one."""
+    return {"items": items[:limit], "next": items[limit - 1][key] if len(items) > limit else None}
+
+
+def list_products(uow: IUnitOfWork, after: Optional[str] = None, limit: int = 100) -> dict:
+    with uow.read_only():
+        rows = uow.products.page_products(after=after, limit=limit + 1)
+    return _page([{"sku": sku, "version": version} for sku, version in rows], limit, key="sku")
+
+
+def list_batches(sku: str, uow: IUnitOfWork, after: Optional[str] = None, limit: int = 100, archived: bool = False) -> dict:
+    with uow.read_only():
+        rows = uow.products.page_batches(sku=sku, after=after, limit=limit + 1, archived=archived)
+        if not rows and uow.products.get_version(sku=sku) is None:
+            raise InvalidSku(f"Invalid sku {sku}")
+    items = [{**row, "eta": row["eta"].isoformat() if row["eta"] else None, "available": row["qty"] - row["allocated"]} for row in rows]
+    return _page(items, limit, key="reference")
+
+
+@retry_on_conflict
 def allocate(event: events.AllocationRequired, uow: IUnitOfWork) -> Optional[str]:
     line = model.OrderLine(orderId=event.orderId, sku=event.sku, qty=event.qty)
     with uow:
         product = uow.products.get(sku=line.sku)
         if not product:
             raise InvalidSku(f"Invalid sku {line.sku}")
+        archived = uow.products.get_archived_allocations([line.orderId], [line.sku])
+        if archived:
+            # Allocated before its batch was archived, e.g. a redelivered request.
+            return archived[line.orderId, line.sku]
         batch = product.allocate(line=line)
+        # Read before committing, which expires the batch.
+        batchref = batch.reference if batch else None
+        uow.commit()
+        return batchref
+
+
+@retry_on_conflict
+def allocate_many(batch: List[events.AllocationRequired], uow: IUnitOfWork) -> List[Optional[str]]:
+    """Allocate several lines of one SKU against a single loaded product and commit once."""
+    skus = {event.sku for event in batch}
+    if len(skus) != 1:
+        raise ValueError(f"allocate_many expects lines of exactly one sku, got {sorted(skus)}")
+    [sku] = skus
+    with uow:
+        product = uow.products.get(sku=sku)
+        if not product:
+            raise InvalidSku(f"Invalid sku {sku}")
+        archived = uow.products.get_archived_allocations([event.orderId for event in batch], [sku])
+        results: List[Optional[str]] = []
+        for event in batch:
+            if (event.orderId, sku) in archived:
+                results.append(archived[event.orderId, sku])
+                continue
+            batch_allocated = product.allocate(line=model.OrderLine(orderId=event.orderId, sku=event.sku, qty=event.qty))
+            results.append(batch_allocated.reference if batch_allocated else None)
         uow.commit()
-        if batch:
-            return batch.reference
-        return None
+        return results
 
 
+@retry_on_conflict
+def allocate_order(event: events.OrderAllocationRequired, uow: IUnitOfWork) -> List[dict]:
+    """
+    Allocate every line of a multi-sku order against products loaded in one query, committing once.
+    Returns one {"sku", "qty", "batchref", "error"} per line. In all-or-nothing mode nothing is
+    allocated unless every line fits; best-effort keeps whatever could be allocated.
+    """
+    with uow:
+        products = {product.sku: product for product in uow.products.get_many(event.lines)}
+        archived = uow.products.get_archived_allocations([event.orderId], event.lines)
+        lines = [model.OrderLine(orderId=event.orderId, sku=sku, qty=qty) for sku, qty in event.lines.items()]
+        results = [{"sku": line.sku, "qty": line.qty, "batchref": archived.get((line.orderId, line.sku)), "error": None} for line in lines]
+
+        if event.all_or_nothing:
+            # An order has one line per sku, so the lines cannot compete for stock: checking each
+            # line on its own before allocating any of them is enough.
+            for line, result in zip(lines, results):
+                product = products.get(line.sku)
+                if not product:
+                    result["error"] = f"Invalid sku {line.sku}"
+                elif not result["batchref"] and not product.can_allocate(line):
+                    result["error"] = f"Out of stock for sku {line.sku}"
+            if any(result["error"] for result in results):
+                for result in results:
+                    result["error"] = result["error"] or "Not allocated: another line of the order failed"
+                return results
+
+        for line, result in zip(lines, results):
+            product = products.get(line.sku)
+            if not product:
+                result["error"] = f"Invalid sku {line.sku}"
+                continue
+            if result["batchref"]:
+                continue
+            batch = product.allocate(line=line)
+            if batch:
+                result["batchref"] = batch.reference
+            else:
+                result["error"] = f"Out of stock for sku {line.sku}"
+        uow.commit()
+        return results
+
+
+@retry_on_conflict
 def deallocate(sku: str, orderId: str, qty: int, uow: IUnitOfWork) -> str:
     line = model.OrderLine(orderId=orderId, sku=sku, qty=qty)
     with uow:
@@ -47,6 +160,7 @@ def deallocate(sku: str, orderId: str, qty: int, uow: IUnitOfWork) -> str:
         return batchref
 
 
+@retry_on_conflict
 def add_batch(
     event: events.BatchCreated,
     uow: IUnitOfWork,
@@ -62,20 +176,57 @@ def add_batch(
             qty=event.qty,
             eta=event.eta,
         )
-        product.batches.append(batch)
+        product.add_batch(batch)
+        uow.availability.adjust(sku=event.sku, eta=event.eta, delta=event.qty)
         uow.commit()
     return batch  # TODO do not return ORM object, return batchref str
 
 
+@retry_on_conflict
 def delete_batch(sku: str, reference: str, uow: IUnitOfWork) -> None:
     with uow:
-        product = uow.products.get(sku=sku)
-        if not product:
+        if uow.products.get_version(sku=sku) is None:
             raise InvalidSku(f"Invalid sku {sku}")
-        product.delete_batch(reference=reference)
+        if not uow.products.delete_batches([reference], sku=sku):
+            raise InvalidBatchReference(f"Invalid batch reference {reference}")
         uow.commit()
 
 
+@retry_on_conflict
+def delete_batches(references: List[str], uow: IUnitOfWork) -> int:
+    """Set-based delete of many batches, e.g. for end-of-season cleanups; unknown references are ignored."""
+    with uow:
+        deleted = uow.products.delete_batches(references)
+        uow.commit()
+        return deleted
+
+
+@retry_on_conflict
+def delete_products(skus: List[str], uow: IUnitOfWork) -> int:
+    with uow:
+        deleted = uow.products.delete_products(skus)
+        uow.commit()
+        return deleted
+
+
+@retry_on_conflict
+def archive_batches(before: date, uow: IUnitOfWork, limit: int = 500) -> int:
+    """Archive up to `limit` closed batches in one transaction; call again until it returns 0."""
+    with uow:
+        archived = uow.products.archive_batches(before=before, limit=limit)
+        uow.commit()
+        return archived
+
+
+@retry_on_conflict
+def compact_order_lines(uow: IUnitOfWork) -> Dict[str, int]:
+    with uow:
+        compacted = uow.products.compact_order_lines()
+        uow.commit()
+        return compacted
+
+
+@retry_on_conflict
 def change_batch_quantity(event: events.BatchQuantityChanged, uow: IUnitOfWork):
     with uow:
         product = uow.products.get_by_batchref(batchref=event.ref)
@@ -90,3 +241,44 @@ def send_out_of_stock_notification(event: events.OutOfStock, uow: IUnitOfWork) -
         "stock@made.com",
         f"Out of stock for {event.sku}",
     )
+
+
+def _availability_view(sku: str, buckets: Dict[Optional[date], int]) -> dict:
+    incoming = sorted((eta, qty) for eta, qty in buckets.items() if eta is not None and qty)
+    return {
+        "sku": sku,
+        "in_stock": buckets.get(None, 0),
+        "incoming": [{"eta": eta.isoformat(), "qty": qty} for eta, qty in incoming],
+        "total": sum(buckets.values()),
+    }
+
+
+def get_availability(sku: str, uow: IUnitOfWork) -> dict:
+    with uow.read_only():
+        buckets = uow.availability.get(sku=sku)
+        if not buckets and uow.products.get_version(sku=sku) is None:
+            raise InvalidSku(f"Invalid sku {sku}")
+        return _availability_view(sku, buckets)
+
+
+def check_availability(sku: str, uow: IUnitOfWork, repair: bool = False) -> dict:
+    """Recompute availability from the full aggregate and compare it with the incremental summary."""
+    with uow:
+        product = uow.products.get(sku=sku)
+        if not product:
+            raise InvalidSku(f"Invalid sku {sku}")
+        expected: Dict[Optional[date], int] = {}
+        for batch in product.batches:
+            expected[batch.eta] = expected.get(batch.eta, 0) + batch.available_quantity
+        stored = {eta: qty for eta, qty in uow.availability.get(sku=sku).items() if qty}
+        expected = {eta: qty for eta, qty in expected.items() if qty}
+        consistent = stored == expected
+        if not consistent and repair:
+            uow.availability.replace(sku=sku, buckets=expected)
+            uow.commit()
+        return {
+            "sku": sku,
+            "consistent": consistent,
+            "expected": _availability_view(sku, expected),
+            "stored": _availability_view(sku, stored),
+        }
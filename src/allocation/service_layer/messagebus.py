@@ -1,26 +1,60 @@
+import logging
 from collections import deque
 from typing import Callable, Dict, List, Type
 
+from allocation.adapters import profiling, timing
 from allocation.domain import events
 from allocation.interfaces.main import IUnitOfWork, IMessageBus
 from allocation.service_layer import handlers
 
+logger = logging.getLogger(__name__)
+
 
 class MessageBus(IMessageBus):
     HANDLERS: Dict[Type[events.Event], List[Callable]] = {
         events.AllocationRequired: [handlers.allocate],
+        events.OrderAllocationRequired: [handlers.allocate_order],
         events.BatchCreated: [handlers.add_batch],
         events.BatchQuantityChanged: [handlers.change_batch_quantity],
         events.OutOfStock: [handlers.send_out_of_stock_notification],
+        # Outcomes: the unit of work that raised them has already applied them to the availability summaries.
+        events.Allocated: [],
+        events.Deallocated: [],
+        events.BatchQuantityAdjusted: [],
+        events.BatchDeleted: [],
     }
+    # Called with every event once all of its handlers have committed, e.g. to stream it to subscribers.
+    LISTENERS: List[Callable[[events.Event], None]] = []
 
     @staticmethod
-    def handle(event: events.Event, uow: IUnitOfWork) -> List[str]:
+    @profiling.profiled
+    def handle(event: events.Event, uow: IUnitOfWork, cascaded: bool = False) -> List[str]:
+        """`cascaded` marks an event raised by a handler that was called directly, for request timings."""
         results = []
         queue = deque([event])
+        phase = "cascade" if cascaded else "handler"
         while queue:
             event = queue.popleft()
-            for handler in MessageBus.HANDLERS[type(event)]:
-                results.append(handler(event=event, uow=uow))
-                queue.extend(uow.collect_new_events())
+            with timing.phase(phase):
+                for handler in MessageBus.HANDLERS[type(event)]:
+                    results.append(handler(event=event, uow=uow))
+                    queue.extend(uow.collect_new_events())
+            MessageBus.notify_listeners(event)
+            phase = "cascade"
         return results
+
+    @staticmethod
+    def handle_new_events(uow: IUnitOfWork) -> List[str]:
+        """Dispatch events raised by a handler that was called directly rather than through handle()."""
+        results = []
+        for event in list(uow.collect_new_events()):
+            results.extend(MessageBus.handle(event=event, uow=uow, cascaded=True))
+        return results
+
+    @staticmethod
+    def notify_listeners(event: events.Event) -> None:
+        for listener in MessageBus.LISTENERS:
+            try:
+                listener(event)
+            except Exception:
+                logger.exception("Event listener %r failed for %r", listener, event)
@@ -0,0 +1,106 @@
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, List, Optional, TypeVar, Union
+
+from allocation.adapters import ndjson
+from allocation.domain import events, exceptions
+from allocation.interfaces.main import IUnitOfWork
+from allocation.service_layer.messagebus import MessageBus
+
+logger = logging.getLogger(__name__)
+
+REPLAYABLE_EVENTS = (events.BatchCreated, events.AllocationRequired, events.BatchQuantityChanged)
+# Outcomes of individual events that are recorded without aborting the replay.
+EVENT_ERRORS = (exceptions.AllocationError, exceptions.DeallocationError, exceptions.ConcurrencyError)
+
+T = TypeVar("T")
+
+
+@dataclass
+class ReplayReport:
+    events: int = 0
+    failed: int = 0
+    chunks: int = 0
+    started: float = field(default_factory=time.perf_counter)
+    finished: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def throughput(self) -> float:
+        return self.events / self.elapsed if self.elapsed else 0.0
+
+    def finish(self) -> "ReplayReport":
+        self.finished = time.perf_counter()
+        return self
+
+    def as_dict(self) -> dict:
+        return {
+            "events": self.events,
+            "failed": self.failed,
+            "chunks": self.chunks,
+            "elapsed_s": round(self.elapsed, 3),
+            "events_per_s": round(self.throughput, 1),
+        }
+
+
+def parse_events(lines: Iterable[Union[str, bytes]], report: ReplayReport) -> Iterator[events.Event]:
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            event = ndjson.decode_event(line)
+        except (ValueError, TypeError) as e:
+            report.failed += 1
+            logger.warning("Skipping line %s: %s", number, e)
+            continue
+        if not isinstance(event, REPLAYABLE_EVENTS):
+            report.failed += 1
+            logger.warning("Skipping line %s: %s is not replayable", number, type(event).__name__)
+            continue
+        yield event
+
+
+def chunked(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    iterator = iter(items)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def replay_chunk(
+    chunk: List[events.Event],
+    uow: IUnitOfWork,
+    report: ReplayReport,
+    uow_for: Optional[Callable[[events.Event], IUnitOfWork]] = None,
+) -> ReplayReport:
+    """`uow_for` picks the unit of work per event, e.g. to send write-behind SKUs to their own; `uow` otherwise."""
+    for event in chunk:
+        report.events += 1
+        try:
+            MessageBus.handle(event=event, uow=uow_for(event) if uow_for else uow)
+        except EVENT_ERRORS as e:
+            report.failed += 1
+            logger.debug("Replay of %r failed: %s", event, e)
+    report.chunks += 1
+    return report
+
+
+def replay(
+    lines: Iterable[Union[str, bytes]],
+    uow: IUnitOfWork,
+    chunk_size: int = 500,
+    on_progress: Optional[Callable[[ReplayReport], None]] = None,
+) -> ReplayReport:
+    """Stream NDJSON event records through the message bus; memory use is bounded by chunk_size."""
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be at least 1, got {chunk_size}")
+    report = ReplayReport()
+    for chunk in chunked(parse_events(lines, report), chunk_size):
+        replay_chunk(chunk, uow, report)
+        if on_progress:
+            on_progress(report)
+    return report.finish()
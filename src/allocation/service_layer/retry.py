@@ -0,0 +1,130 @@
+import functools
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional, TypeVar
+
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm.exc import StaleDataError
+
+from allocation import config
+from allocation.adapters import timing
+from allocation.domain.exceptions import ConcurrencyError
+
+logger = logging.getLogger(__name__)
+
+# serialization_failure and deadlock_detected
+RETRYABLE_SQLSTATES = ("40001", "40P01")
+# A unique_violation is a conflict only when two transactions create the same product; a retry then finds it.
+UNIQUE_VIOLATION = "23505"
+RETRYABLE_CONSTRAINTS = ("products_pkey", "product_streams_pkey")
+# SQLITE_BUSY and SQLITE_LOCKED: the write lock was not free within busy_timeout
+RETRYABLE_SQLITE_ERRORS = (5, 6)
+
+T = TypeVar("T")
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, StaleDataError):
+        return True
+    if isinstance(error, DBAPIError):
+        orig = error.orig
+        sqlite_error = getattr(orig, "sqlite_errorcode", None)
+        if sqlite_error is not None:
+            # Extended result codes keep the primary code in the low byte.
+            return sqlite_error & 0xFF in RETRYABLE_SQLITE_ERRORS
+        sqlstate = getattr(orig, "pgcode", None) or getattr(orig, "sqlstate", None)
+        if sqlstate == UNIQUE_VIOLATION:
+            return getattr(getattr(orig, "diag", None), "constraint_name", None) in RETRYABLE_CONSTRAINTS
+        return sqlstate in RETRYABLE_SQLSTATES
+    return False
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    attempts: int = 5
+    base_delay: float = 0.005
+    max_delay: float = 0.2
+
+    @classmethod
+    def from_config(cls) -> "RetryPolicy":
+        return cls(
+            attempts=config.get_retry_attempts(),
+            base_delay=config.get_retry_base_delay(),
+            max_delay=config.get_retry_max_delay(),
+        )
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff for the given (zero-based) retry attempt."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+@dataclass
+class RetryStats:
+    calls: int = 0
+    retries: int = 0
+    exhausted: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def record(self, retries: int, exhausted: bool) -> None:
+        with self._lock:
+            self.calls += 1
+            self.retries += retries
+            self.exhausted += int(exhausted)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls = self.retries = self.exhausted = 0
+
+
+stats = RetryStats()
+_policy: Optional[RetryPolicy] = None
+
+
+def get_policy() -> RetryPolicy:
+    global _policy
+    if _policy is None:
+        _policy = RetryPolicy.from_config()
+    return _policy
+
+
+def set_policy(policy: Optional[RetryPolicy]) -> None:
+    global _policy
+    _policy = policy
+
+
+def call_with_retry(func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Call a handler, re-running it from scratch on optimistic-concurrency conflicts.
+    Every attempt enters a fresh unit of work, so the aggregate is reloaded.
+    """
+    policy = get_policy()
+    attempt = 0
+    while True:
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if not is_retryable(e):
+                stats.record(retries=attempt, exhausted=False)
+                raise
+            if attempt + 1 >= policy.attempts:
+                stats.record(retries=attempt, exhausted=True)
+                raise ConcurrencyError(f"{func.__name__} conflicted {attempt + 1} times, giving up") from e
+            delay = policy.backoff(attempt)
+            logger.debug("%s conflicted on attempt %s, retrying in %.4fs", func.__name__, attempt + 1, delay)
+            attempt += 1
+            with timing.phase("retry_backoff"):
+                time.sleep(delay)
+        else:
+            stats.record(retries=attempt, exhausted=False)
+            return result
+
+
+def retry_on_conflict(func: Callable[..., T]) -> Callable[..., T]:
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs) -> T:
+        return call_with_retry(func, *args, **kwargs)
+
+    return wrapper
@@ -1,34 +1,173 @@
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import date
+from typing import Any, Dict, Iterator, Optional, Tuple
+
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import Engine, create_engine, make_url
 from allocation import config
-from allocation.interfaces.main import IUnitOfWork
-from allocation.adapters.repository import SQLAlchemyRepository
+from allocation.adapters import orm, sqlite, sqlstats, timing
+from allocation.adapters.event_store import EventSourcedRepository
+from allocation.adapters.memory import InMemoryAvailabilityRepository, InMemoryRepository, InMemoryStore
+from allocation.domain import events
+from allocation.interfaces.main import IAvailabilityRepository, ICallableSession, IRepository, IUnitOfWork
+from allocation.adapters.repository import LockPolicy, SQLAlchemyAvailabilityRepository, SQLAlchemyRepository
+
+logger = logging.getLogger(__name__)
+
+_session_factory: Optional[sessionmaker] = None
+_session_factory_lock = threading.Lock()
+
+
+def get_session_factory() -> sessionmaker:
+    """
+    The default engine and session factory, built (and the ORM mapped) on first use rather than at
+    import time, so CLI tools, test collection and forked workers do not pay for them up front.
+    """
+    global _session_factory
+    if _session_factory is None:
+        with _session_factory_lock:
+            if _session_factory is None:
+                orm.start_mappers()
+                _session_factory = sessionmaker(bind=make_engine(config.get_db_uri()))
+    return _session_factory
+
+
+def make_engine(db_uri: str) -> Engine:
+    engine = create_engine(**engine_options(db_uri))
+    if engine.dialect.name == "sqlite":
+        sqlite.configure(engine)
+        # Migrations target Postgres; a SQLite database gets the current schema instead.
+        orm.metadata.create_all(engine)
+    return engine
+
 
-DEFAULT_SESSION_FACTORY = sessionmaker(
-    bind=create_engine(
-        url=config.get_db_uri(),
-        isolation_level="REPEATABLE READ",
-    )
-)
+def engine_options(db_uri: str) -> dict:
+    url = make_url(db_uri)
+    if url.get_backend_name() == "sqlite":
+        # sqlite.configure serializes the transactions instead; pooled connections move between threads.
+        return dict(url=url, connect_args={"check_same_thread": False})
+    options: Dict[str, Any] = dict(url=url, isolation_level="REPEATABLE READ")
+    prepare_threshold = config.get_db_prepare_threshold()
+    if prepare_threshold is not None and options["url"].get_backend_name() == "postgresql":
+        # psycopg2 cannot prepare statements server-side; psycopg 3 can (pip install "psycopg[binary]").
+        options["url"] = options["url"].set(drivername="postgresql+psycopg")
+        options["connect_args"] = {"prepare_threshold": prepare_threshold}
+    return options
+
+
+def _availability_delta(event: events.Event) -> Optional[Tuple[str, Optional[date], int]]:
+    if isinstance(event, events.Allocated):
+        return event.sku, event.eta, -event.qty
+    if isinstance(event, events.Deallocated):
+        return event.sku, event.eta, event.qty
+    if isinstance(event, events.BatchQuantityAdjusted):
+        return event.sku, event.eta, event.delta
+    if isinstance(event, events.BatchDeleted):
+        return event.sku, event.eta, -event.qty
+    return None
+
+
+def record_availability(uow: IUnitOfWork, recorded: Dict[object, int]) -> None:
+    """
+    Adjust uow.availability by the events raised since the last call, summed per (sku, eta), so the summaries
+    are committed with the change that moved them. Call it from commit(); `recorded` counts the events already
+    applied per product (and for the repository's own events) and starts empty with each unit of work.
+    """
+    deltas: Dict[Tuple[str, Optional[date]], int] = {}
+    for source, raised in [*((product, product.events) for product in uow.products.seen), (uow.products, uow.products.events)]:
+        for event in raised[recorded.get(source, 0) :]:
+            change = _availability_delta(event)
+            if change:
+                sku, eta, delta = change
+                deltas[sku, eta] = deltas.get((sku, eta), 0) + delta
+        recorded[source] = len(raised)
+    # In a stable order, so concurrent units of work update the same summary rows without deadlocking.
+    for (sku, eta), delta in sorted(deltas.items(), key=lambda item: (item[0][0], item[0][1] or date.min)):
+        if delta:
+            uow.availability.adjust(sku=sku, eta=eta, delta=delta)
 
 
 class SqlAlchemyUnitOfWork(IUnitOfWork):
-    def __init__(self, session_factory=DEFAULT_SESSION_FACTORY):
-        self.session_factory = session_factory
+    """
+    The session and repositories are kept per thread, so one instance can serve concurrent
+    requests (e.g. the API's module-level unit of work under FastAPI's threadpool).
+    """
+
+    def __init__(self, session_factory=None, lock_policy: Optional[LockPolicy] = None):
+        self._session_factory = session_factory
+        self.lock_policy = lock_policy or LockPolicy.from_config()
+        self._local = threading.local()
+
+    @property
+    def session_factory(self):
+        if self._session_factory is None:
+            self._session_factory = get_session_factory()
+        return self._session_factory
+
+    @session_factory.setter
+    def session_factory(self, session_factory):
+        self._session_factory = session_factory
+
+    @property
+    def session(self):
+        return self._local.session
+
+    @session.setter
+    def session(self, session):
+        self._local.session = session
+
+    @property
+    def products(self) -> SQLAlchemyRepository:
+        return self._local.products
+
+    @products.setter
+    def products(self, products: IRepository):
+        self._local.products = products
+
+    @property
+    def availability(self) -> SQLAlchemyAvailabilityRepository:
+        return self._local.availability
+
+    @availability.setter
+    def availability(self, availability: IAvailabilityRepository):
+        self._local.availability = availability
 
     def __enter__(self):
+        self._local.queries, self._local.queries_token = sqlstats.push()
         self.session = self.session_factory()
-        self.products = SQLAlchemyRepository(self.session)
+        if getattr(self._local, "read_only", False):
+            self.session.connection(execution_options={sqlite.READ_ONLY: True})
+        self.products = SQLAlchemyRepository(self.session, lock_policy=self.lock_policy)
+        self.availability = SQLAlchemyAvailabilityRepository(self.session)
+        self._local.recorded = {}
         return super().__enter__()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if exc_type is not None:
             self.rollback()
         self.session.close()
+        sqlstats.pop(self._local.queries_token)
+        queries = self._local.queries
+        logger.debug("unit of work executed %s statements in %.2fms", queries.statements, queries.seconds * 1000)
         return super().__exit__(exc_type, exc_val, exc_tb)
 
+    @contextmanager
+    def read_only(self) -> Iterator["SqlAlchemyUnitOfWork"]:
+        self._local.read_only = True
+        try:
+            with self:
+                yield self
+        finally:
+            self._local.read_only = False
+
     def commit(self):
-        self.session.commit()
+        with timing.phase("commit"):
+            record_availability(self, self._local.recorded)
+            self.session.flush()
+            self.products.verify_versions()
+            self.session.commit()
 
     def rollback(self):
         self.session.rollback()
@@ -37,3 +176,113 @@ class SqlAlchemyUnitOfWork(IUnitOfWork):
         for product in self.products.seen:
             while product.events:
                 yield product.events.pop(0)
+        while self.products.events:
+            yield self.products.events.pop(0)
+
+
+class EventSourcedUnitOfWork(SqlAlchemyUnitOfWork):
+    """
+    SqlAlchemyUnitOfWork whose products are event-sourced (EventSourcedRepository); availability and
+    everything else stay in their tables, in the same transaction.
+    """
+
+    def __init__(self, session_factory=None, snapshot_every: Optional[int] = None):
+        super().__init__(session_factory=session_factory)
+        self.snapshot_every = snapshot_every or config.get_event_store_snapshot_every()
+
+    def __enter__(self):
+        super().__enter__()
+        self.products = EventSourcedRepository(self.session, snapshot_every=self.snapshot_every)
+        return self
+
+    def commit(self):
+        with timing.phase("commit"):
+            record_availability(self, self._local.recorded)
+            self.products.save()
+            self.session.commit()
+
+    def rollback(self):
+        super().rollback()
+        self.products.rollback()
+
+
+def from_config() -> SqlAlchemyUnitOfWork:
+    """The unit of work for PRODUCT_STORE: "tables" (default) or "events"."""
+    if config.get_product_store() == "events":
+        return EventSourcedUnitOfWork()
+    return SqlAlchemyUnitOfWork()
+
+
+class InMemoryUnitOfWork(IUnitOfWork):
+    """
+    Unit of work over an InMemoryStore, for tests, benchmarks and single-process tools that need no database.
+    Units of work run one at a time (the store's lock is held from enter to exit); as in SqlAlchemyUnitOfWork
+    the repositories are kept per thread, so events stay with the thread that collects them. Repositories
+    used outside a `with` block change the store directly, e.g. to seed it.
+    """
+
+    # Nothing to open: the products are in memory.
+    session_factory: Optional[ICallableSession] = None
+
+    def __init__(self, store: Optional[InMemoryStore] = None):
+        self.store = store if store is not None else InMemoryStore()
+        # Any attribute namespace will do; FakeUnitOfWork shares one between threads.
+        self._local: Any = threading.local()
+
+    @property
+    def products(self) -> InMemoryRepository:
+        if not hasattr(self._local, "products"):
+            self._local.products = InMemoryRepository(self.store)
+        return self._local.products
+
+    @products.setter
+    def products(self, products: IRepository):
+        self._local.products = products
+
+    @property
+    def availability(self) -> InMemoryAvailabilityRepository:
+        if not hasattr(self._local, "availability"):
+            self._local.availability = InMemoryAvailabilityRepository(self.store)
+        return self._local.availability
+
+    @availability.setter
+    def availability(self, availability: IAvailabilityRepository):
+        self._local.availability = availability
+
+    def __enter__(self):
+        self.store.lock.acquire()
+        self.products.begin()
+        self.availability.begin()
+        self._local.recorded = {}
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            return super().__exit__(exc_type, exc_val, exc_tb)
+        finally:
+            self.store.lock.release()
+
+    def commit(self):
+        with timing.phase("commit"):
+            record_availability(self, self._local.recorded)
+            self.products.commit()
+            self.availability.commit()
+
+    def rollback(self):
+        self.products.rollback()
+        self.availability.rollback()
+
+    def snapshot(self) -> InMemoryStore:
+        with self.store.lock:
+            return self.store.snapshot()
+
+    def restore(self, snapshot: InMemoryStore) -> None:
+        with self.store.lock:
+            self.store.restore(snapshot)
+
+    def collect_new_events(self):
+        for product in self.products.seen:
+            while product.events:
+                yield product.events.pop(0)
+        while self.products.events:
+            yield self.products.events.pop(0)
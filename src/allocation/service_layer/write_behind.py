@@ -0,0 +1,239 @@
+import itertools
+import logging
+import threading
+from collections import deque
+from datetime import date
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from allocation import config
+from allocation.adapters import timing
+from allocation.adapters.journal import Journal, apply_record
+from allocation.adapters.memory import copy_product
+from allocation.adapters.write_behind import HotAvailabilityRepository, HotProductRepository, HotProducts
+from allocation.domain import events, model
+from allocation.interfaces.main import IAvailabilityRepository, IRepository, IUnitOfWork
+from allocation.service_layer.retry import retry_on_conflict
+from allocation.service_layer.unit_of_work import record_availability
+
+logger = logging.getLogger(__name__)
+
+# (seq, sku, record) as read from the journal
+JournalEntry = Tuple[int, str, events.Event]
+
+
+@retry_on_conflict
+def store_records(records: List[Tuple[str, events.Event]], uow: IUnitOfWork) -> None:
+    """Apply (sku, record) pairs to the products in the database, and to their availability, in one transaction."""
+    with uow:
+        products = {product.sku: product for product in uow.products.get_many({sku for sku, _ in records})}
+        deltas: Dict[Tuple[str, Optional[date]], int] = {}
+        released: Dict[Tuple[str, str], model.OrderLine] = {}
+        for sku, record in records:
+            product = products.get(sku)
+            if product is None:
+                product = products[sku] = model.Product(sku=sku, batches=[])
+                uow.products.add(product)
+            change = apply_record(product, record, released)
+            if change:
+                eta, delta = change
+                deltas[sku, eta] = deltas.get((sku, eta), 0) + delta
+        for (sku, eta), delta in deltas.items():
+            if delta:
+                uow.availability.adjust(sku=sku, eta=eta, delta=delta)
+        uow.commit()
+
+
+class WriteBehindWriter:
+    """
+    Stores journaled records in the database from a background thread. Every `interval` seconds, or as soon
+    as `batch_size` records wait, the oldest records are stored in journal order in one transaction and
+    then discarded from the journal. A failed flush keeps its records and is tried again next round.
+    """
+
+    def __init__(self, journal: Journal, uow: IUnitOfWork, interval: float = 0.05, batch_size: int = 1000):
+        self.journal = journal
+        self.uow = uow
+        self.interval = interval
+        self.batch_size = batch_size
+        self._pending: Deque[JournalEntry] = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def backlog(self) -> int:
+        """Records committed in memory but not stored in the database yet."""
+        return len(self._pending)
+
+    def submit(self, entries: List[JournalEntry]) -> None:
+        """Queue journal entries, in journal order."""
+        with self._lock:
+            self._pending.extend(entries)
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+
+    def flush(self) -> int:
+        """Store up to `batch_size` of the oldest waiting records; returns how many were stored."""
+        with self._lock:
+            chunk = list(itertools.islice(self._pending, self.batch_size))
+        if not chunk:
+            return 0
+        store_records([(sku, record) for _, sku, record in chunk], uow=self.uow)
+        # Only this thread (or stop(), once it has joined) takes records off the queue.
+        with self._lock:
+            for _ in chunk:
+                self._pending.popleft()
+        self.journal.discard_through(chunk[-1][0])
+        return len(chunk)
+
+    def drain(self) -> int:
+        stored = 0
+        while flushed := self.flush():
+            stored += flushed
+        return stored
+
+    def start(self) -> None:
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop the thread and store whatever is still waiting."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self.drain()
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.drain()
+            except Exception:
+                logger.exception("Write-behind flush failed; %s records wait for the next round", self.backlog)
+
+
+class WriteBehindUnitOfWork(IUnitOfWork):
+    """
+    Unit of work over the write-behind products in memory. A product's SKU is locked from loading until the
+    unit of work exits. commit() returns once the changes are in the journal on disk and hands them to the
+    writer; rollback() undoes what was not committed. Like SqlAlchemyUnitOfWork, one instance serves many threads.
+    """
+
+    # Nothing to open: the products are in memory.
+    session_factory = None
+
+    def __init__(self, store: HotProducts, journal: Journal, writer: WriteBehindWriter):
+        self.store = store
+        self.journal = journal
+        self.writer = writer
+        # The writer must get entries in journal order.
+        self._commit_lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def products(self) -> HotProductRepository:
+        return self._local.products
+
+    @products.setter
+    def products(self, products: IRepository):
+        self._local.products = products
+
+    @property
+    def availability(self) -> HotAvailabilityRepository:
+        return self._local.availability
+
+    @availability.setter
+    def availability(self, availability: IAvailabilityRepository):
+        self._local.availability = availability
+
+    def __enter__(self):
+        self.products = HotProductRepository(self.store)
+        self.availability = HotAvailabilityRepository(self.store)
+        self._local.recorded = {}
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            return super().__exit__(exc_type, exc_val, exc_tb)
+        finally:
+            self.products.release()
+
+    def commit(self):
+        with timing.phase("commit"):
+            record_availability(self, self._local.recorded)
+            records = self.products.pending_records()
+            with self._commit_lock:
+                seqs = self.journal.append(records)
+                self.writer.submit([(seq, sku, record) for seq, (sku, record) in zip(seqs, records)])
+            self.products.commit()
+            self.availability.commit()
+
+    def rollback(self):
+        self.products.rollback()
+        self.availability.rollback()
+
+    def collect_new_events(self):
+        while self.products.events:
+            yield self.products.events.pop(0)
+
+
+class WriteBehind:
+    """
+    Flash-sale mode: the products of `skus` live in memory as their source of truth. Commits are appended to
+    a local, fsync'd journal and a background writer stores them in the database in batches. start() also
+    recovers from a crash: it loads the products from the database and replays the journal over them.
+    """
+
+    def __init__(self, skus: Iterable[str], journal: Journal, uow: IUnitOfWork, interval: float = 0.05, batch_size: int = 1000):
+        self.store = HotProducts(skus)
+        self.journal = journal
+        self.database_uow = uow
+        self.writer = WriteBehindWriter(journal, uow=uow, interval=interval, batch_size=batch_size)
+        self.uow = WriteBehindUnitOfWork(self.store, journal, self.writer)
+
+    @classmethod
+    def from_config(cls, uow: IUnitOfWork) -> Optional["WriteBehind"]:
+        skus = config.get_write_behind_skus()
+        if not skus:
+            return None
+        return cls(
+            skus,
+            journal=Journal(config.get_write_behind_journal()),
+            uow=uow,
+            interval=config.get_write_behind_flush_interval(),
+            batch_size=config.get_write_behind_flush_size(),
+        )
+
+    def owns(self, sku: str) -> bool:
+        return sku in self.store.skus
+
+    def owns_batch(self, reference: str) -> bool:
+        return reference in self.store.batchrefs
+
+    def start(self) -> int:
+        """Recover, then start the writer; returns how many journal records were replayed."""
+        replayed = self.recover()
+        self.writer.start()
+        return replayed
+
+    def stop(self) -> None:
+        self.writer.stop()
+        self.journal.close()
+
+    def recover(self) -> int:
+        """Load the products from the database, replay the journal over them and queue it for the writer again."""
+        with self.database_uow:
+            products = {product.sku: copy_product(product) for product in self.database_uow.products.get_many(self.store.skus)}
+        entries = list(self.journal.read())
+        for _, sku, record in entries:
+            apply_record(products.setdefault(sku, model.Product(sku=sku, batches=[])), record)
+        self.store.load(product for product in products.values() if self.owns(product.sku))
+        self.writer.submit(entries)
+        if entries:
+            logger.info("Replayed %s write-behind journal records", len(entries))
+        return len(entries)
@@ -1,7 +1,8 @@
 import pathlib
 import time
+import types
 from datetime import date
-from typing import Callable, Generator, List, Optional, Tuple
+from typing import Callable, ContextManager, Generator, List, Optional, Tuple
 
 import httpx
 import pytest
@@ -11,11 +12,13 @@ from sqlalchemy.orm import clear_mappers, sessionmaker
 from sqlalchemy.pool import StaticPool
 
 from allocation import config
+from allocation.adapters import sqlstats
 from allocation.adapters.orm import metadata, start_mappers
 from allocation.domain import events
-from allocation.domain.model import Batch, OrderLine, Product
+from allocation.domain.model import Batch, OrderLine
 from allocation.entrypoints.main import app
-from allocation.interfaces.main import IRepository, ISession, IUnitOfWork
+from allocation.interfaces.main import ISession, IUnitOfWork
+from allocation.service_layer.unit_of_work import InMemoryUnitOfWork, SqlAlchemyUnitOfWork
 
 TRUNCATE_QUERIES = (
     "truncate table products CASCADE;",
@@ -25,63 +28,25 @@ TRUNCATE_QUERIES = (
 )
 
 
-class FakeUnitOfWork(IUnitOfWork):
+class FakeUnitOfWork(InMemoryUnitOfWork):
+    """InMemoryUnitOfWork that also remembers whether it committed and which events it published."""
+
     def __init__(self, session_factory: Callable[[], ISession]):
+        super().__init__()
+        # One set of repositories for every thread, so that tests can patch them.
+        self._local = types.SimpleNamespace()
         self.session_factory = session_factory
         self.committed = False
-        self.products = FakeRepository([])
         self.events_published: List[events.Event] = []
 
-    def __enter__(self):
-        self.session = self.session_factory()
-        return super().__enter__()
-
     def commit(self):
+        super().commit()
         self.committed = True
 
-    def rollback(self):
-        pass
-
     def collect_new_events(self):
-        for product in self.products.seen:
-            while product.events:
-                self.events_published.append(product.events[0])
-                yield product.events.pop(0)
-
-
-class FakeRepository(IRepository):
-    def __init__(self, products: List[Product]):
-        self._products = set(products)
-        self.seen = set(products)
-
-    def add(self, product: Product):
-        self._products.add(product)
-        self.seen.add(product)
-
-    def delete(self, sku: str):
-        product = self.get(sku=sku)
-        if product:
-            self._products.remove(product)
-            self.seen.discard(product)
-
-    def get(self, sku: str) -> Optional[Product]:
-        product = next((b for b in self._products if b.sku == sku), None)
-        if product:
-            self.seen.add(product)
-        return product
-
-    def get_by_batchref(self, batchref: str) -> Optional[Product]:
-        for product in self._products:
-            if any(batch.reference == batchref for batch in product.batches):
-                self.seen.add(product)
-                return product
-        return None
-
-    def list(self):
-        products = list(self._products)
-        for product in products:
-            self.seen.add(product)
-        return products
+        for event in super().collect_new_events():
+            self.events_published.append(event)
+            yield event
 
 
 @pytest.fixture(scope="function")
@@ -91,6 +56,14 @@ def make_fake_uow(session_factory: Callable[[], ISession]) -> FakeUnitOfWork:
     return uow
 
 
+@pytest.fixture(scope="function", params=["sqlalchemy", "memory"])
+def backend_uow(request) -> IUnitOfWork:
+    """A unit of work over each backend in turn, for the behaviour their repositories share."""
+    if request.param == "memory":
+        return InMemoryUnitOfWork()
+    return SqlAlchemyUnitOfWork(session_factory=request.getfixturevalue("session_factory"))
+
+
 @pytest.fixture(scope="function")
 def make_batch_and_line() -> Callable[..., Tuple[Batch, OrderLine]]:
     def _make(
@@ -168,6 +141,12 @@ def session_factory(in_memory_db) -> Generator[Callable[[], ISession], None, Non
     clear_mappers()
 
 
+@pytest.fixture(scope="function")
+def assert_max_queries() -> Callable[[int], ContextManager[sqlstats.QueryStats]]:
+    """`with assert_max_queries(3): ...` fails if the block executes more than 3 SQL statements."""
+    return sqlstats.assert_max_queries
+
+
 @pytest.fixture(scope="function")
 def restart_api():
     app_file = pathlib.Path(__file__).parent.parent / "src" / "allocation" / "entrypoints" / "main.py"
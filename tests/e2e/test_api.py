@@ -106,3 +106,71 @@ def test_unhappy_path_post_allocate_returns_400_and_error_message(fastapi_test_c
     r = fastapi_test_client.post(f"{url}/allocate", json=data)
     assert r.status_code == 400
     assert r.json()["detail"] == f"Invalid sku {unknown_sku}"
+
+
+@pytest.mark.e2e
+@pytest.mark.api
+@pytest.mark.usefixtures("restart_api")
+def test_bulk_allocate_returns_result_per_line(fastapi_test_client):
+    sku, unknown_sku = random_sku(name="BULK-LAMP"), random_sku(name="unknown")
+    batchref = random_batchref(name="bulk")
+    r = fastapi_test_client.post(f"{url}/batches/", json={"reference": batchref, "sku": sku, "qty": 10, "eta": None})
+    assert r.status_code == 201
+
+    lines = [
+        {"orderid": random_orderid(), "sku": sku, "qty": 4},
+        {"orderid": random_orderid(), "sku": unknown_sku, "qty": 1},
+        {"orderid": random_orderid(), "sku": sku, "qty": 4},
+    ]
+    r = fastapi_test_client.post(f"{url}/allocate/bulk", json=lines)
+    assert r.status_code == 200
+    results = r.json()["results"]
+    assert [result["batchref"] for result in results] == [batchref, None, batchref]
+    assert results[1]["error"] == f"Invalid sku {unknown_sku}"
+
+
+@pytest.mark.e2e
+@pytest.mark.api
+@pytest.mark.usefixtures("restart_api")
+def test_get_batch_honours_if_none_match(fastapi_test_client):
+    sku, batchref = random_sku(name="POLLED"), random_batchref(name="polled")
+    r = fastapi_test_client.post(f"{url}/batches/", json={"reference": batchref, "sku": sku, "qty": 10, "eta": None})
+    assert r.status_code == 201
+
+    r = fastapi_test_client.get(f"{url}/batches/{batchref}?sku={sku}")
+    assert r.status_code == 200
+    etag = r.headers["ETag"]
+
+    r = fastapi_test_client.get(f"{url}/batches/{batchref}?sku={sku}", headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.headers["ETag"] == etag
+
+    r = fastapi_test_client.post(f"{url}/allocate", json={"orderid": random_orderid(), "sku": sku, "qty": 1})
+    assert r.status_code == 201
+    r = fastapi_test_client.get(f"{url}/batches/{batchref}?sku={sku}", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.headers["ETag"] != etag
+
+    for if_none_match in ("*", r.headers["ETag"]):
+        r = fastapi_test_client.get(f"{url}/batches/{random_batchref()}?sku={sku}", headers={"If-None-Match": if_none_match})
+        assert r.status_code == 404
+
+
+@pytest.mark.e2e
+@pytest.mark.api
+@pytest.mark.usefixtures("restart_api")
+def test_retried_allocate_with_idempotency_key_replays_the_response(fastapi_test_client):
+    sku, batchref = random_sku(name="RETRIED"), random_batchref(name="retried")
+    r = fastapi_test_client.post(f"{url}/batches/", json={"reference": batchref, "sku": sku, "qty": 10, "eta": None})
+    assert r.status_code == 201
+
+    data = {"orderid": random_orderid(), "sku": sku, "qty": 3}
+    headers = {"Idempotency-Key": random_orderid(name="key")}
+    first = fastapi_test_client.post(f"{url}/allocate", json=data, headers=headers)
+    retried = fastapi_test_client.post(f"{url}/allocate", json=data, headers=headers)
+    assert first.status_code == retried.status_code == 201
+    assert retried.json() == first.json() == {"batchref": batchref}
+    assert retried.headers["Idempotent-Replayed"] == "true"
+
+    r = fastapi_test_client.post(f"{url}/allocate", json={**data, "qty": 4}, headers=headers)
+    assert r.status_code == 422
@@ -0,0 +1,133 @@
+import json
+from datetime import date
+
+import pytest
+from sqlalchemy import delete, text
+from sqlalchemy.orm.exc import StaleDataError
+
+from allocation.adapters import orm
+from allocation.adapters.event_store import decode_state, encode_state
+from allocation.domain import events
+from allocation.domain.exceptions import InvalidBatchReference, UnsupportedOperation
+from allocation.domain.model import Batch, OrderLine, Product
+from allocation.entrypoints import cli
+from allocation.service_layer import handlers, unit_of_work
+from allocation.service_layer.messagebus import MessageBus
+from allocation.service_layer.unit_of_work import EventSourcedUnitOfWork
+
+
+def _records(session, sku: str):
+    return session.execute(text("SELECT version, record FROM product_events WHERE sku = :sku ORDER BY version"), dict(sku=sku)).all()
+
+
+@pytest.mark.integration
+@pytest.mark.repository
+def test_event_store_appends_outcomes_and_replays_them(session_factory):
+    uow = EventSourcedUnitOfWork(session_factory=session_factory)
+    MessageBus.handle(events.BatchCreated(ref="b1", sku="ES-LAMP", qty=10, eta=None), uow=uow)
+    MessageBus.handle(events.AllocationRequired(orderId="o1", sku="ES-LAMP", qty=4), uow=uow)
+    MessageBus.handle(events.AllocationRequired(orderId="o2", sku="ES-LAMP", qty=2), uow=uow)
+    handlers.deallocate(sku="ES-LAMP", orderId="o1", qty=4, uow=uow)
+    MessageBus.handle_new_events(uow=uow)
+    MessageBus.handle(events.BatchQuantityChanged(ref="b1", qty=5), uow=uow)
+
+    session = session_factory()
+    assert [(version, json.loads(record)["type"]) for version, record in _records(session, "ES-LAMP")] == [
+        (1, "BatchCreated"),
+        (2, "Allocated"),
+        (3, "Allocated"),
+        (4, "Deallocated"),
+        (5, "BatchQuantityChanged"),
+    ]
+    with uow:
+        product = uow.products.get("ES-LAMP")
+        assert product.version_number == uow.products.get_version("ES-LAMP") == 5
+        assert {line.orderId for line in product.batches[0]._allocations} == {"o2"}
+        assert uow.products.get_by_batchref("b1") is product
+    assert handlers.get_availability(sku="ES-LAMP", uow=uow)["in_stock"] == 3
+    assert handlers.get_batch_version(sku="ES-LAMP", reference="b1", uow=uow) == (5, 0)
+    MessageBus.handle(events.BatchCreated(ref="b2", sku="ES-LAMP", qty=1, eta=None), uow=uow)
+    handlers.delete_batch(sku="ES-LAMP", reference="b2", uow=uow)
+    with pytest.raises(InvalidBatchReference):
+        handlers.get_batch_version(sku="ES-LAMP", reference="b2", uow=uow)
+
+
+@pytest.mark.integration
+@pytest.mark.repository
+def test_event_store_loads_from_the_latest_snapshot(session_factory):
+    uow = EventSourcedUnitOfWork(session_factory=session_factory, snapshot_every=3)
+    MessageBus.handle(events.BatchCreated(ref="b1", sku="ES-SOFA", qty=10, eta=None), uow=uow)
+    for i in range(4):
+        MessageBus.handle(events.AllocationRequired(orderId=f"o{i}", sku="ES-SOFA", qty=1), uow=uow)
+
+    session = session_factory()
+    assert session.execute(text("SELECT version FROM product_snapshots WHERE sku = 'ES-SOFA'")).scalar() == 3
+    # Records up to the snapshot are not needed to load the product any more.
+    session.execute(delete(orm.product_events).where(orm.product_events.c.version <= 3))
+    session.commit()
+    with uow:
+        product = uow.products.get("ES-SOFA")
+        assert product.version_number == 5
+        assert sorted(line.orderId for line in product.batches[0]._allocations) == ["o0", "o1", "o2", "o3"]
+
+
+@pytest.mark.integration
+@pytest.mark.repository
+def test_event_store_rejects_an_append_to_a_stream_that_moved_on(session_factory):
+    uow = EventSourcedUnitOfWork(session_factory=session_factory)
+    MessageBus.handle(events.BatchCreated(ref="b1", sku="ES-CHAIR", qty=10, eta=None), uow=uow)
+    stale, fresh = EventSourcedUnitOfWork(session_factory=session_factory), EventSourcedUnitOfWork(session_factory=session_factory)
+
+    with stale:
+        stale_product = stale.products.get("ES-CHAIR")
+        with fresh:
+            fresh.products.get("ES-CHAIR").allocate(OrderLine("first", "ES-CHAIR", 1))
+            fresh.commit()
+        stale_product.allocate(OrderLine("second", "ES-CHAIR", 1))
+        with pytest.raises(StaleDataError):
+            stale.commit()
+
+
+@pytest.mark.integration
+@pytest.mark.repository
+def test_event_store_deletes_products_with_their_history(session_factory):
+    uow = EventSourcedUnitOfWork(session_factory=session_factory)
+    MessageBus.handle(events.BatchCreated(ref="b1", sku="ES-MUG", qty=10, eta=None), uow=uow)
+    MessageBus.handle(events.AllocationRequired(orderId="o1", sku="ES-MUG", qty=2), uow=uow)
+
+    assert handlers.delete_products(skus=["ES-MUG", "NO-SUCH-SKU"], uow=uow) == 1
+    with uow:
+        assert uow.products.get("ES-MUG") is None
+        assert uow.products.page_products(after=None, limit=10) == []
+    assert _records(session_factory(), "ES-MUG") == []
+
+
+@pytest.mark.integration
+@pytest.mark.repository
+def test_event_store_has_no_archive_and_refuses_table_maintenance(session_factory):
+    uow = EventSourcedUnitOfWork(session_factory=session_factory)
+    MessageBus.handle(events.BatchCreated(ref="b1", sku="ES-MUG", qty=10, eta=None), uow=uow)
+
+    assert handlers.list_batches(sku="ES-MUG", uow=uow, archived=True)["items"] == []
+    with pytest.raises(UnsupportedOperation):
+        handlers.archive_batches(before=date(2026, 1, 1), uow=uow)
+    with pytest.raises(UnsupportedOperation):
+        handlers.compact_order_lines(uow=uow)
+
+
+@pytest.mark.integration
+@pytest.mark.repository
+def test_cli_uses_the_configured_store_and_rejects_table_only_commands(session_factory, monkeypatch, capsys):
+    monkeypatch.setattr(unit_of_work, "from_config", lambda: EventSourcedUnitOfWork(session_factory=session_factory))
+    assert cli.main(["archive-batches"]) == 2
+    assert cli.main(["compact-order-lines"]) == 2
+    assert "PRODUCT_STORE=tables" in capsys.readouterr().err
+
+
+@pytest.mark.unit
+def test_snapshot_state_round_trips():
+    product = Product(sku="ES-DESK", batches=[Batch("b1", "ES-DESK", 5, eta=None), Batch("b2", "ES-DESK", 7, eta=None)])
+    product.batches[1].allocate(OrderLine("o1", "ES-DESK", 3))
+    restored = decode_state("ES-DESK", encode_state(product))
+    assert encode_state(restored) == encode_state(product)
+    assert [b.available_quantity for b in restored.batches] == [5, 4]
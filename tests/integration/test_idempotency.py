@@ -0,0 +1,111 @@
+import pytest
+from sqlalchemy import text
+
+from allocation.adapters import sqlstats
+from allocation.adapters.idempotency import IdempotencyStore, fingerprint
+from allocation.domain.exceptions import IdempotencyKeyConflict, IdempotencyKeyInProgress
+
+PAYLOAD = {"orderid": "o1", "sku": "RETRIED-LAMP", "qty": 1}
+
+
+def _complete(store: IdempotencyStore, key: str, body: dict) -> None:
+    assert store.reserve(key=key, endpoint="/allocate", request_fingerprint=fingerprint(PAYLOAD)) is None
+    store.complete(key=key, endpoint="/allocate", request_fingerprint=fingerprint(PAYLOAD), status_code=201, body=body)
+
+
+@pytest.mark.integration
+def test_stored_response_is_returned_for_repeated_key(session_factory):
+    store = IdempotencyStore(session_factory=session_factory, ttl=60, cache_size=10)
+    _complete(store, "k1", {"batchref": "b1"})
+
+    stored = store.reserve(key="k1", endpoint="/allocate", request_fingerprint=fingerprint(PAYLOAD))
+    assert (stored.status_code, stored.body) == (201, {"batchref": "b1"})
+    assert store.reserve(key="k1", endpoint="/deallocate", request_fingerprint=fingerprint(PAYLOAD)) is None
+
+
+@pytest.mark.integration
+def test_a_repeated_request_is_answered_without_writing(session_factory):
+    _complete(IdempotencyStore(session_factory=session_factory, ttl=60), "k1", {"batchref": "b1"})
+
+    # Another worker, whose cache has not seen the key.
+    other = IdempotencyStore(session_factory=session_factory, ttl=60)
+    with sqlstats.count_queries(keep_statements=True) as stats:
+        assert other.reserve(key="k1", endpoint="/allocate", request_fingerprint=fingerprint(PAYLOAD)).body == {"batchref": "b1"}
+    assert [statement.split()[0] for statement in stats.executed] == ["SELECT"]
+
+
+@pytest.mark.integration
+def test_a_key_is_held_while_its_request_runs(session_factory):
+    store = IdempotencyStore(session_factory=session_factory, ttl=60)
+    assert store.reserve(key="k1", endpoint="/allocate", request_fingerprint=fingerprint(PAYLOAD)) is None
+
+    # Another worker, with its own cache, sees the pending row.
+    other = IdempotencyStore(session_factory=session_factory, ttl=60)
+    with pytest.raises(IdempotencyKeyInProgress):
+        other.reserve(key="k1", endpoint="/allocate", request_fingerprint=fingerprint(PAYLOAD))
+    with pytest.raises(IdempotencyKeyConflict):
+        other.reserve(key="k1", endpoint="/allocate", request_fingerprint=fingerprint({**PAYLOAD, "qty": 2}))
+
+    store.complete(key="k1", endpoint="/allocate", request_fingerprint=fingerprint(PAYLOAD), status_code=201, body={"batchref": "b1"})
+    assert other.reserve(key="k1", endpoint="/allocate", request_fingerprint=fingerprint(PAYLOAD)).body == {"batchref": "b1"}
+
+
+@pytest.mark.integration
+def test_an_abandoned_reservation_is_taken_over_after_its_lease(session_factory):
+    crashed = IdempotencyStore(session_factory=session_factory, ttl=60, lease=0)
+    assert crashed.reserve(key="k1", endpoint="/allocate", request_fingerprint=fingerprint(PAYLOAD)) is None
+
+    retry = IdempotencyStore(session_factory=session_factory, ttl=60, lease=0)
+    assert retry.reserve(key="k1", endpoint="/allocate", request_fingerprint=fingerprint(PAYLOAD)) is None
+    retry.complete(key="k1", endpoint="/allocate", request_fingerprint=fingerprint(PAYLOAD), status_code=201, body={"batchref": "b1"})
+    assert retry.reserve(key="k1", endpoint="/allocate", request_fingerprint=fingerprint(PAYLOAD)).body == {"batchref": "b1"}
+    assert list(session_factory().execute(text("SELECT count(*) FROM idempotency_keys"))) == [(1,)]
+
+
+@pytest.mark.integration
+def test_released_keys_can_be_reserved_again(session_factory):
+    store = IdempotencyStore(session_factory=session_factory, ttl=60)
+    assert store.reserve(key="k1", endpoint="/allocate", request_fingerprint=fingerprint(PAYLOAD)) is None
+    store.release(key="k1", endpoint="/allocate")
+    assert store.reserve(key="k1", endpoint="/allocate", request_fingerprint=fingerprint(PAYLOAD)) is None
+
+
+@pytest.mark.integration
+def test_evicted_entries_are_reloaded_from_the_table(session_factory):
+    store = IdempotencyStore(session_factory=session_factory, ttl=60, cache_size=1)
+    _complete(store, "k1", {"batchref": "b1"})
+    _complete(store, "k2", {"batchref": "b2"})
+    assert len(store._cache) == 1
+
+    fresh_store = IdempotencyStore(session_factory=session_factory, ttl=60, cache_size=1)
+    assert fresh_store.get(key="k1", endpoint="/allocate", request_fingerprint=fingerprint(PAYLOAD)).body == {"batchref": "b1"}
+
+
+@pytest.mark.integration
+def test_repeated_complete_keeps_the_first_response(session_factory):
+    store = IdempotencyStore(session_factory=session_factory, ttl=60)
+    _complete(store, "k1", {"batchref": "b1"})
+    IdempotencyStore(session_factory=session_factory, ttl=60).complete(
+        key="k1", endpoint="/allocate", request_fingerprint=fingerprint(PAYLOAD), status_code=201, body={"batchref": "b2"}
+    )
+    rows = list(session_factory().execute(text("SELECT response FROM idempotency_keys")))
+    assert rows == [('{"batchref": "b1"}',)]
+
+
+@pytest.mark.integration
+def test_key_reused_for_a_different_request_is_rejected(session_factory):
+    store = IdempotencyStore(session_factory=session_factory, ttl=60)
+    _complete(store, "k1", {"batchref": "b1"})
+    with pytest.raises(IdempotencyKeyConflict, match="already used for a different /allocate request"):
+        store.reserve(key="k1", endpoint="/allocate", request_fingerprint=fingerprint({**PAYLOAD, "qty": 2}))
+
+
+@pytest.mark.integration
+def test_expired_keys_are_taken_over_and_purged(session_factory):
+    store = IdempotencyStore(session_factory=session_factory, ttl=0)
+    assert store.reserve(key="k1", endpoint="/allocate", request_fingerprint=fingerprint(PAYLOAD)) is None
+    # A pending row left behind by a crashed request does not hold the key past its ttl.
+    assert store.reserve(key="k1", endpoint="/allocate", request_fingerprint=fingerprint(PAYLOAD)) is None
+    store.complete(key="k1", endpoint="/allocate", request_fingerprint=fingerprint(PAYLOAD), status_code=201, body={"batchref": "b1"})
+    assert store.get(key="k1", endpoint="/allocate", request_fingerprint=fingerprint(PAYLOAD)) is None
+    assert store.purge_expired() == 1
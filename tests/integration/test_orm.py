@@ -1,6 +1,7 @@
 import pytest
 from datetime import date
 from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
 from allocation.domain.model import Batch, OrderLine
 
 
@@ -112,3 +113,12 @@ def test_deallocate(orm_session):
     orm_session.commit()
     allocations = list(orm_session.execute(statement=text('SELECT orderline_id, batch_id FROM "allocations"')))
     assert allocations == []  # type: ignore
+    assert list(orm_session.execute(statement=text('SELECT "orderId" FROM order_lines'))) == []
+
+
+@pytest.mark.integration
+@pytest.mark.orm
+def test_order_lines_are_unique_per_order_and_sku(orm_session):
+    orm_session.execute(text("INSERT INTO order_lines (\"orderId\", sku, qty) VALUES ('order1', 'sku1', 10)"))
+    with pytest.raises(IntegrityError):
+        orm_session.execute(text("INSERT INTO order_lines (\"orderId\", sku, qty) VALUES ('order1', 'sku1', 5)"))
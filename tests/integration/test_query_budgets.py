@@ -0,0 +1,66 @@
+from datetime import date, timedelta
+
+import pytest
+
+from allocation.domain import events, exceptions
+from allocation.service_layer import handlers
+from allocation.service_layer.unit_of_work import SqlAlchemyUnitOfWork
+
+SKU = "BUDGETED-LAMP"
+PRODUCT_SIZES = [1, 10, 50]
+
+
+@pytest.fixture
+def make_product(session_factory):
+    def _make(batches: int) -> SqlAlchemyUnitOfWork:
+        uow = SqlAlchemyUnitOfWork(session_factory=session_factory)
+        for i in range(batches):
+            handlers.add_batch(events.BatchCreated(ref=f"batch-{i}", sku=SKU, qty=100, eta=date(2026, 1, 1) + timedelta(days=i)), uow=uow)
+            # One line per batch: the earliest batches fill up first.
+            handlers.allocate(events.AllocationRequired(orderId=f"order-{i}", sku=SKU, qty=100 if i < batches - 1 else 1), uow=uow)
+        return uow
+
+    return _make
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize("batches", PRODUCT_SIZES)
+def test_allocate_statement_budget(make_product, assert_max_queries, batches):
+    uow = make_product(batches)
+    with assert_max_queries(8):
+        assert handlers.allocate(events.AllocationRequired(orderId="budget", sku=SKU, qty=1), uow=uow) == f"batch-{batches - 1}"
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize("batches", PRODUCT_SIZES)
+def test_deallocate_statement_budget(make_product, assert_max_queries, batches):
+    uow = make_product(batches)
+    # load product, batches and lines; delete the allocation and the order line; bump the version; adjust availability
+    with assert_max_queries(7):
+        handlers.deallocate(sku=SKU, orderId=f"order-{batches - 1}", qty=1, uow=uow)
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize("batches", PRODUCT_SIZES)
+def test_get_batch_statement_budget(make_product, assert_max_queries, batches):
+    uow = make_product(batches)
+    with assert_max_queries(3):
+        handlers.get_batch(sku=SKU, reference="batch-0", uow=uow)
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize("batches", PRODUCT_SIZES)
+def test_change_batch_quantity_statement_budget(make_product, assert_max_queries, batches):
+    uow = make_product(batches)
+    # The availability summary is adjusted in the same transaction.
+    with assert_max_queries(7):
+        handlers.change_batch_quantity(events.BatchQuantityChanged(ref=f"batch-{batches - 1}", qty=50), uow=uow)
+
+
+@pytest.mark.integration
+def test_assert_max_queries_lists_the_statements(session_factory, assert_max_queries):
+    uow = SqlAlchemyUnitOfWork(session_factory=session_factory)
+    with pytest.raises(AssertionError, match=r"at most 0 SQL statements, 1 were executed:\n  1\. SELECT"):
+        with assert_max_queries(0):
+            with pytest.raises(exceptions.InvalidSku):
+                handlers.get_product_version(sku=SKU, uow=uow)
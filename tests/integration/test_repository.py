@@ -1,7 +1,10 @@
+from datetime import date
+
 import pytest
 from sqlalchemy import text
+from allocation.adapters import sqlstats
 from allocation.domain.model import Batch, OrderLine, Product
-from allocation.adapters.repository import SQLAlchemyRepository
+from allocation.adapters.repository import ADVISORY_LOCK, OPTIMISTIC, ROW_LOCK, LockPolicy, SQLAlchemyRepository, advisory_lock_key
 
 
 def insert_order_line(orm_session, orderid, sku, qty) -> int:
@@ -83,21 +86,22 @@ def test_repository_can_retrieve_a_batch_with_allocations(orm_session, insert_ba
 
 @pytest.mark.integration
 @pytest.mark.repository
-def test_repository_can_list_batches(orm_session):
+def test_repository_can_list_batches(backend_uow):
     batch1 = Batch("batch1", "ROUND-MIRROR", 100, eta=None)
     batch2 = Batch("batch1", "PRETTY-TABLE", 100, eta=None)
     batch3 = Batch("batch1", "LITTLE_BOX", 100, eta=None)
     batches = [batch1, batch2, batch3]
-    repo = SQLAlchemyRepository(orm_session)
-    for batch in batches:
-        product = Product(sku=batch.sku, batches=[batch])
-        repo.add(product=product)
-    orm_session.commit()
+    expected = {(batch.sku, batch.reference) for batch in batches}
+    with backend_uow:
+        for batch in batches:
+            product = Product(sku=batch.sku, batches=[batch])
+            backend_uow.products.add(product=product)
+        backend_uow.commit()
 
-    retrieved_products = repo.list()
-    assert len(retrieved_products) == len(batches)
-    for product in retrieved_products:
-        assert any(product.sku == batch.sku and product.batches[0] == batch for batch in batches)
+    with backend_uow:
+        retrieved_products = backend_uow.products.list()
+        assert len(retrieved_products) == len(batches)
+        assert {(product.sku, product.batches[0].reference) for product in retrieved_products} == expected
 
 
 @pytest.mark.integration
@@ -120,3 +124,262 @@ def test_repository_get_by_batchref(orm_session, insert_batch_via_session):
     assert retrieved_batch == batch1
     assert retrieved_batch.sku == batch1.sku
     assert retrieved_batch._purchase_quantity == batch1._purchase_quantity
+
+
+@pytest.mark.integration
+@pytest.mark.repository
+def test_lock_policy_from_config(monkeypatch):
+    monkeypatch.setenv("LOCK_MODE", ROW_LOCK)
+    monkeypatch.setenv("LOCK_MODE_OVERRIDES", "HOT-LAMP=advisory, COLD-SOFA=optimistic")
+    policy = LockPolicy.from_config()
+    assert policy.mode_for("ANY-SKU") == ROW_LOCK
+    assert policy.mode_for("HOT-LAMP") == ADVISORY_LOCK
+    assert policy.mode_for("COLD-SOFA") == OPTIMISTIC
+    assert policy.is_pessimistic
+    assert not LockPolicy().is_pessimistic
+    with pytest.raises(ValueError, match="Unknown lock mode"):
+        LockPolicy(default="exclusive")
+
+
+@pytest.mark.integration
+@pytest.mark.repository
+def test_advisory_lock_key_is_stable_bigint():
+    key = advisory_lock_key("HOT-LAMP")
+    assert key == advisory_lock_key("HOT-LAMP")
+    assert key != advisory_lock_key("HOT-SOFA")
+    assert -(2**63) <= key < 2**63
+
+
+@pytest.mark.integration
+@pytest.mark.repository
+@pytest.mark.parametrize("mode", [ROW_LOCK, ADVISORY_LOCK])
+def test_locked_repository_reads_work_without_postgres(orm_session, insert_batch_via_session, mode):
+    insert_batch_via_session(session=orm_session, ref="batch1", sku="HOT-LAMP", qty=10, eta=None)
+    repo = SQLAlchemyRepository(orm_session, lock_policy=LockPolicy(overrides={"HOT-LAMP": mode}))
+    assert repo.get(sku="HOT-LAMP").sku == "HOT-LAMP"
+    assert repo.get_by_batchref(batchref="batch1").sku == "HOT-LAMP"
+
+
+@pytest.mark.integration
+@pytest.mark.repository
+def test_repository_get_many_loads_products_in_one_query(orm_session, insert_batch_via_session):
+    for sku in ("ORDERED-SOFA", "ORDERED-LAMP"):
+        insert_batch_via_session(session=orm_session, ref=f"batch-{sku}", sku=sku, qty=10, eta=None)
+    repo = SQLAlchemyRepository(orm_session, lock_policy=LockPolicy(overrides={"ORDERED-LAMP": ROW_LOCK}))
+    with sqlstats.assert_max_queries(3):
+        products = repo.get_many(["ORDERED-SOFA", "ORDERED-LAMP", "NO-SUCH-SKU", "ORDERED-SOFA"])
+        assert [[b.reference for b in p.batches] for p in products] == [["batch-ORDERED-LAMP"], ["batch-ORDERED-SOFA"]]
+    assert repo.seen == set(products)
+    assert repo.get_many([]) == []
+
+
+@pytest.mark.integration
+@pytest.mark.repository
+def test_repository_iter_all_streams_untracked_products(backend_uow):
+    with backend_uow:
+        for i in range(5):
+            backend_uow.products.add(Product(sku=f"STREAMED-{i}", batches=[Batch(ref=f"b{i}", sku=f"STREAMED-{i}", qty=10, eta=None)]))
+        backend_uow.commit()
+    with backend_uow:
+        repo = backend_uow.products
+        assert [(p.sku, len(p.batches)) for p in repo.iter_all(batch_size=2)] == [(f"STREAMED-{i}", 1) for i in range(5)]
+        assert repo.seen == set()
+        assert len(list(repo.iter_all(batch_size=2, read_only=False))) == len(repo.seen) == 5
+
+
+@pytest.mark.integration
+@pytest.mark.repository
+def test_repository_pages_batches_with_allocated_quantities(backend_uow):
+    etas = (("b3", date(2026, 3, 1)), ("b1", None), ("b2", date(2026, 2, 1)))
+    batches = [Batch(ref=ref, sku="PAGED-SOFA", qty=10, eta=eta) for ref, eta in etas]
+    product = Product(sku="PAGED-SOFA", batches=batches)
+    product.allocate(OrderLine(orderId="o1", sku="PAGED-SOFA", qty=4))
+    product.allocate(OrderLine(orderId="o2", sku="PAGED-SOFA", qty=3))
+    with backend_uow:
+        backend_uow.products.add(product)
+        backend_uow.commit()
+        version = backend_uow.products.get_version(sku="PAGED-SOFA")
+    with backend_uow:
+        repo = backend_uow.products
+        first = repo.page_batches(sku="PAGED-SOFA", after=None, limit=2)
+        assert [(row["reference"], row["allocated"]) for row in first] == [("b1", 7), ("b2", 0)]
+        assert [(row["reference"], row["allocated"]) for row in repo.page_batches(sku="PAGED-SOFA", after="b2", limit=2)] == [("b3", 0)]
+        assert repo.page_products(after=None, limit=10) == [("PAGED-SOFA", version)]
+        assert repo.page_products(after="PAGED-SOFA", limit=10) == []
+
+
+@pytest.mark.integration
+@pytest.mark.repository
+def test_repository_deletes_batches_set_based_and_records_events(orm_session):
+    product = Product(sku="SEASONAL-LAMP", batches=[Batch(ref=f"b{i}", sku="SEASONAL-LAMP", qty=1, eta=None) for i in range(20)])
+    for i in range(20):
+        product.allocate(OrderLine(orderId=f"o{i}", sku="SEASONAL-LAMP", qty=1))
+    orm_session.add(product)
+    orm_session.commit()
+    version = product.version_number
+    orm_session.expunge_all()
+
+    repo = SQLAlchemyRepository(orm_session)
+    with sqlstats.assert_max_queries(6):
+        assert repo.delete_batches([f"b{i}" for i in range(15)] + ["no-such-batch"]) == 15
+    orm_session.commit()
+
+    assert [type(e).__name__ for e in repo.events].count("Deallocated") == 15
+    assert [type(e).__name__ for e in repo.events].count("BatchDeleted") == 15
+    assert list(orm_session.execute(text("SELECT count(*) FROM batches"))) == [(5,)]
+    assert list(orm_session.execute(text("SELECT count(*) FROM allocations"))) == [(5,)]
+    assert list(orm_session.execute(text("SELECT count(*) FROM order_lines"))) == [(5,)]
+    assert repo.get_version("SEASONAL-LAMP") == version + 1
+
+
+@pytest.mark.integration
+@pytest.mark.repository
+def test_repository_deletes_whole_products(orm_session):
+    for sku in ("OLD-LAMP", "OLD-SOFA", "NEW-LAMP"):
+        product = Product(sku=sku, batches=[Batch(ref=f"b-{sku}", sku=sku, qty=5, eta=None)])
+        product.allocate(OrderLine(orderId=f"o-{sku}", sku=sku, qty=2))
+        orm_session.add(product)
+    orm_session.commit()
+    orm_session.expunge_all()
+
+    repo = SQLAlchemyRepository(orm_session)
+    assert repo.delete_products(["OLD-LAMP", "OLD-SOFA", "NO-SUCH-SKU"]) == 2
+    orm_session.commit()
+    assert list(orm_session.execute(text("SELECT sku FROM products"))) == [("NEW-LAMP",)]
+    assert list(orm_session.execute(text("SELECT sku FROM order_lines"))) == [("NEW-LAMP",)]
+    assert {(type(e).__name__, e.sku) for e in repo.events} == {
+        ("Deallocated", "OLD-LAMP"),
+        ("BatchDeleted", "OLD-LAMP"),
+        ("Deallocated", "OLD-SOFA"),
+        ("BatchDeleted", "OLD-SOFA"),
+    }
+
+
+@pytest.mark.integration
+@pytest.mark.repository
+def test_repository_get_version_skips_loading_the_aggregate(backend_uow):
+    with backend_uow:
+        backend_uow.products.add(Product(sku="POLLED-SOFA", batches=[Batch(ref="batch1", sku="POLLED-SOFA", qty=10, eta=None)]))
+        backend_uow.commit()
+    with backend_uow:
+        repo = backend_uow.products
+        version = repo.get_version(sku="POLLED-SOFA")
+        assert version is not None
+        assert repo.get_version(sku="NO-SUCH-SKU") is None
+        batch_version = repo.get_batch_version(sku="POLLED-SOFA", reference="batch1")
+        assert repo.get_batch_version(sku="POLLED-SOFA", reference="batch2") is None
+        assert repo.get_batch_version(sku="NO-SUCH-SKU", reference="batch1") is None
+        assert repo.seen == set()
+        assert batch_version == (version, repo.get(sku="POLLED-SOFA").get_batch("batch1").version_number)
+
+
+@pytest.mark.integration
+@pytest.mark.repository
+def test_availability_repository_buckets_by_eta(backend_uow):
+    eta = date(2026, 3, 1)
+    with backend_uow:
+        repo = backend_uow.availability
+        repo.adjust(sku="BUCKETED-SOFA", eta=None, delta=10)
+        repo.adjust(sku="BUCKETED-SOFA", eta=None, delta=-4)
+        repo.adjust(sku="BUCKETED-SOFA", eta=eta, delta=7)
+        repo.adjust(sku="OTHER-SOFA", eta=None, delta=1)
+        assert repo.get(sku="BUCKETED-SOFA") == {None: 6, eta: 7}
+
+        repo.replace(sku="BUCKETED-SOFA", buckets={eta: 3})
+        assert repo.get(sku="BUCKETED-SOFA") == {eta: 3}
+        assert repo.get(sku="OTHER-SOFA") == {None: 1}
+
+
+def _drop_order_lines_unique_constraint(session):
+    """Recreate order_lines as older releases had it, without the unique (orderId, sku) constraint."""
+    for statement in (
+        'CREATE TABLE legacy_order_lines (id INTEGER PRIMARY KEY, sku VARCHAR(255), qty INTEGER NOT NULL, "orderId" VARCHAR(255))',
+        "DROP TABLE order_lines",
+        "ALTER TABLE legacy_order_lines RENAME TO order_lines",
+    ):
+        session.execute(text(statement))
+
+
+@pytest.mark.integration
+@pytest.mark.repository
+def test_repository_compacts_orphaned_and_duplicate_order_lines(orm_session):
+    _drop_order_lines_unique_constraint(orm_session)
+    product = Product(sku="LEGACY-LAMP", batches=[Batch(ref=ref, sku="LEGACY-LAMP", qty=10, eta=None) for ref in ("b1", "b2")])
+    product.allocate(OrderLine(orderId="o1", sku="LEGACY-LAMP", qty=2))
+    orm_session.add(product)
+    orm_session.commit()
+    version = product.version_number
+    orm_session.execute(
+        text("""INSERT INTO order_lines ("orderId", sku, qty) VALUES ('o1', 'LEGACY-LAMP', 2), ('gone', 'LEGACY-LAMP', 1)""")
+    )
+    duplicate_id = orm_session.execute(text("""SELECT max(id) FROM order_lines WHERE "orderId" = 'o1'""")).scalar()
+    b2_id = orm_session.execute(text("SELECT id FROM batches WHERE reference = 'b2'")).scalar()
+    orm_session.execute(
+        text("INSERT INTO allocations (orderline_id, batch_id) VALUES (:line, :batch)"), dict(line=duplicate_id, batch=b2_id)
+    )
+    orm_session.commit()
+    orm_session.expunge_all()
+
+    repo = SQLAlchemyRepository(orm_session)
+    assert repo.compact_order_lines() == {"orphans": 1, "duplicates": 1}
+    orm_session.commit()
+
+    assert list(orm_session.execute(text('SELECT "orderId", sku FROM order_lines'))) == [("o1", "LEGACY-LAMP")]
+    assert list(orm_session.execute(text("SELECT count(*) FROM allocations"))) == [(1,)]
+    assert [(type(e).__name__, e.batchref) for e in repo.events] == [("Deallocated", "b2")]
+    assert repo.get_version("LEGACY-LAMP") == version + 1
+    assert repo.compact_order_lines() == {"orphans": 0, "duplicates": 0}
+
+
+@pytest.mark.integration
+@pytest.mark.repository
+def test_repository_archives_closed_batches_with_their_lines(orm_session):
+    batches = [
+        Batch(ref="arrived-full", sku="ARCHIVED-LAMP", qty=3, eta=date(2026, 1, 1)),
+        Batch(ref="warehouse-full", sku="ARCHIVED-LAMP", qty=2, eta=None),
+        Batch(ref="arrived-open", sku="ARCHIVED-LAMP", qty=10, eta=date(2026, 1, 2)),
+        Batch(ref="incoming-full", sku="ARCHIVED-LAMP", qty=1, eta=date(2026, 6, 1)),
+    ]
+    product = Product(sku="ARCHIVED-LAMP", batches=batches)
+    for batch, order in zip(batches, ("o1", "o2", "o3", "o4")):
+        batch.allocate(OrderLine(orderId=order, sku="ARCHIVED-LAMP", qty=min(batch._purchase_quantity, 3)))
+    orm_session.add(product)
+    orm_session.commit()
+    version = product.version_number
+    orm_session.expunge_all()
+
+    repo = SQLAlchemyRepository(orm_session)
+    assert repo.archive_batches(before=date(2026, 3, 1), limit=1) == 1
+    assert repo.archive_batches(before=date(2026, 3, 1), limit=10) == 1
+    assert repo.archive_batches(before=date(2026, 3, 1), limit=10) == 0
+    orm_session.commit()
+    orm_session.expunge_all()
+
+    product = repo.get("ARCHIVED-LAMP")
+    assert sorted(b.reference for b in product.batches) == ["arrived-open", "incoming-full"]
+    assert product.version_number == version + 2
+    assert list(orm_session.execute(text('SELECT "orderId" FROM order_lines ORDER BY "orderId"'))) == [("o3",), ("o4",)]
+    history = repo.page_batches(sku="ARCHIVED-LAMP", after=None, limit=10, archived=True)
+    assert [(row["reference"], row["qty"], row["allocated"]) for row in history] == [("arrived-full", 3, 3), ("warehouse-full", 2, 2)]
+    assert list(orm_session.execute(text('SELECT "orderId", qty FROM archived_order_lines ORDER BY "orderId"'))) == [("o1", 3), ("o2", 2)]
+
+
+@pytest.mark.integration
+@pytest.mark.repository
+def test_repository_archives_batches_whose_ids_were_reused(orm_session):
+    repo = SQLAlchemyRepository(orm_session)
+    for sku in ("REUSED-LAMP", "REUSED-SOFA"):
+        batch = Batch(ref=f"{sku}-batch", sku=sku, qty=2, eta=None)
+        batch.allocate(OrderLine(orderId="o1", sku=sku, qty=2))
+        repo.add(Product(sku=sku, batches=[batch]))
+        orm_session.commit()
+        # SQLite hands the ids of the rows just archived out again.
+        assert repo.archive_batches(before=date(2026, 1, 1), limit=10) == 1
+        orm_session.commit()
+
+    assert list(orm_session.execute(text("SELECT COUNT(DISTINCT batch_id), COUNT(*) FROM archived_batches"))) == [(1, 2)]
+    assert [row["allocated"] for row in repo.page_batches(sku="REUSED-SOFA", after=None, limit=10, archived=True)] == [2]
+    assert repo.get_archived_allocations(["o1", "o2"], ["REUSED-LAMP", "REUSED-SOFA"]) == {
+        ("o1", "REUSED-LAMP"): "REUSED-LAMP-batch",
+        ("o1", "REUSED-SOFA"): "REUSED-SOFA-batch",
+    }
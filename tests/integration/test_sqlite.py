@@ -0,0 +1,102 @@
+import sqlite3
+import threading
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from allocation.adapters.orm import start_mappers
+from allocation.domain import events
+from allocation.domain.model import OrderLine
+from allocation.service_layer import handlers
+from allocation.service_layer.messagebus import MessageBus
+from allocation.service_layer.retry import is_retryable
+from allocation.service_layer.unit_of_work import SqlAlchemyUnitOfWork, make_engine
+
+
+@pytest.fixture
+def wal_session_factory(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'allocation.db'}")
+    clear_mappers()
+    start_mappers()
+    yield sessionmaker(bind=engine)
+    clear_mappers()
+    engine.dispose()
+
+
+@pytest.mark.integration
+@pytest.mark.uow
+def test_sqlite_engine_uses_wal_and_the_tuned_pragmas(wal_session_factory):
+    session = wal_session_factory()
+    try:
+        assert session.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert session.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert session.execute(text("PRAGMA foreign_keys")).scalar() == 1
+        assert session.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+    finally:
+        session.close()
+
+
+@pytest.mark.integration
+@pytest.mark.uow
+def test_sqlite_uow_commits_and_rolls_back(wal_session_factory):
+    uow = SqlAlchemyUnitOfWork(session_factory=wal_session_factory)
+    MessageBus.handle(events.BatchCreated(ref="b1", sku="EDGE-LAMP", qty=10, eta=None), uow=uow)
+    assert MessageBus.handle(events.AllocationRequired(orderId="o1", sku="EDGE-LAMP", qty=4), uow=uow) == ["b1"]
+
+    with uow:
+        uow.products.get("EDGE-LAMP").change_batch_quantity("b1", 100)
+    assert handlers.get_availability(sku="EDGE-LAMP", uow=uow)["in_stock"] == 6
+
+
+@pytest.mark.integration
+@pytest.mark.uow
+def test_sqlite_writers_queue_instead_of_conflicting(wal_session_factory):
+    uow = SqlAlchemyUnitOfWork(session_factory=wal_session_factory)
+    MessageBus.handle(events.BatchCreated(ref="b1", sku="EDGE-SOFA", qty=40, eta=None), uow=uow)
+    barrier = threading.Barrier(8)
+    errors = []
+
+    def allocate(worker: int):
+        barrier.wait()
+        for i in range(5):
+            try:
+                MessageBus.handle(events.AllocationRequired(orderId=f"o-{worker}-{i}", sku="EDGE-SOFA", qty=1), uow=uow)
+            except Exception as e:  # noqa: BLE001
+                errors.append(e)
+
+    threads = [threading.Thread(target=allocate, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert handlers.get_availability(sku="EDGE-SOFA", uow=uow)["in_stock"] == 0
+
+
+@pytest.mark.integration
+@pytest.mark.uow
+def test_sqlite_reads_do_not_wait_for_the_write_lock(wal_session_factory):
+    uow = SqlAlchemyUnitOfWork(session_factory=wal_session_factory)
+    MessageBus.handle(events.BatchCreated(ref="b1", sku="EDGE-DESK", qty=10, eta=None), uow=uow)
+    writer = SqlAlchemyUnitOfWork(session_factory=wal_session_factory)
+
+    with writer:
+        writer.products.get("EDGE-DESK").allocate(OrderLine("o1", "EDGE-DESK", 4))
+        writer.session.flush()
+        # An IMMEDIATE begin would wait for busy_timeout here, then fail with "database is locked".
+        assert handlers.get_batch(sku="EDGE-DESK", reference="b1", uow=uow)["qty"] == 10
+        assert handlers.get_availability(sku="EDGE-DESK", uow=uow)["in_stock"] == 10
+        writer.commit()
+    assert handlers.get_availability(sku="EDGE-DESK", uow=uow)["in_stock"] == 6
+
+
+@pytest.mark.integration
+def test_sqlite_busy_errors_are_retryable():
+    busy = sqlite3.OperationalError("database is locked")
+    busy.sqlite_errorcode = 5
+    assert is_retryable(OperationalError("COMMIT", {}, busy))
+    constraint = sqlite3.IntegrityError("NOT NULL constraint failed")
+    constraint.sqlite_errorcode = 1299
+    assert not is_retryable(OperationalError("INSERT", {}, constraint))
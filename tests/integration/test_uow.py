@@ -1,5 +1,9 @@
 import threading
+import time
 import traceback
+from datetime import date
+
+from allocation.adapters.repository import ADVISORY_LOCK, BATCH_VERSION, OPTIMISTIC, ROW_LOCK, LockPolicy
 from allocation.domain import model
 from allocation.service_layer.unit_of_work import SqlAlchemyUnitOfWork
 from sqlalchemy.orm.exc import StaleDataError
@@ -12,80 +16,79 @@ from concurrent.futures import ThreadPoolExecutor
 
 @pytest.mark.integration
 @pytest.mark.uow
-def test_uow_can_get_batch_and_allocate_to_it(session_factory, insert_batch_via_session):
+def test_uow_can_get_batch_and_allocate_to_it(backend_uow):
     sku = "HIPSTER-WORKBENCH"
-    orderId = "order1"
-    batchRef = "batch1"
+    with backend_uow:
+        backend_uow.products.add(model.Product(sku=sku, batches=[model.Batch(ref="batch1", sku=sku, qty=100, eta=None)]))
+        backend_uow.commit()
+
+    with backend_uow:
+        product = backend_uow.products.get(sku=sku)
+        assert product is not None
+        product.allocate(model.OrderLine(orderId="order1", sku=sku, qty=10))
+        backend_uow.commit()
+
+    with backend_uow:
+        product = backend_uow.products.get_by_batchref("batch1")
+        assert product.get_batch("batch1").allocated_line("order1") == model.OrderLine(orderId="order1", sku=sku, qty=10)
+
+
+@pytest.mark.integration
+@pytest.mark.uow
+def test_uow_allocations_are_stored_in_the_allocations_table(session_factory, insert_batch_via_session):
     session = session_factory()
-    insert_batch_via_session(
-        session=session,
-        ref=batchRef,
-        sku=sku,
-        qty=100,
-        eta=None,
-    )
+    insert_batch_via_session(session=session, ref="batch1", sku="HIPSTER-WORKBENCH", qty=100, eta=None)
     session.commit()
 
     uow = SqlAlchemyUnitOfWork(session_factory=session_factory)
     with uow:
-        product = uow.products.get(sku=sku)
-        assert product is not None
-        line = model.OrderLine(orderId=orderId, sku=sku, qty=10)
-        product.allocate(line)
+        uow.products.get(sku="HIPSTER-WORKBENCH").allocate(model.OrderLine(orderId="order1", sku="HIPSTER-WORKBENCH", qty=10))
         uow.commit()
 
-    orderLine_id = session.execute(
-        text('SELECT id FROM order_lines WHERE "orderId" = :orderid AND sku = :sku'),
-        dict(orderid=orderId, sku=sku),
-    ).scalar_one()
-
     allocated_batch_ref = session.execute(
-        text("SELECT b.reference FROM batches AS b JOIN allocations AS a ON b.id = a.batch_id WHERE a.orderline_id = :orderline_id"),
-        dict(orderline_id=orderLine_id),
+        text(
+            "SELECT b.reference FROM batches AS b JOIN allocations AS a ON b.id = a.batch_id "
+            'JOIN order_lines AS ol ON ol.id = a.orderline_id WHERE ol."orderId" = :orderid'
+        ),
+        dict(orderid="order1"),
     ).scalar_one()
-
-    assert allocated_batch_ref == batchRef
+    assert allocated_batch_ref == "batch1"
 
 
 @pytest.mark.integration
 @pytest.mark.uow
-def test_rolls_back_uncommitted_work_by_default(session_factory, insert_batch_via_session):
-    uow = SqlAlchemyUnitOfWork(session_factory=session_factory)
-    with uow:
-        insert_batch_via_session(
-            session=uow.session,
-            ref="batch1",
-            sku="MEDIUM-PLINTH",
-            qty=100,
-            eta=None,
-        )
+def test_rolls_back_uncommitted_work_by_default(backend_uow):
+    with backend_uow:
+        batch = model.Batch(ref="batch1", sku="MEDIUM-PLINTH", qty=100, eta=None)
+        backend_uow.products.add(model.Product(sku="MEDIUM-PLINTH", batches=[batch]))
 
-    new_session = session_factory()
-    rows = list(new_session.execute(text("SELECT * FROM batches")))
-    assert rows == []
+    with backend_uow:
+        assert backend_uow.products.get(sku="MEDIUM-PLINTH") is None
+        assert backend_uow.products.get_by_batchref("batch1") is None
 
 
 @pytest.mark.integration
 @pytest.mark.uow
-def test_rolls_back_on_error(session_factory, insert_batch_via_session):
+def test_rolls_back_on_error(backend_uow):
     class MyException(Exception):
         pass
 
-    uow = SqlAlchemyUnitOfWork(session_factory=session_factory)
+    with backend_uow:
+        backend_uow.products.add(model.Product(sku="LARGE-FORK", batches=[model.Batch(ref="batch1", sku="LARGE-FORK", qty=100, eta=None)]))
+        backend_uow.commit()
+        version = backend_uow.products.get_version(sku="LARGE-FORK")
+
     with pytest.raises(MyException):
-        with uow:
-            insert_batch_via_session(
-                session=uow.session,
-                ref="batch1",
-                sku="LARGE-FORK",
-                qty=100,
-                eta=None,
-            )
+        with backend_uow:
+            product = backend_uow.products.get(sku="LARGE-FORK")
+            product.allocate(model.OrderLine(orderId="order1", sku="LARGE-FORK", qty=10))
+            product.add_batch(model.Batch(ref="batch2", sku="LARGE-FORK", qty=5, eta=None))
             raise MyException()
 
-    new_session = session_factory()
-    rows = list(new_session.execute(text("SELECT * FROM batches")))
-    assert rows == []
+    with backend_uow:
+        product = backend_uow.products.get(sku="LARGE-FORK")
+        assert [(b.reference, b.allocated_quantity) for b in product.batches] == [("batch1", 0)]
+        assert product.version_number == version
 
 
 def __try_to_allocate(sku: str, line: model.OrderLine, exceptions: List[Exception], session_factory, barrier: threading.Barrier):
@@ -171,3 +174,169 @@ def test_concurrent_updates_to_version_are_not_allowed(postgres_session_factory,
         assert candidate_count == 1
     finally:
         verify_session.close()
+
+
+@pytest.mark.integration
+@pytest.mark.uow
+@pytest.mark.parametrize("mode", [ROW_LOCK, ADVISORY_LOCK])
+def test_concurrent_updates_under_a_pessimistic_lock_policy_wait_instead_of_conflicting(
+    postgres_session_factory, insert_batch_via_session, mode
+):
+    sku = random_sku(name="LOCKED-SOFA")
+    session = postgres_session_factory()
+    batch_id = insert_batch_via_session(session=session, ref=random_batchref(), sku=sku, qty=100, eta=None)
+    session.commit()
+    session.close()
+
+    holding = threading.Event()
+    seen_available = []
+
+    def allocate(orderid: str, qty: int, hold: bool) -> None:
+        uow = SqlAlchemyUnitOfWork(session_factory=postgres_session_factory, lock_policy=LockPolicy(default=mode))
+        with uow:
+            product = uow.products.get(sku=sku)
+            assert product is not None
+            seen_available.append(product.batches[0].available_quantity)
+            if hold:
+                holding.set()
+                time.sleep(0.5)  # long enough for the other unit of work to queue up on the lock
+            product.allocate(model.OrderLine(orderid, sku, qty))
+            uow.commit()
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(allocate, random_orderid(name="order1"), 12, True)
+        assert holding.wait(timeout=5)
+        second = executor.submit(allocate, random_orderid(name="order2"), 30, False)
+        # Neither raises: the second waits for the lock instead of failing on a stale version.
+        first.result()
+        second.result()
+
+    # The second loaded the product only once the first had committed.
+    assert seen_available == [100, 88]
+    verify_session = postgres_session_factory()
+    try:
+        assert verify_session.execute(text("SELECT version_number FROM products WHERE sku = :sku"), dict(sku=sku)).scalar_one() == 2
+        allocated = verify_session.execute(
+            text("SELECT COUNT(*) FROM allocations WHERE batch_id = :batch_id"),
+            dict(batch_id=batch_id),
+        ).scalar_one()
+        assert allocated == 2
+    finally:
+        verify_session.close()
+
+
+@pytest.mark.integration
+@pytest.mark.uow
+def test_uow_instance_keeps_a_separate_session_per_thread(session_factory):
+    uow = SqlAlchemyUnitOfWork(session_factory=session_factory)
+    inside = threading.Barrier(2)
+    sessions = []
+
+    def use_uow():
+        with uow:
+            session = uow.session
+            sessions.append(session)
+            inside.wait(timeout=5)
+            assert uow.session is session
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(lambda _: use_uow(), range(2)))
+    assert len(sessions) == 2
+    assert sessions[0] is not sessions[1]
+
+
+def _two_batch_product(session_factory, sku: str) -> None:
+    uow = SqlAlchemyUnitOfWork(session_factory=session_factory)
+    with uow:
+        uow.products.add(
+            model.Product(
+                sku=sku,
+                batches=[model.Batch("early", sku, 5, eta=date(2026, 1, 1)), model.Batch("late", sku, 100, eta=date(2026, 2, 1))],
+            )
+        )
+        uow.commit()
+
+
+def _interleave(session_factory, sku: str, mode: str, first, second) -> None:
+    """Load the product in two units of work, run and commit `first` in one, then `second` in the stale other."""
+    stale = SqlAlchemyUnitOfWork(session_factory=session_factory, lock_policy=LockPolicy(default=mode))
+    fresh = SqlAlchemyUnitOfWork(session_factory=session_factory, lock_policy=LockPolicy(default=mode))
+    with stale:
+        stale_product = stale.products.get(sku=sku)
+        with fresh:
+            first(fresh.products.get(sku=sku))
+            fresh.commit()
+        second(stale_product)
+        stale.commit()
+
+
+@pytest.mark.integration
+@pytest.mark.uow
+@pytest.mark.parametrize("mode, conflicts", [(OPTIMISTIC, True), (BATCH_VERSION, False)])
+def test_allocations_to_different_batches_only_conflict_under_product_versioning(session_factory, mode, conflicts):
+    sku = random_sku(name="BATCHED-SOFA")
+    _two_batch_product(session_factory, sku)
+    allocate_small = lambda product: product.allocate(model.OrderLine("small", sku, 2))  # noqa: E731
+    allocate_large = lambda product: product.allocate(model.OrderLine("large", sku, 50))  # noqa: E731, lands on "late"
+
+    if conflicts:
+        with pytest.raises(StaleDataError):
+            _interleave(session_factory, sku, mode, allocate_small, allocate_large)
+    else:
+        _interleave(session_factory, sku, mode, allocate_small, allocate_large)
+        session = session_factory()
+        rows = session.execute(
+            text(
+                'SELECT b.reference, l."orderId" FROM allocations a'
+                " JOIN batches b ON b.id = a.batch_id JOIN order_lines l ON l.id = a.orderline_id"
+            )
+        )
+        assert sorted(rows) == [("early", "small"), ("late", "large")]
+
+
+@pytest.mark.integration
+@pytest.mark.uow
+def test_batch_version_tracks_allocations_the_product_version_misses(session_factory):
+    sku = random_sku(name="BATCHED-SOFA")
+    _two_batch_product(session_factory, sku)
+    uow = SqlAlchemyUnitOfWork(session_factory=session_factory, lock_policy=LockPolicy(default=BATCH_VERSION))
+    with uow:
+        before = uow.products.get_batch_version(sku=sku, reference="early")
+        uow.products.get(sku=sku).allocate(model.OrderLine("small", sku, 2))
+        uow.commit()
+    with uow:
+        after = uow.products.get_batch_version(sku=sku, reference="early")
+    # The product version alone, which the ETag of GET /batches used to be, did not move.
+    assert after[0] == before[0]
+    assert after != before
+
+
+@pytest.mark.integration
+@pytest.mark.uow
+def test_batch_versioning_still_conflicts_on_the_same_batch(session_factory):
+    sku = random_sku(name="BATCHED-SOFA")
+    _two_batch_product(session_factory, sku)
+    with pytest.raises(StaleDataError):
+        _interleave(
+            session_factory,
+            sku,
+            BATCH_VERSION,
+            lambda product: product.allocate(model.OrderLine("first", sku, 4)),
+            lambda product: product.allocate(model.OrderLine("second", sku, 4)),
+        )
+
+
+@pytest.mark.integration
+@pytest.mark.uow
+def test_batch_versioning_rejects_an_allocation_that_skipped_a_batch_which_gained_room(session_factory):
+    sku = random_sku(name="BATCHED-SOFA")
+    _two_batch_product(session_factory, sku)
+    with pytest.raises(StaleDataError):
+        # "early" grows to 50 while the stale allocation of 20 skips it for "late": no longer first-fit.
+        _interleave(
+            session_factory,
+            sku,
+            BATCH_VERSION,
+            lambda product: product.change_batch_quantity("early", 50),
+            lambda product: product.allocate(model.OrderLine("skipper", sku, 20)),
+        )
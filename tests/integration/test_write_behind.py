@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import pytest
+
+from allocation.adapters.journal import Journal
+from allocation.domain import events
+from allocation.service_layer import handlers
+from allocation.service_layer.messagebus import MessageBus
+from allocation.service_layer.unit_of_work import SqlAlchemyUnitOfWork
+from allocation.service_layer.write_behind import WriteBehind, store_records
+
+
+def _allocated(uow, sku: str) -> dict:
+    return {row["reference"]: row["allocated"] for row in handlers.list_batches(sku=sku, uow=uow)["items"]}
+
+
+@pytest.mark.integration
+@pytest.mark.uow
+def test_concurrent_write_behind_allocations_reach_the_database(tmp_path, session_factory):
+    database = SqlAlchemyUnitOfWork(session_factory=session_factory)
+    MessageBus.handle(events.BatchCreated(ref="b1", sku="FLASH-LAMP", qty=30, eta=None), uow=database)
+    write_behind = WriteBehind(["FLASH-LAMP"], journal=Journal(str(tmp_path / "journal")), uow=database, batch_size=7)
+    write_behind.start()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(
+            executor.map(
+                lambda i: handlers.allocate(events.AllocationRequired(orderId=f"o{i}", sku="FLASH-LAMP", qty=1), uow=write_behind.uow),
+                range(40),
+            )
+        )
+    write_behind.stop()
+
+    assert results.count("b1") == 30
+    assert _allocated(database, "FLASH-LAMP") == {"b1": 30}
+    assert handlers.get_availability(sku="FLASH-LAMP", uow=database)["in_stock"] == 0
+    assert list(Journal(write_behind.journal.path).read()) == []
+
+
+@pytest.mark.integration
+@pytest.mark.uow
+def test_records_stored_before_a_crash_are_not_applied_twice(tmp_path, session_factory):
+    database = SqlAlchemyUnitOfWork(session_factory=session_factory)
+    MessageBus.handle(events.BatchCreated(ref="b1", sku="FLASH-SOFA", qty=10, eta=None), uow=database)
+    journal = Journal(str(tmp_path / "journal"))
+    records = [
+        ("FLASH-SOFA", events.Allocated(orderId="o1", sku="FLASH-SOFA", qty=4, batchref="b1", eta=None)),
+        ("FLASH-SOFA", events.BatchCreated(ref="b2", sku="FLASH-SOFA", qty=5, eta=None)),
+        ("FLASH-SOFA", events.Deallocated(orderId="o1", sku="FLASH-SOFA", qty=4, batchref="b1", eta=None)),
+        ("FLASH-SOFA", events.Allocated(orderId="o1", sku="FLASH-SOFA", qty=4, batchref="b2", eta=None)),
+    ]
+    journal.append(records)
+    # Stored, but the process died before discarding them from the journal.
+    store_records(records[:3], uow=database)
+    journal.close()
+
+    write_behind = WriteBehind(["FLASH-SOFA"], journal=Journal(journal.path), uow=database)
+    assert write_behind.start() == 4
+    write_behind.stop()
+
+    assert _allocated(database, "FLASH-SOFA") == {"b1": 0, "b2": 4}
+    assert _allocated(write_behind.uow, "FLASH-SOFA") == {"b1": 0, "b2": 4}
+    availability = handlers.get_availability(sku="FLASH-SOFA", uow=database)
+    assert availability["in_stock"] == 11
+
+
+@pytest.mark.integration
+@pytest.mark.uow
+def test_a_line_reallocated_by_a_quantity_decrease_is_stored_in_one_flush(tmp_path, session_factory):
+    database = SqlAlchemyUnitOfWork(session_factory=session_factory)
+    MessageBus.handle(events.BatchCreated(ref="A", sku="FLASH-TABLE", qty=10, eta=None), uow=database)
+    MessageBus.handle(events.BatchCreated(ref="B", sku="FLASH-TABLE", qty=10, eta=date(2026, 3, 1)), uow=database)
+    write_behind = WriteBehind(["FLASH-TABLE"], journal=Journal(str(tmp_path / "journal")), uow=database)
+    write_behind.recover()
+
+    assert handlers.allocate(events.AllocationRequired(orderId="o1", sku="FLASH-TABLE", qty=4), uow=write_behind.uow) == "A"
+    write_behind.writer.drain()
+    MessageBus.handle(events.BatchQuantityChanged(ref="A", qty=2), uow=write_behind.uow)
+
+    # Deallocated from A and allocated to B again: one order line, moved, within the same transaction.
+    assert write_behind.writer.drain() == 3
+    assert write_behind.writer.backlog == 0
+    assert _allocated(database, "FLASH-TABLE") == {"A": 0, "B": 4}
+    assert list(write_behind.journal.read()) == []
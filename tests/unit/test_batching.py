@@ -0,0 +1,132 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from allocation.domain import events
+from allocation.domain.exceptions import InvalidSku
+from allocation.service_layer import handlers
+from allocation.service_layer.batching import AllocationBatcher, allocate_bulk
+from allocation.service_layer.messagebus import MessageBus
+
+
+def _count_commits(uow):
+    commits = []
+    commit = uow.commit
+
+    def counting_commit():
+        commits.append(threading.get_ident())
+        commit()
+
+    uow.commit = counting_commit
+    return commits
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_allocate_many_commits_once(make_fake_uow):
+    uow = make_fake_uow
+    sku = "GROUPED-LAMP"
+    MessageBus.handle(events.BatchCreated(ref="b1", sku=sku, qty=2, eta=None), uow=uow)
+    commits = _count_commits(uow)
+    results = handlers.allocate_many(
+        batch=[events.AllocationRequired(orderId=f"o{i}", sku=sku, qty=1) for i in range(3)],
+        uow=uow,
+    )
+    assert results == ["b1", "b1", None]
+    assert len(commits) == 1
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_allocate_many_rejects_mixed_skus(make_fake_uow):
+    with pytest.raises(ValueError, match="exactly one sku"):
+        handlers.allocate_many(
+            batch=[events.AllocationRequired("o1", "SKU-A", 1), events.AllocationRequired("o2", "SKU-B", 1)],
+            uow=make_fake_uow,
+        )
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_batcher_groups_simultaneous_calls_into_one_commit(make_fake_uow):
+    uow = make_fake_uow
+    sku = "FLASH-SALE-CHAIR"
+    MessageBus.handle(events.BatchCreated(ref="b1", sku=sku, qty=100, eta=None), uow=uow)
+    commits = _count_commits(uow)
+    batcher = AllocationBatcher(window=0.2, max_size=1000)
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        results = list(executor.map(lambda i: batcher.submit(events.AllocationRequired(f"o{i}", sku, 1), uow=uow), range(10)))
+    assert results == ["b1"] * 10
+    assert len(commits) == 1
+    assert uow.products.get(sku=sku).batches[0].available_quantity == 90
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_batcher_flushes_early_when_batch_is_full(make_fake_uow):
+    uow = make_fake_uow
+    sku = "FLASH-SALE-TABLE"
+    MessageBus.handle(events.BatchCreated(ref="b1", sku=sku, qty=100, eta=None), uow=uow)
+    commits = _count_commits(uow)
+    batcher = AllocationBatcher(window=5, max_size=1)
+    assert batcher.submit(events.AllocationRequired("o1", sku, 1), uow=uow) == "b1"
+    assert len(commits) == 1
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_batcher_propagates_errors_to_every_caller(make_fake_uow):
+    batcher = AllocationBatcher(window=0.1)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(batcher.submit, events.AllocationRequired(f"o{i}", "NO-SUCH-SKU", 1), make_fake_uow) for i in range(3)]
+        for future in futures:
+            with pytest.raises(InvalidSku):
+                future.result()
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_allocate_bulk_reports_per_line_results(make_fake_uow):
+    uow = make_fake_uow
+    MessageBus.handle(events.BatchCreated(ref="lamp-batch", sku="BULK-LAMP", qty=5, eta=None), uow=uow)
+    MessageBus.handle(events.BatchCreated(ref="sofa-batch", sku="BULK-SOFA", qty=5, eta=None), uow=uow)
+    commits = _count_commits(uow)
+    results = allocate_bulk(
+        batch=[
+            events.AllocationRequired("o1", "BULK-LAMP", 2),
+            events.AllocationRequired("o1", "BULK-SOFA", 2),
+            events.AllocationRequired("o1", "NO-SUCH-SKU", 2),
+            events.AllocationRequired("o2", "BULK-LAMP", 2),
+            events.AllocationRequired("o3", "BULK-LAMP", 2),
+        ],
+        uow=uow,
+    )
+    assert [r["batchref"] for r in results] == ["lamp-batch", "sofa-batch", None, "lamp-batch", None]
+    assert results[2]["error"] == "Invalid sku NO-SUCH-SKU"
+    assert results[4]["error"] == "Out of stock for sku BULK-LAMP"
+    assert len(commits) == 2
+    assert any(isinstance(e, events.OutOfStock) for e in uow.events_published)
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_allocate_bulk_reports_failed_follow_up_events_per_sku(make_fake_uow, monkeypatch):
+    uow = make_fake_uow
+    MessageBus.handle(events.BatchCreated(ref="lamp-batch", sku="BULK-LAMP", qty=5, eta=None), uow=uow)
+    MessageBus.handle(events.BatchCreated(ref="sofa-batch", sku="BULK-SOFA", qty=5, eta=None), uow=uow)
+
+    def failing_for_lamps(event, uow):
+        if event.sku == "BULK-LAMP":
+            raise RuntimeError("listener down")
+
+    monkeypatch.setitem(MessageBus.HANDLERS, events.Allocated, [failing_for_lamps])
+    results = allocate_bulk(
+        batch=[events.AllocationRequired("o1", "BULK-LAMP", 2), events.AllocationRequired("o1", "BULK-SOFA", 2)],
+        uow=uow,
+    )
+    assert [(r["batchref"], r["error"]) for r in results] == [
+        ("lamp-batch", "Allocated, but handling its events failed: listener down"),
+        ("sofa-batch", None),
+    ]
+    assert uow.products.get("BULK-LAMP").batches[0].allocated_quantity == 2
@@ -0,0 +1,94 @@
+import asyncio
+import threading
+
+import pytest
+
+from allocation.adapters.broadcast import DISCONNECT, EventBroadcaster
+from allocation.domain import events
+from allocation.service_layer.messagebus import MessageBus
+
+
+def allocated(orderId: str, sku: str = "STREAMED-LAMP") -> events.Allocated:
+    return events.Allocated(orderId=orderId, sku=sku, qty=1, batchref="b1", eta=None)
+
+
+async def drain(subscription, timeout: float = 0.05):
+    received = []
+    try:
+        while (event := await subscription.get(timeout=timeout)) is not None:
+            received.append(event)
+    except StopAsyncIteration:
+        received.append("closed")
+    return received
+
+
+@pytest.mark.unit
+def test_subscribers_only_receive_their_skus_and_streamed_events():
+    async def scenario():
+        broadcaster = EventBroadcaster()
+        lamps = broadcaster.subscribe(skus=["STREAMED-LAMP"])
+        everything = broadcaster.subscribe()
+        broadcaster.publish(allocated("o1"))
+        broadcaster.publish(allocated("o2", sku="STREAMED-SOFA"))
+        broadcaster.publish(events.AllocationRequired(orderId="o3", sku="STREAMED-LAMP", qty=1))
+        return await drain(lamps), await drain(everything)
+
+    lamps, everything = asyncio.run(scenario())
+    assert lamps == [allocated("o1")]
+    assert everything == [allocated("o1"), allocated("o2", sku="STREAMED-SOFA")]
+
+
+@pytest.mark.unit
+def test_slow_subscriber_drops_its_oldest_events():
+    async def scenario():
+        broadcaster = EventBroadcaster(buffer_size=2)
+        slow = broadcaster.subscribe()
+        for n in range(5):
+            broadcaster.publish(allocated(f"o{n}"))
+        return slow, await drain(slow)
+
+    slow, received = asyncio.run(scenario())
+    assert received == [allocated("o3"), allocated("o4")]
+    assert slow.dropped == 3
+
+
+@pytest.mark.unit
+def test_slow_subscriber_is_disconnected_without_affecting_others():
+    async def scenario():
+        broadcaster = EventBroadcaster(buffer_size=2)
+        slow = broadcaster.subscribe(overflow=DISCONNECT)
+        fast = broadcaster.subscribe(buffer_size=10)
+        for n in range(3):
+            broadcaster.publish(allocated(f"o{n}"))
+        return broadcaster, await drain(slow), await drain(fast)
+
+    broadcaster, slow, fast = asyncio.run(scenario())
+    assert slow == ["closed"]
+    assert fast == [allocated("o0"), allocated("o1"), allocated("o2")]
+    assert broadcaster.subscribers == 1
+
+
+@pytest.mark.unit
+def test_events_published_from_worker_threads_reach_the_loop():
+    async def scenario():
+        broadcaster = EventBroadcaster()
+        subscription = broadcaster.subscribe()
+        worker = threading.Thread(target=broadcaster.publish, args=(allocated("o1"),))
+        worker.start()
+        worker.join()
+        return await drain(subscription)
+
+    assert asyncio.run(scenario()) == [allocated("o1")]
+
+
+@pytest.mark.unit
+def test_message_bus_notifies_listeners_after_handlers_ran(make_fake_uow):
+    uow = make_fake_uow
+    seen = []
+    MessageBus.LISTENERS.append(seen.append)
+    try:
+        MessageBus.handle(event=events.BatchCreated(ref="b1", sku="STREAMED-LAMP", qty=10, eta=None), uow=uow)
+        MessageBus.handle(event=events.AllocationRequired(orderId="o1", sku="STREAMED-LAMP", qty=2), uow=uow)
+    finally:
+        MessageBus.LISTENERS.remove(seen.append)
+    assert [type(event) for event in seen] == [events.BatchCreated, events.AllocationRequired, events.Allocated]
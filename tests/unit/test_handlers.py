@@ -1,11 +1,16 @@
 from datetime import date
+from types import SimpleNamespace
+from typing import Optional
 from unittest import mock
 
 import pytest
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 
 from allocation.domain import events
-from allocation.domain.exceptions import InvalidBatchReference, InvalidSku, UnallocatedLine
-from allocation.service_layer import handlers
+from allocation.domain.exceptions import ConcurrencyError, InvalidBatchReference, InvalidSku, UnallocatedLine
+from allocation.domain.model import OrderLine
+from allocation.service_layer import handlers, retry
 from allocation.service_layer.messagebus import MessageBus
 
 
@@ -181,3 +186,324 @@ def test_reallocates_on_batch_quantity_changed(make_fake_uow):
 
     collected_events = list(uow.events_published)
     assert any(isinstance(e, events.AllocationRequired) and e.orderId in ["order1", "order2"] for e in collected_events)
+
+
+@pytest.fixture
+def instant_retries():
+    retry.set_policy(retry.RetryPolicy(attempts=3, base_delay=0, max_delay=0))
+    retry.stats.reset()
+    yield
+    retry.set_policy(None)
+
+
+def _fail_commits(uow, times: int):
+    commit = uow.commit
+    failures = iter(range(times))
+
+    def flaky_commit():
+        if next(failures, None) is not None:
+            raise StaleDataError("UPDATE statement on table 'products' expected to update 1 row(s); 0 were matched.")
+        commit()
+
+    uow.commit = flaky_commit
+
+
+@pytest.mark.unit
+@pytest.mark.service
+@pytest.mark.usefixtures("instant_retries")
+def test_allocate_retries_on_stale_data(make_fake_uow):
+    uow = make_fake_uow
+    sku = "CONTENDED-LAMP"
+    MessageBus.handle(events.BatchCreated(ref="b1", sku=sku, qty=100, eta=None), uow=uow)
+    _fail_commits(uow, times=2)
+    results = MessageBus.handle(events.AllocationRequired(orderId="o1", sku=sku, qty=10), uow=uow)
+    assert results[0] == "b1"
+    assert retry.stats.retries == 2
+    assert retry.stats.exhausted == 0
+
+
+@pytest.mark.unit
+@pytest.mark.service
+@pytest.mark.usefixtures("instant_retries")
+def test_allocate_gives_up_after_retry_budget(make_fake_uow):
+    uow = make_fake_uow
+    sku = "CONTENDED-CHAIR"
+    MessageBus.handle(events.BatchCreated(ref="b1", sku=sku, qty=100, eta=None), uow=uow)
+    _fail_commits(uow, times=3)
+    with pytest.raises(ConcurrencyError, match="allocate conflicted 3 times"):
+        MessageBus.handle(events.AllocationRequired(orderId="o1", sku=sku, qty=10), uow=uow)
+    assert retry.stats.exhausted == 1
+
+
+@pytest.mark.unit
+@pytest.mark.service
+@pytest.mark.usefixtures("instant_retries")
+def test_domain_errors_are_not_retried(make_fake_uow):
+    uow = make_fake_uow
+    with pytest.raises(InvalidSku):
+        handlers.deallocate(sku="NOPE", orderId="o1", qty=1, uow=uow)
+    assert retry.stats.retries == 0
+
+
+class _DriverError(Exception):
+    """What psycopg2 raises: the SQLSTATE as `pgcode`, the violated constraint in `diag`."""
+
+    def __init__(self, pgcode: str, constraint_name: Optional[str]):
+        super().__init__(pgcode)
+        self.pgcode = pgcode
+        self.diag = SimpleNamespace(constraint_name=constraint_name)
+
+
+def _postgres_error(sqlstate: str, constraint_name: Optional[str] = None) -> IntegrityError:
+    return IntegrityError("INSERT", {}, _DriverError(sqlstate, constraint_name))
+
+
+@pytest.mark.unit
+def test_only_conflicting_product_creation_is_a_retryable_unique_violation():
+    assert retry.is_retryable(_postgres_error("40001"))
+    assert retry.is_retryable(_postgres_error("23505", "products_pkey"))
+    assert not retry.is_retryable(_postgres_error("23505", "uq_order_lines_order_sku"))
+    assert not retry.is_retryable(_postgres_error("23505"))
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_get_product_version_tracks_changes(make_fake_uow):
+    uow = make_fake_uow
+    sku = "POLLED-LAMP"
+    with pytest.raises(InvalidSku, match=f"Invalid sku {sku}"):
+        handlers.get_product_version(sku=sku, uow=uow)
+    MessageBus.handle(events.BatchCreated(ref="b1", sku=sku, qty=10, eta=None), uow=uow)
+    created = handlers.get_product_version(sku=sku, uow=uow)
+    MessageBus.handle(events.AllocationRequired(orderId="o1", sku=sku, qty=1), uow=uow)
+    assert handlers.get_product_version(sku=sku, uow=uow) == created + 1
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_get_batch_version_requires_the_batch(make_fake_uow):
+    uow = make_fake_uow
+    sku = "POLLED-DESK"
+    with pytest.raises(InvalidSku, match=f"Invalid sku {sku}"):
+        handlers.get_batch_version(sku=sku, reference="b1", uow=uow)
+    MessageBus.handle(events.BatchCreated(ref="b1", sku=sku, qty=10, eta=None), uow=uow)
+    assert handlers.get_batch_version(sku=sku, reference="b1", uow=uow) == (handlers.get_product_version(sku=sku, uow=uow), 0)
+    with pytest.raises(InvalidBatchReference):
+        handlers.get_batch_version(sku=sku, reference="b2", uow=uow)
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_availability_is_adjusted_in_the_commit_that_allocates(make_fake_uow):
+    uow = make_fake_uow
+    sku = "ATOMIC-LAMP"
+    MessageBus.handle(events.BatchCreated("b1", sku, 10, None), uow)
+    commit = uow.commit
+    uow.commit = mock.Mock(side_effect=commit)
+
+    MessageBus.handle(events.AllocationRequired("o1", sku, 4), uow)
+    assert uow.commit.call_count == 1
+    assert handlers.get_availability(sku=sku, uow=uow)["in_stock"] == 6
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_availability_summary_follows_domain_events(make_fake_uow):
+    uow = make_fake_uow
+    sku = "SUMMARIZED-LAMP"
+    eta = date(2026, 3, 1)
+    with pytest.raises(InvalidSku, match=f"Invalid sku {sku}"):
+        handlers.get_availability(sku=sku, uow=uow)
+
+    for event in [
+        events.BatchCreated("in-stock", sku, 20, None),
+        events.BatchCreated("shipment", sku, 50, eta),
+        events.BatchCreated("doomed", sku, 7, date(2026, 4, 1)),
+        events.AllocationRequired("o1", sku, 15),
+        events.AllocationRequired("o2", sku, 15),
+        events.BatchQuantityChanged("in-stock", 10),
+    ]:
+        MessageBus.handle(event, uow)
+    handlers.deallocate(sku=sku, orderId="o1", qty=15, uow=uow)
+    MessageBus.handle_new_events(uow=uow)
+    handlers.delete_batch(sku=sku, reference="doomed", uow=uow)
+    MessageBus.handle_new_events(uow=uow)
+
+    assert handlers.get_availability(sku=sku, uow=uow) == {
+        "sku": sku,
+        "in_stock": 10,
+        "incoming": [{"eta": "2026-03-01", "qty": 35}],
+        "total": 45,
+    }
+    assert handlers.check_availability(sku=sku, uow=uow)["consistent"] is True
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_check_availability_repairs_drifted_summary(make_fake_uow):
+    uow = make_fake_uow
+    sku = "DRIFTED-LAMP"
+    MessageBus.handle(events.BatchCreated("b1", sku, 20, None), uow)
+    uow.availability.adjust(sku=sku, eta=None, delta=-3)
+
+    result = handlers.check_availability(sku=sku, uow=uow, repair=True)
+    assert result["consistent"] is False
+    assert result["stored"]["in_stock"] == 17
+    assert result["expected"]["in_stock"] == 20
+    assert handlers.check_availability(sku=sku, uow=uow)["consistent"] is True
+
+
+def _order_fixture(uow):
+    MessageBus.handle(events.BatchCreated(ref="lamps", sku="ORDERED-LAMP", qty=10, eta=None), uow=uow)
+    MessageBus.handle(events.BatchCreated(ref="sofas", sku="ORDERED-SOFA", qty=1, eta=None), uow=uow)
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_allocate_order_best_effort_keeps_lines_that_fit(make_fake_uow):
+    uow = make_fake_uow
+    _order_fixture(uow)
+    event = events.OrderAllocationRequired(orderId="o1", lines={"ORDERED-LAMP": 3, "ORDERED-SOFA": 2, "UNKNOWN": 1})
+    results = MessageBus.handle(event, uow=uow)[0]
+    assert [(r["sku"], r["batchref"], r["error"]) for r in results] == [
+        ("ORDERED-LAMP", "lamps", None),
+        ("ORDERED-SOFA", None, "Out of stock for sku ORDERED-SOFA"),
+        ("UNKNOWN", None, "Invalid sku UNKNOWN"),
+    ]
+    assert uow.committed
+    assert uow.products.get("ORDERED-LAMP").get_batch("lamps").available_quantity == 7
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_allocate_order_all_or_nothing_allocates_nothing_if_a_line_fails(make_fake_uow):
+    uow = make_fake_uow
+    _order_fixture(uow)
+    uow.committed = False
+    event = events.OrderAllocationRequired(orderId="o1", lines={"ORDERED-LAMP": 3, "ORDERED-SOFA": 2}, all_or_nothing=True)
+    results = MessageBus.handle(event, uow=uow)[0]
+    assert [r["batchref"] for r in results] == [None, None]
+    assert results[0]["error"] == "Not allocated: another line of the order failed"
+    assert not uow.committed
+    assert uow.products.get("ORDERED-LAMP").get_batch("lamps").available_quantity == 10
+
+    event = events.OrderAllocationRequired(orderId="o1", lines={"ORDERED-LAMP": 3, "ORDERED-SOFA": 1}, all_or_nothing=True)
+    results = MessageBus.handle(event, uow=uow)[0]
+    assert [r["batchref"] for r in results] == ["lamps", "sofas"]
+    assert uow.committed
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_allocate_order_loads_products_in_one_call(make_fake_uow):
+    uow = make_fake_uow
+    _order_fixture(uow)
+    with mock.patch.object(uow.products, "get", side_effect=AssertionError("loaded one by one")):
+        with mock.patch.object(uow.products, "get_many", wraps=uow.products.get_many) as get_many:
+            handlers.allocate_order(events.OrderAllocationRequired(orderId="o1", lines={"ORDERED-LAMP": 1, "ORDERED-SOFA": 1}), uow=uow)
+    get_many.assert_called_once()
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_list_products_pages_by_sku(make_fake_uow):
+    uow = make_fake_uow
+    for sku in ("PAGED-C", "PAGED-A", "PAGED-B"):
+        MessageBus.handle(events.BatchCreated(ref=f"b-{sku}", sku=sku, qty=1, eta=None), uow=uow)
+    first = handlers.list_products(uow=uow, limit=2)
+    assert [item["sku"] for item in first["items"]] == ["PAGED-A", "PAGED-B"]
+    assert first["next"] == "PAGED-B"
+    last = handlers.list_products(uow=uow, after=first["next"], limit=2)
+    assert last == {"items": [{"sku": "PAGED-C", "version": 1}], "next": None}
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_list_batches_reports_available_quantity(make_fake_uow):
+    uow = make_fake_uow
+    MessageBus.handle(events.BatchCreated(ref="b2", sku="PAGED-LAMP", qty=5, eta=date(2026, 3, 1)), uow=uow)
+    MessageBus.handle(events.BatchCreated(ref="b1", sku="PAGED-LAMP", qty=5, eta=None), uow=uow)
+    MessageBus.handle(events.AllocationRequired(orderId="o1", sku="PAGED-LAMP", qty=2), uow=uow)
+    page = handlers.list_batches(sku="PAGED-LAMP", uow=uow, limit=1)
+    assert page == {
+        "items": [{"reference": "b1", "sku": "PAGED-LAMP", "eta": None, "qty": 5, "allocated": 2, "available": 3}],
+        "next": "b1",
+    }
+    assert handlers.list_batches(sku="PAGED-LAMP", uow=uow, after="b1")["items"][0]["eta"] == "2026-03-01"
+    with pytest.raises(InvalidSku):
+        handlers.list_batches(sku="NO-SUCH-SKU", uow=uow)
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_bulk_deletes_keep_availability_consistent(make_fake_uow):
+    uow = make_fake_uow
+    for sku in ("SEASONAL-LAMP", "SEASONAL-SOFA"):
+        MessageBus.handle(events.BatchCreated(f"{sku}-1", sku, 10, None), uow)
+        MessageBus.handle(events.BatchCreated(f"{sku}-2", sku, 10, date(2026, 3, 1)), uow)
+        MessageBus.handle(events.AllocationRequired(f"o-{sku}", sku, 4), uow)
+
+    assert handlers.delete_batches(references=["SEASONAL-LAMP-1", "SEASONAL-SOFA-2", "unknown"], uow=uow) == 2
+    MessageBus.handle_new_events(uow=uow)
+    assert handlers.check_availability(sku="SEASONAL-LAMP", uow=uow)["consistent"] is True
+    assert handlers.get_availability(sku="SEASONAL-LAMP", uow=uow)["total"] == 10
+
+    assert handlers.delete_products(skus=["SEASONAL-SOFA"], uow=uow) == 1
+    MessageBus.handle_new_events(uow=uow)
+    assert handlers.get_availability(sku="SEASONAL-SOFA", uow=uow)["total"] == 0
+    assert any(isinstance(e, events.Deallocated) and e.orderId == "o-SEASONAL-SOFA" for e in uow.events_published)
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_compacting_duplicate_order_lines_gives_their_quantity_back(make_fake_uow):
+    uow = make_fake_uow
+    MessageBus.handle(events.BatchCreated("LEGACY-1", "LEGACY-LAMP", 10, None), uow)
+    MessageBus.handle(events.BatchCreated("LEGACY-2", "LEGACY-LAMP", 10, date(2026, 3, 1)), uow)
+    MessageBus.handle(events.AllocationRequired("o1", "LEGACY-LAMP", 4), uow)
+    # A second allocation of the same line, as older releases could store.
+    with uow:
+        product = uow.products.get("LEGACY-LAMP")
+        product.get_batch("LEGACY-2")._allocations.add(OrderLine("o1", "LEGACY-LAMP", 4))
+        uow.availability.adjust("LEGACY-LAMP", date(2026, 3, 1), -4)
+        uow.commit()
+
+    assert handlers.compact_order_lines(uow=uow) == {"orphans": 0, "duplicates": 1}
+    MessageBus.handle_new_events(uow=uow)
+    assert handlers.get_availability(sku="LEGACY-LAMP", uow=uow)["total"] == 16
+    assert handlers.check_availability(sku="LEGACY-LAMP", uow=uow)["consistent"] is True
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_archiving_closed_batches_keeps_availability_and_history(make_fake_uow):
+    uow = make_fake_uow
+    MessageBus.handle(events.BatchCreated("ARCHIVE-1", "ARCHIVED-SOFA", 5, None), uow)
+    MessageBus.handle(events.BatchCreated("ARCHIVE-2", "ARCHIVED-SOFA", 5, date(2026, 3, 1)), uow)
+    MessageBus.handle(events.AllocationRequired("o1", "ARCHIVED-SOFA", 5), uow)
+    before = handlers.get_availability(sku="ARCHIVED-SOFA", uow=uow)
+
+    assert handlers.archive_batches(before=date(2026, 1, 1), uow=uow) == 1
+    assert handlers.archive_batches(before=date(2026, 1, 1), uow=uow) == 0
+
+    assert [item["reference"] for item in handlers.list_batches(sku="ARCHIVED-SOFA", uow=uow)["items"]] == ["ARCHIVE-2"]
+    history = handlers.list_batches(sku="ARCHIVED-SOFA", uow=uow, archived=True)["items"]
+    assert [(item["reference"], item["available"]) for item in history] == [("ARCHIVE-1", 0)]
+    assert handlers.get_availability(sku="ARCHIVED-SOFA", uow=uow) == before
+    assert handlers.check_availability(sku="ARCHIVED-SOFA", uow=uow)["consistent"] is True
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_redelivered_allocations_of_archived_lines_are_not_allocated_again(make_fake_uow):
+    uow = make_fake_uow
+    MessageBus.handle(events.BatchCreated("ARCHIVE-1", "ARCHIVED-DESK", 5, None), uow)
+    MessageBus.handle(events.BatchCreated("ARCHIVE-2", "ARCHIVED-DESK", 5, date(2026, 3, 1)), uow)
+    MessageBus.handle(events.AllocationRequired("o1", "ARCHIVED-DESK", 5), uow)
+    assert handlers.archive_batches(before=date(2026, 1, 1), uow=uow) == 1
+
+    assert MessageBus.handle(events.AllocationRequired("o1", "ARCHIVED-DESK", 5), uow) == ["ARCHIVE-1"]
+    assert handlers.allocate_many([events.AllocationRequired("o1", "ARCHIVED-DESK", 5)], uow=uow) == ["ARCHIVE-1"]
+    [result] = handlers.allocate_order(events.OrderAllocationRequired("o1", {"ARCHIVED-DESK": 5}, all_or_nothing=True), uow=uow)
+    assert (result["batchref"], result["error"]) == ("ARCHIVE-1", None)
+    assert handlers.get_availability(sku="ARCHIVED-DESK", uow=uow)["total"] == 5
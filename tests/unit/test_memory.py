@@ -0,0 +1,84 @@
+import threading
+
+import pytest
+
+from allocation.adapters.memory import InMemoryRepository, InMemoryStore
+from allocation.domain import events
+from allocation.domain.model import Batch, OrderLine, Product
+from allocation.service_layer import handlers
+from allocation.service_layer.messagebus import MessageBus
+from allocation.service_layer.unit_of_work import InMemoryUnitOfWork
+
+
+@pytest.mark.unit
+def test_repository_finds_products_by_sku_and_batchref_through_its_indexes():
+    store = InMemoryStore(Product(sku=f"SKU-{i}", batches=[Batch(f"b-{i}", f"SKU-{i}", 10, eta=None)]) for i in range(1000))
+    repo = InMemoryRepository(store)
+
+    assert repo.get_by_batchref("b-999") is store.products["SKU-999"]
+    repo.get("SKU-5").add_batch(Batch("b-new", "SKU-5", 3, eta=None))
+    assert repo.get_by_batchref("b-new").sku == "SKU-5"
+    repo.commit()
+    assert store.batchrefs["b-new"] == "SKU-5"
+    assert repo.page_products(after="SKU-997", limit=5) == [("SKU-998", 0), ("SKU-999", 0)]
+
+
+@pytest.mark.unit
+@pytest.mark.uow
+def test_rollback_restores_uncommitted_changes_in_the_same_objects():
+    product = Product(sku="MEM-LAMP", batches=[Batch("b1", "MEM-LAMP", 10, eta=None)])
+    uow = InMemoryUnitOfWork(InMemoryStore([product]))
+    batch = product.batches[0]
+
+    with uow:
+        uow.products.get("MEM-LAMP").allocate(OrderLine("o1", "MEM-LAMP", 2))
+        # Committing applies the Allocated event to the availability summary.
+        uow.commit()
+    with uow:
+        held = uow.products.get("MEM-LAMP")
+        held.allocate(OrderLine("o2", "MEM-LAMP", 3))
+        held.delete_batch("b1")
+        uow.products.add(Product(sku="MEM-SOFA"))
+        uow.availability.adjust("MEM-LAMP", None, -3)
+
+    assert uow.store.products == {"MEM-LAMP": product}
+    assert product.batches == [batch] and {line.orderId for line in batch._allocations} == {"o1"}
+    assert uow.availability.get("MEM-LAMP") == {None: -2}
+    with uow:
+        assert uow.products.get_by_batchref("b1") is product
+
+
+@pytest.mark.unit
+@pytest.mark.uow
+def test_snapshot_restores_the_store_as_it_was():
+    uow = InMemoryUnitOfWork()
+    MessageBus.handle(events.BatchCreated(ref="b1", sku="MEM-CHAIR", qty=5, eta=None), uow=uow)
+    snapshot = uow.snapshot()
+
+    MessageBus.handle(events.AllocationRequired(orderId="o1", sku="MEM-CHAIR", qty=5), uow=uow)
+    uow.restore(snapshot)
+    assert handlers.get_availability(sku="MEM-CHAIR", uow=uow)["in_stock"] == 5
+    assert MessageBus.handle(events.AllocationRequired(orderId="o2", sku="MEM-CHAIR", qty=5), uow=uow) == ["b1"]
+    # The snapshot itself is left untouched, so it can be restored again.
+    assert snapshot.products["MEM-CHAIR"].batches[0].available_quantity == 5
+
+
+@pytest.mark.unit
+@pytest.mark.uow
+def test_units_of_work_run_one_at_a_time_across_threads():
+    uow = InMemoryUnitOfWork()
+    MessageBus.handle(events.BatchCreated(ref="b1", sku="MEM-MUG", qty=50, eta=None), uow=uow)
+    barrier = threading.Barrier(10)
+
+    def allocate(worker: int):
+        barrier.wait()
+        for i in range(5):
+            MessageBus.handle(events.AllocationRequired(orderId=f"o-{worker}-{i}", sku="MEM-MUG", qty=1), uow=uow)
+
+    threads = [threading.Thread(target=allocate, args=(worker,)) for worker in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert uow.store.products["MEM-MUG"].batches[0].available_quantity == 0
+    assert uow.availability.get("MEM-MUG") == {None: 0}
@@ -141,3 +141,86 @@ def test_records_out_of_stock_event_if_cannot_allocate():
     allocation = product.allocate(sku2_line)
     assert product.events[-1] == events.OutOfStock(sku="sku2")
     assert allocation is None
+
+
+@pytest.mark.unit
+def test_every_state_change_increments_version_number():
+    product = Product(sku="VERSIONED-LAMP", batches=[])
+    product.add_batch(Batch("b1", "VERSIONED-LAMP", 100, eta=None))
+    assert product.version_number == 1
+    line = OrderLine("oref", "VERSIONED-LAMP", 10)
+    product.allocate(line)
+    assert product.version_number == 2
+    product.deallocate(line)
+    assert product.version_number == 3
+    product.change_batch_quantity("b1", 50)
+    assert product.version_number == 4
+    product.delete_batch("b1")
+    assert product.version_number == 5
+
+
+@pytest.mark.unit
+def test_records_allocation_and_deallocation_events():
+    batch = Batch("b1", "EVENTFUL-LAMP", 100, eta=tomorrow)
+    product = Product(sku="EVENTFUL-LAMP", batches=[batch])
+    line = OrderLine("oref", "EVENTFUL-LAMP", 10)
+    product.allocate(line)
+    product.allocate(line)
+    product.deallocate(line)
+    assert product.events == [
+        events.Allocated(orderId="oref", sku="EVENTFUL-LAMP", qty=10, batchref="b1", eta=tomorrow),
+        events.Deallocated(orderId="oref", sku="EVENTFUL-LAMP", qty=10, batchref="b1", eta=tomorrow),
+    ]
+
+
+@pytest.mark.unit
+def test_allocating_an_already_allocated_line_returns_its_batch():
+    early = Batch("early", "STICKY-LAMP", 5, eta=None)
+    late = Batch("late", "STICKY-LAMP", 100, eta=tomorrow)
+    product = Product(sku="STICKY-LAMP", batches=[early, late])
+    line = OrderLine("oref", "STICKY-LAMP", 10)
+    assert product.allocate(line) is late
+    early._purchase_quantity = 50
+    assert product.allocate(line) is late
+    assert early.available_quantity == 50
+
+
+@pytest.mark.unit
+def test_deleting_a_batch_records_lost_allocations():
+    batch = Batch("b1", "DOOMED-LAMP", 100, eta=None)
+    product = Product(sku="DOOMED-LAMP", batches=[batch])
+    product.allocate(OrderLine("o1", "DOOMED-LAMP", 10))
+    product.events.clear()
+    product.delete_batch("b1")
+    assert product.events == [
+        events.Deallocated(orderId="o1", sku="DOOMED-LAMP", qty=10, batchref="b1", eta=None),
+        events.BatchDeleted(ref="b1", sku="DOOMED-LAMP", eta=None, qty=100),
+    ]
+
+
+@pytest.mark.unit
+def test_can_allocate_does_not_change_the_product():
+    product = Product(sku="CHECKED-LAMP", batches=[Batch(ref="b1", sku="CHECKED-LAMP", qty=5, eta=None)])
+    assert product.can_allocate(OrderLine(orderId="o1", sku="CHECKED-LAMP", qty=5))
+    assert not product.can_allocate(OrderLine(orderId="o1", sku="CHECKED-LAMP", qty=6))
+    assert product.version_number == 0 and product.events == []
+
+    product.allocate(OrderLine(orderId="o1", sku="CHECKED-LAMP", qty=5))
+    assert product.can_allocate(OrderLine(orderId="o1", sku="CHECKED-LAMP", qty=5))
+
+
+@pytest.mark.unit
+def test_batch_versioning_bumps_only_the_batch_that_loses_room():
+    early, late = Batch("early", "BATCHED-LAMP", 10, eta=None), Batch("late", "BATCHED-LAMP", 100, eta=tomorrow)
+    product = Product(sku="BATCHED-LAMP", batches=[early, late], version_number=3)
+    product.batch_versioning = True
+
+    line = OrderLine("o1", "BATCHED-LAMP", 50)
+    product.allocate(line)
+    product.change_batch_quantity("early", 5)
+    assert (product.version_number, early.version_number, late.version_number) == (3, 1, 1)
+
+    # Giving a batch more room could make an allocation that skipped it concurrently no longer first-fit.
+    product.change_batch_quantity("early", 20)
+    product.deallocate(line)
+    assert (product.version_number, early.version_number, late.version_number) == (5, 1, 1)
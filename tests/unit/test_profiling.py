@@ -0,0 +1,96 @@
+import contextvars
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from allocation.adapters import profiling
+from allocation.entrypoints.middleware import ProfilingMiddleware
+
+
+def busy() -> int:
+    return sum(range(1000))
+
+
+@pytest.fixture
+def profiling_enabled(monkeypatch):
+    monkeypatch.setenv("PROFILING_ENABLED", "1")
+
+
+@pytest.mark.unit
+def test_profiled_returns_the_function_itself_when_disabled(monkeypatch):
+    monkeypatch.delenv("PROFILING_ENABLED", raising=False)
+    assert profiling.profiled(busy) is busy
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("profiling_enabled")
+def test_profiled_functions_only_profile_requests_that_asked_for_it():
+    wrapped = profiling.profiled(busy)
+    profiling._current.set(None)
+    assert wrapped() == busy()
+
+    request = profiling.start()
+    try:
+        assert wrapped() == busy()
+    finally:
+        profiling._current.set(None)
+    assert request.calls == 1
+    assert "busy" in request.report()
+
+
+def _profiled_app(tmp_path) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware, secret="s3cret", directory=str(tmp_path))
+    profiled_busy = profiling.profiled(busy)
+
+    @app.get("/busy", status_code=202)
+    def endpoint():
+        return {"total": profiled_busy()}
+
+    return app
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("profiling_enabled")
+def test_profile_is_written_to_the_directory(tmp_path):
+    client = TestClient(_profiled_app(tmp_path))
+    assert "X-Profile-Path" not in client.get("/busy", headers={"X-Profile": "wrong"}).headers
+
+    r = client.get("/busy", headers={"X-Profile": "s3cret"})
+    assert r.status_code == 202
+    assert r.json() == {"total": busy()}
+    assert [str(path) for path in tmp_path.iterdir()] == [r.headers["X-Profile-Path"]]
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("profiling_enabled")
+def test_profile_can_be_returned_inline(tmp_path):
+    r = TestClient(_profiled_app(tmp_path)).get("/busy", headers={"X-Profile": "s3cret", "X-Profile-Output": "inline"})
+    assert r.status_code == 200
+    assert r.headers["X-Profiled-Status"] == "202"
+    assert "function calls" in r.text
+    assert not list(tmp_path.iterdir())
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("profiling_enabled")
+def test_calls_made_while_another_request_is_profiled_are_skipped():
+    wrapped = profiling.profiled(busy)
+    outer = profiling.start()
+    request = profiling.ProfiledRequest()
+
+    def profile_concurrently() -> int:
+        profiling._current.set(request)
+        return wrapped()
+
+    def run_other_request() -> int:
+        # Stands in for a request in another worker thread while this one is being profiled.
+        return contextvars.copy_context().run(profile_concurrently)
+
+    try:
+        assert profiling.profiled(run_other_request)() == busy()
+    finally:
+        profiling._current.set(None)
+    assert (outer.calls, request.calls, request.skipped) == (1, 0, 1)
+    assert not profiling._active.locked()
@@ -0,0 +1,95 @@
+import io
+from datetime import date
+
+import pytest
+
+from allocation.adapters import ndjson
+from allocation.domain import events
+from allocation.entrypoints import cli
+from allocation.service_layer import replay
+
+EVENT_STREAM = """\
+{"type": "BatchCreated", "ref": "b1", "sku": "REPLAYED-LAMP", "qty": 10, "eta": null}
+{"type": "BatchCreated", "ref": "b2", "sku": "REPLAYED-LAMP", "qty": 10, "eta": "2026-03-01"}
+
+{"type": "AllocationRequired", "orderId": "o1", "sku": "REPLAYED-LAMP", "qty": 8}
+{"type": "AllocationRequired", "orderId": "o2", "sku": "UNKNOWN-SKU", "qty": 1}
+{"type": "Teleported", "sku": "REPLAYED-LAMP"}
+not json at all
+[]
+1
+{"type": "AllocationRequired", "orderId": "o3", "sku": "REPLAYED-LAMP", "qty": "10"}
+{"type": "BatchQuantityChanged", "ref": "b1", "qty": 5}
+"""
+
+
+@pytest.mark.unit
+def test_ndjson_round_trip():
+    event = events.BatchCreated(ref="b1", sku="ROUND-TRIP", qty=3, eta=date(2026, 3, 1))
+    assert ndjson.decode_event(ndjson.encode_event(event)) == event
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "line",
+    [
+        "[]",
+        "1",
+        '{"type": ["BatchCreated"]}',
+        '{"type": "AllocationRequired", "orderId": "o1", "sku": "LAMP", "qty": "10"}',
+        '{"type": "AllocationRequired", "orderId": "o1", "sku": "LAMP", "qty": true}',
+        '{"type": "AllocationRequired", "orderId": "o1", "sku": "LAMP", "qty": 1, "colour": "red"}',
+        '{"type": "AllocationRequired", "orderId": "o1", "sku": "LAMP"}',
+        '{"type": "BatchCreated", "ref": "b1", "sku": "LAMP", "qty": 1, "eta": 20260301}',
+    ],
+)
+def test_ndjson_rejects_malformed_records(line):
+    with pytest.raises((ValueError, TypeError)):
+        ndjson.decode_event(line)
+
+
+@pytest.mark.unit
+def test_chunked_is_lazy_and_bounded():
+    def endless():
+        n = 0
+        while True:
+            yield n
+            n += 1
+
+    chunks = replay.chunked(endless(), 3)
+    assert next(chunks) == [0, 1, 2]
+    assert next(chunks) == [3, 4, 5]
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_replay_feeds_events_through_messagebus(make_fake_uow):
+    uow = make_fake_uow
+    progress = []
+    report = replay.replay(io.StringIO(EVENT_STREAM), uow=uow, chunk_size=2, on_progress=lambda r: progress.append(r.events))
+
+    assert report.events == 5
+    assert report.failed == 6
+    assert progress == [2, 4, 5]
+    [batch1, batch2] = uow.products.get(sku="REPLAYED-LAMP").batches
+    assert batch1._purchase_quantity == 5
+    # o1 was deallocated from b1 when its quantity dropped and reallocated to b2
+    assert batch1.available_quantity == 5
+    assert batch2.available_quantity == 2
+    assert report.as_dict()["events_per_s"] > 0
+
+
+@pytest.mark.unit
+def test_cli_parses_replay_arguments():
+    args = cli.build_parser().parse_args(["replay", "-", "--chunk-size", "10"])
+    assert args.path == "-"
+    assert args.chunk_size == 10
+    assert args.func is cli.replay_command
+
+
+@pytest.mark.unit
+def test_replay_rejects_empty_chunks(make_fake_uow):
+    with pytest.raises(ValueError):
+        replay.replay(io.StringIO(EVENT_STREAM), uow=make_fake_uow, chunk_size=0)
+    with pytest.raises(SystemExit):
+        cli.build_parser().parse_args(["replay", "-", "--chunk-size", "0"])
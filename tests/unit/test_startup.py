@@ -0,0 +1,37 @@
+import os
+import pathlib
+import subprocess
+import sys
+
+import pytest
+
+import allocation
+from allocation.adapters import orm
+from allocation.domain.model import Product
+
+IMPORT_SIDE_EFFECTS = """
+import sys
+import allocation.entrypoints.cli
+import allocation.entrypoints.main
+from sqlalchemy import inspect
+from allocation.domain.model import Product
+from allocation.service_layer import unit_of_work
+print(inspect(Product, raiseerr=False) is None, unit_of_work._session_factory is None, "dotenv" in sys.modules)
+"""
+
+
+@pytest.mark.unit
+def test_importing_entrypoints_builds_no_engine_and_maps_nothing():
+    env = {**os.environ, "PYTHONPATH": str(pathlib.Path(allocation.__file__).parent.parent)}
+    completed = subprocess.run([sys.executable, "-c", IMPORT_SIDE_EFFECTS], env=env, capture_output=True, text=True, check=True)
+    assert completed.stdout.split() == ["True", "True", "False"]
+
+
+@pytest.mark.unit
+def test_start_mappers_is_idempotent(session_factory):
+    orm.start_mappers()
+    orm.start_mappers()
+    session = session_factory()
+    session.add(Product(sku="IDEMPOTENT-LAMP", batches=[]))
+    session.commit()
+    assert [p.sku for p in session.query(Product)] == ["IDEMPOTENT-LAMP"]
@@ -0,0 +1,64 @@
+import logging
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from allocation.adapters import timing
+from allocation.entrypoints.middleware import TimingMiddleware
+
+
+@pytest.fixture(autouse=True)
+def no_request_timings():
+    yield
+    timing._current.set(None)
+
+
+@pytest.mark.unit
+def test_nested_phases_are_counted_exclusively():
+    timings = timing.start()
+    with timing.phase("handler"):
+        time.sleep(0.01)
+        with timing.phase("commit"):
+            time.sleep(0.02)
+    assert 0.02 <= timings.phases["commit"]
+    assert 0.01 <= timings.phases["handler"] < 0.02
+    assert timings.breakdown()["total"] >= sum(timings.phases.values()) * 1000
+
+
+@pytest.mark.unit
+def test_phase_is_a_no_op_outside_of_a_request():
+    with timing.phase("load"):
+        pass
+    assert timing.current() is None
+
+
+def _timed_app(**middleware_kwargs) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(TimingMiddleware, **middleware_kwargs)
+
+    @app.get("/slow")
+    def slow():
+        with timing.phase("load"):
+            time.sleep(0.01)
+        return {}
+
+    return app
+
+
+@pytest.mark.unit
+def test_middleware_sends_server_timing_header():
+    r = TestClient(_timed_app(slow_threshold=0)).get("/slow")
+    phases = {item.split(";")[0]: item.rpartition(";dur=")[2] for item in r.headers["Server-Timing"].split(", ")}
+    assert list(phases) == ["load", "other", "total", "sql"]
+    assert float(phases["load"]) >= 10
+
+
+@pytest.mark.unit
+def test_middleware_logs_requests_above_threshold(caplog):
+    with caplog.at_level(logging.WARNING, logger="allocation.slow_requests"):
+        TestClient(_timed_app(slow_threshold=0.005)).get("/slow")
+        TestClient(_timed_app(slow_threshold=10)).get("/slow")
+    assert len(caplog.records) == 1
+    assert '"path": "/slow"' in caplog.records[0].getMessage()
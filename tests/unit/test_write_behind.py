@@ -0,0 +1,210 @@
+import threading
+
+import pytest
+
+from allocation.adapters.journal import Journal
+from allocation.domain import events
+from allocation.domain.exceptions import UnsupportedOperation
+from allocation.domain.model import Batch, OrderLine, Product
+from allocation.entrypoints import main
+from allocation.service_layer import handlers, replay
+from allocation.service_layer.messagebus import MessageBus
+from allocation.service_layer.write_behind import WriteBehind, apply_record
+
+
+def _write_behind(tmp_path, database_uow, *products: Product) -> WriteBehind:
+    for product in products:
+        database_uow.products.add(product)
+    write_behind = WriteBehind([product.sku for product in products], journal=Journal(str(tmp_path / "journal")), uow=database_uow)
+    write_behind.recover()
+    return write_behind
+
+
+@pytest.mark.unit
+def test_journal_reads_back_appended_records_until_discarded(tmp_path):
+    journal = Journal(str(tmp_path / "journal"))
+    allocated = events.Allocated(orderId="o1", sku="LAMP", qty=1, batchref="b1", eta=None)
+    created = events.BatchCreated(ref="b2", sku="LAMP", qty=5, eta=None)
+    assert journal.append([("LAMP", allocated), ("LAMP", created)]) == [1, 2]
+
+    assert list(journal.read()) == [(1, "LAMP", allocated), (2, "LAMP", created)]
+    journal.discard_through(1)
+    assert list(Journal(journal.path).read()) == [(2, "LAMP", created)]
+
+
+@pytest.mark.unit
+def test_journal_appends_carry_on_and_are_kept_while_records_are_discarded(tmp_path, monkeypatch):
+    journal = Journal(str(tmp_path / "journal"))
+    old, kept, late = (events.BatchQuantityChanged(ref="b1", qty=qty) for qty in (5, 6, 7))
+    journal.append([("LAMP", old), ("LAMP", kept)])
+    write_tmp = Journal._write_tmp
+
+    def append_while_copying(self, lines):
+        appender = threading.Thread(target=journal.append, args=([("LAMP", late)],))
+        appender.start()
+        appender.join(timeout=5)
+        assert not appender.is_alive(), "append blocked by discard_through"
+        return write_tmp(self, lines)
+
+    monkeypatch.setattr(Journal, "_write_tmp", append_while_copying)
+    journal.discard_through(1)
+
+    assert list(journal.read()) == [(2, "LAMP", kept), (3, "LAMP", late)]
+    assert journal.append([("LAMP", old)]) == [4]
+    assert [seq for seq, _, _ in Journal(journal.path).read()] == [2, 3, 4]
+
+
+@pytest.mark.unit
+def test_journal_cuts_off_a_record_torn_by_a_crash(tmp_path):
+    path = str(tmp_path / "journal")
+    Journal(path).append([("LAMP", events.BatchQuantityChanged(ref="b1", qty=5))])
+    with open(path, "ab") as f:
+        f.write(b'2\tLAMP\t{"type": "Alloc')
+
+    journal = Journal(path)
+    assert journal.append([("LAMP", events.BatchQuantityChanged(ref="b1", qty=7))]) == [2]
+    assert [record.qty for _, _, record in journal.read()] == [5, 7]
+
+
+@pytest.mark.unit
+def test_apply_record_applies_each_record_once():
+    product = Product(sku="LAMP", batches=[Batch("b1", "LAMP", 10, eta=None)])
+    records = [
+        events.BatchCreated(ref="b2", sku="LAMP", qty=5, eta=None),
+        events.Allocated(orderId="o1", sku="LAMP", qty=3, batchref="b1", eta=None),
+        events.Deallocated(orderId="o1", sku="LAMP", qty=3, batchref="b1", eta=None),
+        events.Allocated(orderId="o1", sku="LAMP", qty=3, batchref="b2", eta=None),
+        events.BatchQuantityChanged(ref="b1", qty=4),
+    ]
+    assert [apply_record(product, record) for record in records] == [(None, 5), (None, -3), (None, 3), (None, -3), (None, -6)]
+
+    assert [apply_record(product, record) for record in records] == [None] * len(records)
+    assert [(b.reference, b._purchase_quantity, b.allocated_quantity) for b in product.batches] == [("b1", 4, 0), ("b2", 5, 3)]
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_allocations_are_journaled_then_stored_by_the_writer(tmp_path, make_fake_uow):
+    database = make_fake_uow
+    write_behind = _write_behind(tmp_path, database, Product(sku="FLASH-LAMP", batches=[Batch("b1", "FLASH-LAMP", 10, eta=None)]))
+
+    assert MessageBus.handle(events.AllocationRequired(orderId="o1", sku="FLASH-LAMP", qty=4), uow=write_behind.uow) == ["b1"]
+    assert [record for _, _, record in write_behind.journal.read()] == [
+        events.Allocated(orderId="o1", sku="FLASH-LAMP", qty=4, batchref="b1", eta=None)
+    ]
+    assert handlers.get_availability(sku="FLASH-LAMP", uow=write_behind.uow)["in_stock"] == 6
+    assert database.products.get("FLASH-LAMP").batches[0].allocated_quantity == 0
+
+    assert write_behind.writer.drain() == 1
+    assert database.products.get("FLASH-LAMP").batches[0].allocated_quantity == 4
+    assert database.availability.get("FLASH-LAMP") == {None: -4}
+    assert list(write_behind.journal.read()) == []
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_batches_of_new_write_behind_products_are_journaled(tmp_path, make_fake_uow):
+    write_behind = WriteBehind(["NEW-SOFA"], journal=Journal(str(tmp_path / "journal")), uow=make_fake_uow)
+    write_behind.recover()
+
+    MessageBus.handle(events.BatchCreated(ref="b1", sku="NEW-SOFA", qty=3, eta=None), uow=write_behind.uow)
+    handlers.allocate(events.AllocationRequired(orderId="o1", sku="NEW-SOFA", qty=1), uow=write_behind.uow)
+
+    assert [type(record).__name__ for _, _, record in write_behind.journal.read()] == ["BatchCreated", "Allocated"]
+    assert write_behind.owns_batch("b1")
+    write_behind.writer.drain()
+    assert make_fake_uow.products.get("NEW-SOFA").batches[0].allocated_quantity == 1
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_rollback_undoes_uncommitted_changes_and_unlocks_the_sku(tmp_path, make_fake_uow):
+    product = Product(sku="FLASH-CHAIR", batches=[Batch("b1", "FLASH-CHAIR", 10, eta=None)])
+    product.batches[0].allocate(OrderLine("kept", "FLASH-CHAIR", 2))
+    write_behind = _write_behind(tmp_path, make_fake_uow, product)
+    uow = write_behind.uow
+
+    with uow:
+        held = uow.products.get("FLASH-CHAIR")
+        held.allocate(OrderLine("o1", "FLASH-CHAIR", 3))
+        held.deallocate(OrderLine("kept", "FLASH-CHAIR", 2))
+        held.change_batch_quantity("b1", 1)
+        held.add_batch(Batch("b2", "FLASH-CHAIR", 5, eta=None))
+        assert not _acquire_from_another_thread(write_behind.store.locks["FLASH-CHAIR"])
+
+    held = write_behind.store.products["FLASH-CHAIR"]
+    assert [(b.reference, b._purchase_quantity) for b in held.batches] == [("b1", 10)]
+    assert {line.orderId for line in held.batches[0]._allocations} == {"kept"}
+    assert held.events == []
+    assert list(write_behind.journal.read()) == []
+    assert _acquire_from_another_thread(write_behind.store.locks["FLASH-CHAIR"])
+
+
+def _acquire_from_another_thread(lock) -> bool:
+    acquired = []
+
+    def probe():
+        if lock.acquire(timeout=0):
+            acquired.append(True)
+            lock.release()
+
+    thread = threading.Thread(target=probe)
+    thread.start()
+    thread.join()
+    return bool(acquired)
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_recovery_replays_the_journal_over_the_database_state(tmp_path, make_fake_uow):
+    journal = Journal(str(tmp_path / "journal"))
+    journal.append(
+        [
+            ("FLASH-MUG", events.Allocated(orderId="o1", sku="FLASH-MUG", qty=2, batchref="b1", eta=None)),
+            ("FLASH-MUG", events.Allocated(orderId="o2", sku="FLASH-MUG", qty=5, batchref="b1", eta=None)),
+        ]
+    )
+    journal.close()
+    # The first record was stored before the crash, the second was not.
+    stored = Product(sku="FLASH-MUG", batches=[Batch("b1", "FLASH-MUG", 10, eta=None)])
+    stored.batches[0].allocate(OrderLine("o1", "FLASH-MUG", 2))
+    make_fake_uow.products.add(stored)
+
+    write_behind = WriteBehind(["FLASH-MUG"], journal=Journal(journal.path), uow=make_fake_uow)
+    assert write_behind.recover() == 2
+
+    assert write_behind.store.products["FLASH-MUG"].batches[0].allocated_quantity == 7
+    assert write_behind.store.availability["FLASH-MUG"] == {None: 3}
+    assert write_behind.writer.drain() == 2
+    assert stored.batches[0].allocated_quantity == 7
+
+
+@pytest.mark.unit
+@pytest.mark.service
+def test_replay_sends_write_behind_skus_to_memory(tmp_path, make_fake_uow, monkeypatch):
+    database = make_fake_uow
+    write_behind = _write_behind(tmp_path, database, Product(sku="FLASH-DESK", batches=[Batch("b1", "FLASH-DESK", 10, eta=None)]))
+    monkeypatch.setattr(main, "uow", database)
+    monkeypatch.setattr(main, "write_behind", write_behind)
+    stream = [
+        '{"type": "AllocationRequired", "orderId": "o1", "sku": "FLASH-DESK", "qty": 4}',
+        '{"type": "BatchQuantityChanged", "ref": "b1", "qty": 8}',
+        '{"type": "BatchCreated", "ref": "b2", "sku": "COLD-DESK", "qty": 3, "eta": null}',
+    ]
+
+    report = replay.ReplayReport()
+    main._replay_lines(stream, report)
+    assert (report.events, report.failed) == (3, 0)
+    assert [type(record).__name__ for _, _, record in write_behind.journal.read()] == ["Allocated", "BatchQuantityChanged"]
+    assert write_behind.store.products["FLASH-DESK"].batches[0].available_quantity == 4
+    assert database.products.get("FLASH-DESK").batches[0].available_quantity == 10
+    assert database.products.get("COLD-DESK") is not None
+
+
+@pytest.mark.unit
+def test_write_behind_products_refuse_set_based_maintenance(tmp_path, make_fake_uow):
+    write_behind = _write_behind(tmp_path, make_fake_uow, Product(sku="FLASH-RUG", batches=[]))
+    with pytest.raises(UnsupportedOperation):
+        handlers.delete_products(skus=["FLASH-RUG"], uow=write_behind.uow)
+    with pytest.raises(UnsupportedOperation):
+        handlers.list_batches(sku="FLASH-RUG", uow=write_behind.uow, archived=True)